@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输入操作队列
+功能：检测和发送解耦。检测线程只把回复意图放入有界队列，由专门的执行线程按顺序完成点击，
+      多个聊天同时需要回复时点击不会交错；同一个聊天的回复意图按合并策略合并
+      （一轮消息只回复一次，或每分钟最多回复N次）
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, Hashable, Dict
+
+
+class ReplyIntent:
+    """一个待执行的回复"""
+    __slots__ = ('key', 'action', 'created_at', 'merged')
+
+    def __init__(self, key: Hashable, action: Callable[[], bool]):
+        self.key = key
+        self.action = action
+        self.created_at = time.time()
+        self.merged = 0  # 合并进来的后续检测次数
+
+
+class CoalescingPolicy:
+    """回复意图的合并策略基类"""
+
+    name = "base"
+
+    def admit(self, key: Hashable, now: float, has_pending: bool) -> bool:
+        """是否接受这个聊天的新回复意图（返回False表示合并到已有的意图或丢弃）"""
+        return not has_pending
+
+    def on_executed(self, key: Hashable, now: float):
+        """一个回复执行完成"""
+        pass
+
+    def describe(self) -> str:
+        return self.name
+
+
+class OnePerBurstPolicy(CoalescingPolicy):
+    """一轮消息只回复一次
+
+    某个聊天已有待执行或正在执行的回复时，新的检测合并进去；
+    回复完成后 quiet_period 秒内的检测也算同一轮。
+    """
+
+    name = "burst"
+
+    def __init__(self, quiet_period: float = 0.0):
+        self.quiet_period = quiet_period
+        self._last_executed: Dict[Hashable, float] = {}
+
+    def admit(self, key, now, has_pending) -> bool:
+        if has_pending:
+            return False
+        last = self._last_executed.get(key)
+        return last is None or now - last >= self.quiet_period
+
+    def on_executed(self, key, now):
+        self._last_executed[key] = now
+
+    def describe(self) -> str:
+        if self.quiet_period > 0:
+            return f"每轮消息回复一次（回复后 {self.quiet_period} 秒内算同一轮）"
+        return "每轮消息回复一次"
+
+
+class RateLimitPolicy(CoalescingPolicy):
+    """每个聊天每分钟最多回复 max_per_minute 次"""
+
+    name = "rate"
+
+    def __init__(self, max_per_minute: int = 6):
+        self.max_per_minute = max_per_minute
+        self._history: Dict[Hashable, deque] = {}
+
+    def admit(self, key, now, has_pending) -> bool:
+        if has_pending:
+            return False
+        history = self._history.get(key)
+        if history is None:
+            return True
+        while history and now - history[0] >= 60.0:
+            history.popleft()
+        return len(history) < self.max_per_minute
+
+    def on_executed(self, key, now):
+        self._history.setdefault(key, deque()).append(now)
+
+    def describe(self) -> str:
+        return f"每分钟最多回复 {self.max_per_minute} 次"
+
+
+class ActionQueue:
+    """有界的串行输入操作队列"""
+
+    def __init__(self, policy: Optional[CoalescingPolicy] = None, maxsize: int = 32):
+        self.policy = policy or OnePerBurstPolicy()
+        self.maxsize = maxsize
+        self._intents = deque()
+        self._pending: Dict[Hashable, ReplyIntent] = {}  # 排队中或正在执行的意图
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.is_running = False
+        self.executed = 0    # 已执行的操作数量
+        self.coalesced = 0   # 被合并掉的操作数量
+        self.dropped = 0     # 队列已满被丢弃的操作数量
+        self.busy = False    # 执行线程是否正在执行操作
+        self.wait_histogram = None  # 设置后记录每个操作从提交到开始执行的等待时间（metrics.Histogram）
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._worker, name='actuator', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        with self._cond:
+            self.is_running = False
+            self._intents.clear()
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, key: Hashable, action: Callable[[], bool]) -> bool:
+        """提交一个回复意图，被合并或丢弃时返回False"""
+        with self._cond:
+            now = time.time()
+            pending = self._pending.get(key)
+            if not self.policy.admit(key, now, pending is not None):
+                self.coalesced += 1
+                if pending is not None:
+                    pending.merged += 1
+                return False
+            if len(self._intents) >= self.maxsize:
+                self.dropped += 1
+                print(f"发送队列已满（{self.maxsize}），丢弃本次回复")
+                return False
+            intent = ReplyIntent(key, action)
+            self._pending[key] = intent
+            self._intents.append(intent)
+            self._cond.notify()
+        return True
+
+    def has_pending(self, key: Hashable) -> bool:
+        """某个聊天是否有排队中或正在执行的回复"""
+        with self._cond:
+            return key in self._pending
+
+    def wait_idle(self, key: Hashable, timeout: Optional[float] = None) -> bool:
+        """等待某个聊天排队中或正在执行的回复完成，超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: key not in self._pending, timeout)
+
+    @property
+    def depth(self) -> int:
+        """等待执行的操作数量"""
+        return len(self._intents)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._intents:
+                    self._cond.wait()
+                if not self.is_running:
+                    break
+                intent = self._intents.popleft()
+                self.busy = True
+            if self.wait_histogram is not None:
+                self.wait_histogram.observe(time.time() - intent.created_at)
+
+            try:
+                intent.action()
+            except Exception as e:
+                print(f"执行输入操作时出错: {e}")
+            finally:
+                with self._cond:
+                    self.busy = False
+                    if self._pending.get(intent.key) is intent:
+                        del self._pending[intent.key]
+                    self.policy.on_executed(intent.key, time.time())
+                    self.executed += 1
+                    self._cond.notify_all()
+                if intent.merged:
+                    print(f"本次回复合并了 {intent.merged} 次后续检测")
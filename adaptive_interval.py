@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应检测间隔
+功能：根据观察到的消息到达频率调整检测间隔。聊天空闲时间隔按指数退避逐步放大到上限，
+      一旦发现新消息（包括窗口标题出现未读数）立即回到最快间隔；
+      到达频率用指数衰减的滑动估计，消息密集时不会退避得太快
+"""
+
+import math
+import time
+from typing import Optional
+
+
+class AdaptiveInterval:
+    """自适应检测间隔
+
+    每次检测后调用 record()：检测到活动时间隔回到 min_interval，否则乘以 backoff，
+    但不会超过 max_interval，也不会超过按当前到达频率估计的消息间隔的一半。
+    """
+
+    def __init__(self, min_interval: float = 0.5, max_interval: float = 5.0,
+                 backoff: float = 1.5, rate_window: float = 60.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rate_window = rate_window  # 到达频率估计的时间常数（秒）
+        self.interval = min_interval
+        self.last_activity: Optional[float] = None
+        self.activity_count = 0
+        self._rate = 0.0                # 最近一次更新时的到达频率（次/秒）
+        self._rate_time: Optional[float] = None
+
+    def reset(self):
+        self.interval = self.min_interval
+        self.last_activity = None
+        self.activity_count = 0
+        self._rate = 0.0
+        self._rate_time = None
+
+    def _decayed_rate(self, now: float) -> float:
+        if self._rate_time is None:
+            return 0.0
+        elapsed = max(0.0, now - self._rate_time)
+        return self._rate * math.exp(-elapsed / self.rate_window)
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """估计的消息到达频率（次/秒）"""
+        return self._decayed_rate(time.time() if now is None else now)
+
+    def rate_per_minute(self, now: Optional[float] = None) -> float:
+        return self.rate(now) * 60.0
+
+    def on_activity(self, now: Optional[float] = None):
+        """观察到一次活动：更新到达频率并回到最快间隔"""
+        now = time.time() if now is None else now
+        self._rate = self._decayed_rate(now) + 1.0 / self.rate_window
+        self._rate_time = now
+        self.last_activity = now
+        self.activity_count += 1
+        self.interval = self.min_interval
+
+    def on_idle(self, now: Optional[float] = None):
+        """一次没有活动的检测：间隔指数退避"""
+        now = time.time() if now is None else now
+        interval = min(self.max_interval, self.interval * self.backoff)
+        rate = self._decayed_rate(now)
+        if rate > 0:
+            # 按估计频率下一条消息很快就会到来时，不要退避到错过它的程度
+            interval = min(interval, max(self.min_interval, 0.5 / rate))
+        self.interval = max(self.min_interval, interval)
+
+    def record(self, active: bool, now: Optional[float] = None) -> float:
+        """记录一次检测结果，返回下一次检测前的等待时间"""
+        if active:
+            self.on_activity(now)
+        else:
+            self.on_idle(now)
+        return self.interval
+
+    def describe(self) -> str:
+        return (f"当前 {self.interval:.2f} 秒（最快 {self.min_interval} 秒，最慢 {self.max_interval} 秒），"
+                f"消息频率约 {self.rate_per_minute():.1f} 条/分钟")
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步监控引擎
+功能：在一个 asyncio 事件循环上运行所有聊天的检测、冷却和自适应间隔的定时器、发送队列以及启动停止等控制操作。
+      每个聊天是一个协程，等待下一次检测时只占一个定时器，监控几十个聊天也不需要每个聊天一个线程；
+      UI Automation 这些阻塞的检测调用交给一个专用的执行线程按顺序执行，pyautogui 的点击交给另一个发送线程，
+      发送表情包的一两秒里其他聊天照常检测。
+      停止时直接取消所有协程，不用等待检测间隔或发送结束；冷却期结束的时刻用定时器准时检测
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Optional, Callable, Hashable, Dict, List
+
+from action_queue import ReplyIntent, CoalescingPolicy, OnePerBurstPolicy
+from adaptive_interval import AdaptiveInterval
+from chat_scheduler import ChatMonitor, ChatTarget
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class BlockingExecutor:
+    """专用的执行线程：按提交顺序执行阻塞调用，结果交回事件循环"""
+
+    def __init__(self, name: str = 'blocking'):
+        self._jobs = queue.SimpleQueue()
+        self.calls = 0
+        self.busy_time = 0.0    # 执行阻塞调用累计花的时间（秒）
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, fn: Callable, *args) -> 'asyncio.Future':
+        """在执行线程中调用 fn(*args)，返回可以 await 的 Future（在事件循环中调用）"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._jobs.put((loop, future, fn, args))
+        return future
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            loop, future, fn, args = job
+            if future.cancelled():
+                # 等待结果的协程已经被取消（例如停止监控），不再执行
+                continue
+            start = time.perf_counter()
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                result, error = None, e
+            self.busy_time += time.perf_counter() - start
+            self.calls += 1
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # 事件循环已经关闭，结果没有人等了
+                pass
+
+    def close(self):
+        """不再执行新的调用；正在执行的调用完成后线程退出（不等待）"""
+        self._jobs.put(None)
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+
+class AsyncActionQueue:
+    """发送队列的协程版本：合并策略和统计与 ActionQueue 相同，由事件循环上的一个任务依次交给发送线程"""
+
+    def __init__(self, policy: Optional[CoalescingPolicy] = None, maxsize: int = 32):
+        self.policy = policy or OnePerBurstPolicy()
+        self.maxsize = maxsize
+        self._intents = deque()
+        self._pending: Dict[Hashable, ReplyIntent] = {}  # 排队中或正在执行的意图
+        self._ready: Optional[asyncio.Event] = None
+        self.executed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.busy = False
+        self.wait_histogram = None  # 设置后记录每个操作从提交到开始执行的等待时间（metrics.Histogram）
+        self.on_executed: Optional[Callable[[Hashable], None]] = None  # 每个回复执行完后在事件循环中调用
+
+    def submit(self, key: Hashable, action: Callable[[], bool]) -> bool:
+        """提交一个回复意图（在事件循环中调用），被合并或丢弃时返回False"""
+        now = time.time()
+        pending = self._pending.get(key)
+        if not self.policy.admit(key, now, pending is not None):
+            self.coalesced += 1
+            if pending is not None:
+                pending.merged += 1
+            return False
+        if len(self._intents) >= self.maxsize:
+            self.dropped += 1
+            print(f"发送队列已满（{self.maxsize}），丢弃本次回复")
+            return False
+        intent = ReplyIntent(key, action)
+        self._pending[key] = intent
+        self._intents.append(intent)
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def has_pending(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    @property
+    def depth(self) -> int:
+        """等待执行的操作数量"""
+        return len(self._intents)
+
+    async def run(self, executor: BlockingExecutor):
+        """依次执行队列中的回复，直到被取消"""
+        self._ready = asyncio.Event()
+        while True:
+            while not self._intents:
+                self._ready.clear()
+                await self._ready.wait()
+            intent = self._intents.popleft()
+            self.busy = True
+            if self.wait_histogram is not None:
+                self.wait_histogram.observe(time.time() - intent.created_at)
+            try:
+                await executor.run(intent.action)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"执行输入操作时出错: {e}")
+            finally:
+                self.busy = False
+                if self._pending.get(intent.key) is intent:
+                    del self._pending[intent.key]
+            self.policy.on_executed(intent.key, time.time())
+            self.executed += 1
+            if intent.merged:
+                print(f"本次回复合并了 {intent.merged} 次后续检测")
+            if self.on_executed is not None:
+                self.on_executed(intent.key)
+
+
+class AsyncEngine(ChatMonitor):
+    """异步监控引擎
+
+    与 ChatScheduler 的接口相同（add_window、discover、status 由 ChatMonitor 共用，start、stop 各自实现），
+    事件循环运行在后台线程中，start/stop/wake 可以在任意线程调用。每个聊天一个协程：
+    等待自适应间隔的定时器、结构变化通知或窗口标题变化，再把检测交给执行线程。
+    发送队列的回复在单独的发送线程（actuator）中执行，与 thread 引擎的发送线程一样不阻塞检测。
+    """
+
+    def __init__(self, backend, uia, detector_factory=None, min_interval: float = 0.3,
+                 max_interval: float = 5.0, backoff: float = 1.5,
+                 action_queue: Optional[AsyncActionQueue] = None,
+                 fallback_interval: float = 2.0, title_check_interval: float = 0.1):
+        super().__init__(backend, uia, detector_factory, min_interval, max_interval, backoff)
+        self.action_queue = action_queue or AsyncActionQueue()
+        self.fallback_interval = fallback_interval        # 有结构变化事件的聊天最长多久兜底检测一次
+        self.title_check_interval = title_check_interval  # 检查所有窗口标题的间隔（秒）
+        self.on_closed: Optional[Callable[[ChatTarget], None]] = None  # 聊天窗口关闭、停止监控它时调用
+
+        self.executor: Optional[BlockingExecutor] = None  # 检测和窗口标题检查
+        self.actuator: Optional[BlockingExecutor] = None  # 发送表情包的点击和粘贴
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._wakes: Dict[int, asyncio.Event] = {}
+        self._services: List[asyncio.Task] = []
+
+    # ---- 添加聊天（在启动前或任意线程中调用） ----
+
+    def add_target(self, detector, pacer: AdaptiveInterval, subscribe: bool = True) -> ChatTarget:
+        """监控一个已经初始化好的检测器，subscribe 为 False 时只按间隔轮询"""
+        target = ChatTarget(detector, pacer)
+        if subscribe:
+            self._subscribe(target)
+        self._register(target)
+        return target
+
+    def _register(self, target: ChatTarget):
+        self.targets[target.key] = target
+        if self.is_running:
+            self.loop.call_soon_threadsafe(self._spawn, target)
+
+    def is_event_driven(self, key) -> bool:
+        target = self.targets.get(key)
+        return bool(target and target.event_source and target.event_source.is_active)
+
+    def wake(self, key):
+        """让某个聊天尽快检测（可在任意线程调用）"""
+        loop = self.loop
+        if loop is None or not self.is_running:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake_now, key)
+        except RuntimeError:
+            # 事件循环已经关闭
+            pass
+
+    def _wake_now(self, key):
+        wake = self._wakes.get(key)
+        if wake is not None:
+            wake.set()
+
+    # ---- 启动和停止 ----
+
+    def start(self):
+        if self.is_running:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.executor = BlockingExecutor()
+        self.actuator = BlockingExecutor('actuator')
+        self.action_queue.on_executed = self._after_reply
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run_loop, name='engine', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_tasks(), self.loop).result()
+        print(f"异步监控引擎已启动，共 {len(self.targets)} 个聊天")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _start_tasks(self):
+        for target in list(self.targets.values()):
+            self._spawn(target)
+        loop = asyncio.get_event_loop()
+        self._services = [loop.create_task(self.action_queue.run(self.actuator)),
+                          loop.create_task(self._watch_titles())]
+
+    def stop(self):
+        """取消所有协程并停止事件循环，不等待正在执行的检测或发送（它在执行线程中完成后直接丢弃结果）"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result(timeout=1)
+        except Exception as e:
+            print(f"停止异步监控引擎时出错: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+        self.executor.close()
+        self.actuator.close()
+        self._stop_event_sources()
+        print("异步监控引擎已停止")
+
+    async def _cancel_all(self):
+        tasks = list(self._tasks.values()) + self._services
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._services = []
+
+    def wait_closed(self, timeout: Optional[float] = None):
+        """等待上一次停止时还在执行的阻塞调用完成（重新开始监控前调用，避免两个线程同时使用同一个检测器）"""
+        deadline = None if timeout is None else time.time() + timeout
+        for executor in (self.executor, self.actuator):
+            if executor is not None:
+                executor.join(None if deadline is None else max(0.0, deadline - time.time()))
+
+    # ---- 协程 ----
+
+    def _spawn(self, target: ChatTarget):
+        if target.key in self._tasks or target.key not in self.targets:
+            return
+        self._wakes[target.key] = asyncio.Event()
+        self._tasks[target.key] = asyncio.get_event_loop().create_task(self._watch(target))
+
+    def _remove(self, target: ChatTarget):
+        self.targets.pop(target.key, None)
+        self._tasks.pop(target.key, None)
+        self._wakes.pop(target.key, None)
+        if target.event_source:
+            target.event_source.stop()
+            target.event_source = None
+        if self.on_closed is not None:
+            self.on_closed(target)
+
+    async def _watch(self, target: ChatTarget):
+        detector = target.detector
+        wake = self._wakes[target.key]
+        loop = asyncio.get_event_loop()
+        while True:
+            if self.action_queue.has_pending(target.key):
+                # 回复还没有发送完时不检测：发送线程正在使用同一个检测器（消息解析的缓存、冷却状态），
+                # 发送完成后由 _after_reply 唤醒
+                wake.clear()
+                await wake.wait()
+                continue
+
+            # 冷却期内不检测，冷却结束的时刻准时检测一次（这次检测会更新基线）
+            remaining = detector.get_cooldown_status()['remaining_time']
+            if remaining > 0:
+                while remaining > 0:
+                    await asyncio.sleep(remaining)
+                    remaining = detector.get_cooldown_status()['remaining_time']
+                if wake.is_set():
+                    detector.metrics.suppressed.inc(label_value='cooldown')
+                detector.change_time = None
+
+            wake.clear()
+            target.in_tick = True
+            try:
+                result = await self.executor.run(self._tick, target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"检测聊天 {target.title} 时出错: {e}")
+                result = (False, None)
+            finally:
+                target.in_tick = False
+            if result is None:
+                print(f"聊天窗口已关闭，停止监控: {target.title}")
+                self._remove(target)
+                return
+
+            detected, reply = result
+            target.ticks += 1
+            self.total_ticks += 1
+            if detected:
+                target.detections += 1
+            if reply is not None:
+                if self.action_queue.submit(target.key, reply):
+                    print(f"聊天 {target.title} 检测到新消息，已加入发送队列")
+                else:
+                    print(f"聊天 {target.title} 检测到新消息，已合并到待发送的回复")
+
+            now = time.time()
+            interval = target.pacer.record(detected, now)
+            if target.event_source is not None:
+                interval = min(interval, self.fallback_interval)
+            target.next_due = now + interval
+            if wake.is_set():
+                # 检测过程中又收到了通知，立即再检测一次
+                continue
+            timer = loop.call_later(interval, wake.set)
+            try:
+                await wake.wait()
+            finally:
+                timer.cancel()
+
+    def _tick(self, target: ChatTarget):
+        """在执行线程中检测一次，返回 (是否检测到新消息, 回复动作)，窗口已关闭时返回 None"""
+        detector = target.detector
+        if not self.backend.is_window_alive(detector.wechat_window):
+            return None
+        chat_area = detector.chat_area_element
+        detected = detector.detect_new_message()
+        if detector.chat_area_element is not chat_area and target.event_source:
+            self._resubscribe(target)
+        reply = detector.make_reply() if detected else None
+        return detected, reply
+
+    async def _watch_titles(self):
+        """定期检查所有窗口的标题（一次阻塞调用检查全部），标题变化（出现未读数）时立即唤醒对应的聊天"""
+        while True:
+            await asyncio.sleep(self.title_check_interval)
+            targets = [target for target in list(self.targets.values()) if not target.in_tick]
+            if not targets:
+                continue
+            for key in await self.executor.run(self._changed_titles, targets):
+                self._wake_now(key)
+
+    @staticmethod
+    def _changed_titles(targets: List[ChatTarget]) -> List[int]:
+        return [target.key for target in targets if target.detector.window_title_changed()]
+
+    def _after_reply(self, key):
+        """一个回复发送完成：在冷却期结束的时刻唤醒该聊天（定时器可能早到一点，协程会再等到真正结束），
+        发送失败没有进入冷却期时立即唤醒"""
+        target = self.targets.get(key)
+        if target is None:
+            return
+        remaining = target.detector.get_cooldown_status()['remaining_time']
+        if remaining > 0:
+            asyncio.get_event_loop().call_later(remaining, self._wake_now, key)
+        else:
+            self._wake_now(key)
+
+    def describe(self) -> str:
+        executor, actuator = self.executor, self.actuator
+        calls = f"，执行线程已执行 {executor.calls} 次阻塞调用（共 {executor.busy_time:.1f} 秒）" if executor else ""
+        sends = f"，发送线程已执行 {actuator.calls} 次回复（共 {actuator.busy_time:.1f} 秒）" if actuator else ""
+        return f"异步引擎: {len(self.targets)} 个聊天，已检测 {self.total_ticks} 次{calls}{sends}"
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包位置自动识别
+功能：不用按热键，直接在微信窗口的截图中找到表情包按钮和表情包面板。
+      按钮用多尺度模板匹配（template_matcher.py）在聊天区域下方的工具栏中查找：模板优先使用手动设置时
+      在按钮位置截下的图（保存在 calibration_templates.npz），没有时用画出来的笑脸图标；
+      面板是点击按钮前后两张窗口截图中变化的矩形区域。
+      每个窗口大小和DPI识别到的按钮位置、每个DPI匹配成功的缩放比例都会记住：
+      回到识别过的窗口大小时只在上次的位置附近确认一次，其他大小只尝试记住的比例。需要 numpy
+"""
+
+import os
+import time
+from typing import Optional, Dict, List, Tuple
+
+from backends import Point
+from calibration_profile import profile_key, make_panel_area
+from template_matcher import TemplateMatcher, ImagePyramid, Match, to_gray, HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# 默认模板保存位置：程序所在目录
+DEFAULT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration_templates.npz')
+
+# 画出来的默认模板对应 100% 缩放（96 DPI），边长包括图标周围的一圈背景
+BASE_DPI = 96
+TEMPLATE_SIZE = 28
+
+# 在 DPI 换算出的比例基础上依次尝试的倍数（微信不同版本的图标大小略有不同）
+SCALE_STEPS = (1.0, 0.9, 1.12, 0.8, 1.25)
+
+# 工具栏在聊天区域下方的高度（100% 缩放时的像素）
+TOOLBAR_HEIGHT = 80
+
+
+def draw_button_template(size: int = TEMPLATE_SIZE):
+    """画一个笑脸图标（表情包按钮）：浅色背景上的圆圈、两只眼睛和向上弯的嘴"""
+    background, ink = 245.0, 80.0
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) + 0.5
+    center = size / 2
+    distance = np.hypot(x - center, y - center)
+    stroke = max(1.0, size / 14)
+    image = np.full((size, size), background, dtype=np.float32)
+    image[np.abs(distance - size * 0.36) <= stroke / 2 + 0.25] = ink
+    for eye_x in (center - size * 0.13, center + size * 0.13):
+        image[np.hypot(x - eye_x, y - (center - size * 0.08)) <= stroke] = ink
+    image[(np.abs(distance - size * 0.2) <= stroke / 2 + 0.25) & (y > center + size * 0.05)] = ink
+    return image
+
+
+def _longest_run(mask) -> Optional[Tuple[int, int]]:
+    """布尔数组中最长的一段连续 True 的 (开始, 结束+1)"""
+    best, start = None, None
+    for index, value in enumerate(list(mask) + [False]):
+        if value and start is None:
+            start = index
+        elif not value and start is not None:
+            if best is None or index - start > best[1] - best[0]:
+                best = (start, index)
+            start = None
+    return best
+
+
+class AutoCalibrator:
+    """在窗口截图中识别表情包按钮和面板"""
+
+    def __init__(self, backend, template_path: str = DEFAULT_TEMPLATE_PATH, threshold: float = 0.6,
+                 panel_tolerance: float = 6.0, panel_fraction: float = 0.3):
+        if not HAS_NUMPY:
+            raise RuntimeError("自动识别表情包位置需要安装 numpy")
+        self.backend = backend
+        self.template_path = template_path
+        self.threshold = threshold              # 匹配度低于它时认为没有找到按钮
+        self.panel_tolerance = panel_tolerance  # 灰度差超过它才算变化
+        self.panel_fraction = panel_fraction    # 变化像素数达到最多的一行（列）的这个比例才算面板内
+        self.matcher = TemplateMatcher()
+        self._template = None                   # (灰度模板, 截取时的DPI, 是否保存的截图)
+        self._capture = None
+        self.frame = None                       # 上一次截取的窗口（灰度），识别面板时作为点击前的画面
+        self.scale_hints: Dict[int, float] = {}            # DPI → 上次匹配成功的缩放比例
+        self.button_cache: Dict[str, Tuple[int, int]] = {}  # 窗口大小和DPI → 按钮相对窗口左上角的位置
+        self.last_match: Optional[Match] = None
+        self.last_elapsed = 0.0
+        self.calibrations = 0
+
+    def template(self):
+        """按钮模板和截取时的 DPI：优先读取保存的模板，没有时用画出来的图标"""
+        if self._template is None:
+            self._template = (draw_button_template(), BASE_DPI, False)
+            if os.path.exists(self.template_path):
+                try:
+                    with np.load(self.template_path) as data:
+                        self._template = (data['button'].astype(np.float32), int(data['dpi']), True)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"读取表情包按钮模板失败: {e}")
+        return self._template
+
+    def capture(self, window):
+        """截取整个窗口，返回 float32 灰度图（截图缓冲区按窗口大小复用），不支持截图时返回 None"""
+        width, height = window.width, window.height
+        capture = self._capture
+        if capture is None or (capture.width, capture.height) != (width, height):
+            if capture is not None:
+                capture.close()
+            capture = self._capture = self.backend.create_region_capture(width, height)
+            if capture is None:
+                return None
+        self.frame = to_gray(capture.grab(window.left, window.top), capture.bgr)
+        return self.frame
+
+    def search_region(self, window, dpi: int,
+                      chat_rect: Optional[Tuple[int, int, int, int]] = None) -> Tuple[int, int, int, int]:
+        """查找按钮的区域（相对窗口左上角）：聊天区域下方的工具栏，不知道聊天区域时用窗口下半部分"""
+        if chat_rect:
+            chat_left, _, chat_right, chat_bottom = chat_rect
+            left = max(0, chat_left - window.left - 10)
+            top = max(0, chat_bottom - window.top - 10)
+            right = min(window.width, chat_right - window.left + 10)
+            bottom = min(window.height, top + int(TOOLBAR_HEIGHT * dpi / BASE_DPI))
+            if right - left > TEMPLATE_SIZE * 2 and bottom - top > TEMPLATE_SIZE:
+                return (left, top, right, bottom)
+        return (0, window.height // 2, window.width, window.height)
+
+    def _match(self, gray, region: Tuple[int, int, int, int], template, scales: List[float]) -> Optional[Match]:
+        left, top, right, bottom = region
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(gray.shape[1], right), min(gray.shape[0], bottom)
+        if right <= left or bottom <= top:
+            return None
+        match = self.matcher.find(ImagePyramid(gray[top:bottom, left:right]), template, scales, self.threshold)
+        if match is None:
+            return None
+        return match._replace(left=match.left + left, top=match.top + top)
+
+    def locate_button(self, window, dpi: int,
+                      chat_rect: Optional[Tuple[int, int, int, int]] = None) -> Optional[Point]:
+        """截取窗口并查找表情包按钮，返回按钮中心的屏幕坐标，找不到时返回 None"""
+        start = time.perf_counter()
+        self.calibrations += 1
+        gray = self.capture(window)
+        if gray is None:
+            return None
+        template, template_dpi, _ = self.template()
+        key = profile_key(window, dpi)
+        hint = self.scale_hints.get(dpi)
+
+        match = None
+        cached = self.button_cache.get(key)
+        if cached and hint:
+            # 这个窗口大小识别过：只在上次的位置附近用上次的比例确认
+            half = int(max(template.shape) * hint)
+            x, y = cached
+            match = self._match(gray, (x - half, y - half, x + half, y + half), template, [hint])
+        if match is None:
+            base = dpi / template_dpi
+            scales = [base * step for step in SCALE_STEPS]
+            if hint:
+                scales = [hint] + [scale for scale in scales if abs(scale - hint) > 0.02]
+            match = self._match(gray, self.search_region(window, dpi, chat_rect), template, scales)
+
+        self.last_match = match
+        self.last_elapsed = time.perf_counter() - start
+        if match is None:
+            return None
+        self.scale_hints[dpi] = match.scale
+        x, y = match.center
+        self.button_cache[key] = (x, y)
+        return Point(window.left + x, window.top + y)
+
+    def locate_panel(self, window) -> Optional[dict]:
+        """再截取一次窗口，与 locate_button 时的画面比较，变化的矩形区域就是面板；找不到时返回 None"""
+        before = self.frame
+        after = self.capture(window)
+        if before is None or after is None or before.shape != after.shape:
+            return None
+        changed = np.abs(after - before) > self.panel_tolerance
+        rows = changed.sum(axis=1)
+        if rows.max() == 0:
+            return None
+        vertical = _longest_run(rows >= rows.max() * self.panel_fraction)
+        # 列只统计面板所在的行，按钮的高亮等其他小变化不影响左右边界
+        columns = changed[vertical[0]:vertical[1]].sum(axis=0)
+        horizontal = _longest_run(columns >= columns.max() * self.panel_fraction)
+        return make_panel_area(window.left + horizontal[0], window.top + vertical[0],
+                               window.left + horizontal[1], window.top + vertical[1])
+
+    def remember_button(self, window, dpi: int, button: Point) -> bool:
+        """手动设置按钮位置后，把按钮周围截下来保存，作为以后自动识别的模板"""
+        gray = self.capture(window)
+        if gray is None:
+            return False
+        half = int(round(TEMPLATE_SIZE / 2 * dpi / BASE_DPI))
+        x, y = button.x - window.left, button.y - window.top
+        if x < half or y < half:
+            return False
+        patch = gray[y - half:y + half, x - half:x + half]
+        if patch.shape != (2 * half, 2 * half) or patch.std() < self.matcher.min_std:
+            # 按钮贴着窗口边缘，或者截到的是纯色（位置不对）
+            return False
+        try:
+            np.savez(self.template_path, button=np.round(patch).astype(np.uint8), dpi=dpi)
+        except OSError as e:
+            print(f"保存表情包按钮模板失败: {e}")
+            return False
+        self._template = (patch.copy(), dpi, True)
+        # 模板换了，之前记住的比例和位置不再适用
+        self.scale_hints.clear()
+        self.button_cache.clear()
+        return True
+
+    def describe(self) -> str:
+        template, template_dpi, saved = self.template()
+        source = "手动设置时截取" if saved else "默认笑脸图标"
+        text = (f"自动识别表情包位置: 模板为{source}（{template.shape[1]}x{template.shape[0]}，DPI {template_dpi}），"
+                f"识别 {self.calibrations} 次，记住 {len(self.button_cache)} 个窗口大小")
+        if self.last_match is not None:
+            text += (f"，上次匹配度 {self.last_match.score:.2f}、比例 {self.last_match.scale:.2f}、"
+                     f"耗时 {self.last_elapsed * 1000:.0f} ms")
+        return text
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
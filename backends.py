@@ -0,0 +1,875 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+平台后端
+功能：把窗口查找、UI Automation 元素树和鼠标输入封装成可替换的后端。
+      Windows 后端在第一次使用时才导入 pygetwindow / pyautogui / win32gui / comtypes，
+      模拟后端在内存中模拟聊天列表、消息到达和鼠标点击，可以在Linux上运行和压测
+"""
+
+import time
+from collections import namedtuple
+from typing import Optional, List, Tuple, Callable
+
+from uia_events import MessageEventSource, UIAStructureEventSource
+
+# 与 pyautogui.Point 兼容的坐标
+Point = namedtuple('Point', ['x', 'y'])
+
+
+class PlatformBackend:
+    """平台后端基类"""
+
+    name = "base"
+
+    # UI Automation 常量所在的模块（UIAutomationClient 或 simulated_uia），不可用时为 None
+    uia_module = None
+
+    def find_windows(self, title: str) -> List:
+        """按标题查找窗口，返回的窗口对象需要提供 title/left/top/width/height/
+        isMinimized/restore()/activate() 以及 _hWnd"""
+        raise NotImplementedError
+
+    def list_chat_windows(self) -> List:
+        """列出所有可以监控的聊天窗口（微信主窗口和弹出的独立聊天窗口）"""
+        return self.find_windows("微信")
+
+    def is_window_alive(self, window) -> bool:
+        """窗口是否仍然存在"""
+        raise NotImplementedError
+
+    def create_automation(self):
+        """创建 IUIAutomation 对象，不可用时返回 None"""
+        return None
+
+    def create_event_source(self, uia) -> Optional[MessageEventSource]:
+        """创建聊天列表结构变化事件源，不支持时返回 None"""
+        return None
+
+    def watch_window_geometry(self, uia, window, callback: Callable[[], None]) -> Optional[Callable[[], None]]:
+        """订阅窗口移动和改变大小的通知，返回取消订阅的函数；不支持时返回 None"""
+        return None
+
+    def get_dpi(self, window) -> int:
+        """窗口所在显示器的DPI（100%缩放为96）"""
+        return 96
+
+    def create_region_capture(self, width: int, height: int):
+        """创建截取屏幕区域的对象（grab(left, top) 返回 (高, 宽, 通道) 的 numpy 数组，
+        每次截图写入同一块缓冲区），需要 numpy，不支持时返回 None"""
+        return None
+
+    def is_foreground(self, window) -> Optional[bool]:
+        """窗口是否已在前台，无法判断时返回 None"""
+        return None
+
+    def is_emoji_panel_open(self, window) -> Optional[bool]:
+        """表情包面板是否已经显示，无法判断时返回 None"""
+        return None
+
+    def get_emoji_panel_cells(self, uia, window) -> Optional[List[Tuple[int, int, int, int]]]:
+        """已打开的表情包面板中每个表情包的矩形 (left, top, right, bottom)，读取不到时返回 None"""
+        return None
+
+    def get_emoji_panel_tabs(self, uia, window) -> Optional[List[Tuple[str, Tuple[int, int, int, int]]]]:
+        """已打开的表情包面板中的标签按钮 [(名称, 矩形), ...]，读取不到时返回 None"""
+        return None
+
+    def emoji_panel_signature(self, uia, window) -> Optional[str]:
+        """表情包面板当前显示内容的标识，切换标签页或翻页后会变化；无法读取时返回 None"""
+        return None
+
+    def click(self, x: int, y: int):
+        """在屏幕坐标处点击鼠标左键"""
+        raise NotImplementedError
+
+    def scroll(self, x: int, y: int, amount: int):
+        """在屏幕坐标处滚动鼠标滚轮，amount 为负数时向下滚动"""
+        raise NotImplementedError
+
+    def hotkey(self, *keys: str):
+        """按下组合键，例如 hotkey('ctrl', 'v')"""
+        raise NotImplementedError
+
+    def press(self, key: str):
+        """按一下某个键"""
+        raise NotImplementedError
+
+    def set_clipboard(self, format: int, data: bytes) -> bool:
+        """把某种格式的数据放到剪贴板，不支持时返回 False"""
+        return False
+
+    def mouse_position(self) -> Point:
+        """当前鼠标位置"""
+        raise NotImplementedError
+
+    def sleep(self, seconds: float):
+        """输入操作之间的等待"""
+        time.sleep(seconds)
+
+    def now(self) -> float:
+        """检测使用的当前时间（回放后端返回录制时的时间）"""
+        return time.time()
+
+    def replay_snapshot(self, window):
+        """回放录制的聊天列表快照（ChatSnapshot），不是回放后端时返回 None，由检测器读取元素树"""
+        return None
+
+
+class WindowsBackend(PlatformBackend):
+    """Windows 后端：pygetwindow + pyautogui + UI Automation"""
+
+    name = "windows"
+
+    def __init__(self):
+        self._gw = None
+        self._pyautogui = None
+        self._win32gui = None
+        self._win32clipboard = None
+        self._uia_loaded = False
+        self.uia_module = None
+
+    # 依赖库按需导入，只有真正用到时才要求安装
+
+    @property
+    def gw(self):
+        if self._gw is None:
+            import pygetwindow
+            self._gw = pygetwindow
+        return self._gw
+
+    @property
+    def pyautogui(self):
+        if self._pyautogui is None:
+            import pyautogui
+            # 设置pyautogui的安全设置
+            pyautogui.FAILSAFE = True
+            pyautogui.PAUSE = 0.1
+            self._pyautogui = pyautogui
+        return self._pyautogui
+
+    @property
+    def win32gui(self):
+        if self._win32gui is None:
+            import win32gui
+            self._win32gui = win32gui
+        return self._win32gui
+
+    @property
+    def win32clipboard(self):
+        if self._win32clipboard is None:
+            import win32clipboard
+            self._win32clipboard = win32clipboard
+        return self._win32clipboard
+
+    def _load_uia_module(self):
+        if not self._uia_loaded:
+            self._uia_loaded = True
+            try:
+                import comtypes.gen.UIAutomationClient as UIAuto
+                self.uia_module = UIAuto
+            except ImportError:
+                print("UI Automation模块未找到，将使用备选监控方案")
+                self.uia_module = None
+        return self.uia_module
+
+    def find_windows(self, title: str) -> List:
+        return self.gw.getWindowsWithTitle(title)
+
+    # 微信主窗口和弹出的独立聊天窗口的窗口类名
+    CHAT_WINDOW_CLASSES = ('WeChatMainWndForPC', 'ChatWnd')
+
+    def list_chat_windows(self) -> List:
+        hwnds = []
+
+        def _collect(hwnd, _):
+            if (self.win32gui.IsWindowVisible(hwnd)
+                    and self.win32gui.GetClassName(hwnd) in self.CHAT_WINDOW_CLASSES):
+                hwnds.append(hwnd)
+            return True
+
+        self.win32gui.EnumWindows(_collect, None)
+        return [self.gw.Win32Window(hwnd) for hwnd in hwnds]
+
+    def is_window_alive(self, window) -> bool:
+        return bool(window) and bool(self.win32gui.IsWindow(window._hWnd))
+
+    def create_automation(self):
+        UIAuto = self._load_uia_module()
+        if UIAuto is None:
+            return None
+        try:
+            from comtypes import CoCreateInstance, CLSCTX_INPROC_SERVER
+            uia = CoCreateInstance(UIAuto.CUIAutomation._reg_clsid_,
+                                   interface=UIAuto.IUIAutomation,
+                                   clsctx=CLSCTX_INPROC_SERVER)
+            print("UI Automation已初始化")
+            return uia
+        except Exception as e:
+            print(f"UI Automation初始化失败: {e}")
+            return None
+
+    def create_event_source(self, uia) -> Optional[MessageEventSource]:
+        if uia is None:
+            return None
+        return UIAStructureEventSource(uia)
+
+    def watch_window_geometry(self, uia, window, callback: Callable[[], None]) -> Optional[Callable[[], None]]:
+        # 窗口的 BoundingRectangle 属性变化事件：移动和改变大小时都会触发
+        if uia is None or not window:
+            return None
+        try:
+            import comtypes
+            import comtypes.gen.UIAutomationClient as UIAuto
+        except ImportError:
+            return None
+
+        class _GeometryChangedHandler(comtypes.COMObject):
+            _com_interfaces_ = [UIAuto.IUIAutomationPropertyChangedEventHandler]
+
+            def HandlePropertyChangedEvent(self, sender, propertyId, newValue):
+                callback()
+                return 0  # S_OK
+
+        try:
+            element = uia.ElementFromHandle(window._hWnd)
+            handler = _GeometryChangedHandler()
+            uia.AddPropertyChangedEventHandler(element, UIAuto.TreeScope_Element, None, handler,
+                                               [UIAuto.UIA_BoundingRectanglePropertyId])
+        except Exception as e:
+            print(f"订阅窗口位置变化事件失败，改为定时读取窗口位置: {e}")
+            return None
+
+        def unsubscribe():
+            try:
+                uia.RemovePropertyChangedEventHandler(element, handler)
+            except Exception as e:
+                print(f"取消窗口位置变化事件订阅时出错: {e}")
+        return unsubscribe
+
+    # 微信表情包面板弹出窗口的窗口类名
+    EMOJI_PANEL_CLASSES = ('EmotionWnd',)
+
+    def get_dpi(self, window) -> int:
+        try:
+            import ctypes
+            # Windows 10 1607 及以上版本支持按窗口获取DPI
+            dpi = ctypes.windll.user32.GetDpiForWindow(window._hWnd)
+            return dpi or 96
+        except (AttributeError, OSError):
+            return 96
+
+    def create_region_capture(self, width: int, height: int):
+        try:
+            return GdiRegionCapture(width, height)
+        except (ImportError, OSError, AttributeError) as e:
+            print(f"无法创建屏幕截图缓冲区: {e}")
+            return None
+
+    def is_foreground(self, window) -> Optional[bool]:
+        if not window:
+            return None
+        return self.win32gui.GetForegroundWindow() == window._hWnd
+
+    def is_emoji_panel_open(self, window) -> Optional[bool]:
+        return self._find_emoji_panel_hwnd() is not None
+
+    def _find_emoji_panel_hwnd(self) -> Optional[int]:
+        for class_name in self.EMOJI_PANEL_CLASSES:
+            hwnd = self.win32gui.FindWindow(class_name, None)
+            if hwnd and self.win32gui.IsWindowVisible(hwnd):
+                return hwnd
+        return None
+
+    def _find_panel_elements(self, uia, control_type_name: str):
+        """在已打开的表情包面板中查找某种控件，返回 [(名称, 矩形), ...]"""
+        UIAuto = self._load_uia_module()
+        hwnd = self._find_emoji_panel_hwnd()
+        if uia is None or UIAuto is None or not hwnd:
+            return None
+        try:
+            panel = uia.ElementFromHandle(hwnd)
+            condition = uia.CreatePropertyCondition(UIAuto.UIA_ControlTypePropertyId,
+                                                    getattr(UIAuto, control_type_name))
+            items = panel.FindAll(UIAuto.TreeScope_Descendants, condition)
+            elements = []
+            for i in range(items.Length):
+                item = items.GetElement(i)
+                rect = item.CurrentBoundingRectangle
+                if rect.right > rect.left and rect.bottom > rect.top:
+                    elements.append((item.CurrentName or '', (rect.left, rect.top, rect.right, rect.bottom)))
+            return elements or None
+        except Exception as e:
+            print(f"读取表情包面板元素失败: {e}")
+            return None
+
+    def get_emoji_panel_cells(self, uia, window) -> Optional[List[Tuple[int, int, int, int]]]:
+        elements = self._find_panel_elements(uia, 'UIA_ListItemControlTypeId')
+        return [rect for _, rect in elements] if elements else None
+
+    def get_emoji_panel_tabs(self, uia, window) -> Optional[List[Tuple[str, Tuple[int, int, int, int]]]]:
+        return self._find_panel_elements(uia, 'UIA_TabItemControlTypeId')
+
+    def emoji_panel_signature(self, uia, window) -> Optional[str]:
+        # 当前显示的前几个表情包的名称，切换标签页或翻页后会变化
+        elements = self._find_panel_elements(uia, 'UIA_ListItemControlTypeId')
+        if not elements:
+            return None
+        return "|".join(name for name, _ in elements[:4])
+
+    def click(self, x: int, y: int):
+        self.pyautogui.click(x, y)
+
+    def scroll(self, x: int, y: int, amount: int):
+        self.pyautogui.scroll(amount, x=x, y=y)
+
+    def hotkey(self, *keys: str):
+        self.pyautogui.hotkey(*keys)
+
+    def press(self, key: str):
+        self.pyautogui.press(key)
+
+    def set_clipboard(self, format: int, data: bytes) -> bool:
+        # 其他程序正在使用剪贴板时打开会失败，稍等后重试几次
+        for _ in range(5):
+            try:
+                self.win32clipboard.OpenClipboard()
+            except Exception:
+                time.sleep(0.02)
+                continue
+            try:
+                self.win32clipboard.EmptyClipboard()
+                self.win32clipboard.SetClipboardData(format, data)
+                return True
+            except Exception as e:
+                print(f"写入剪贴板失败: {e}")
+                return False
+            finally:
+                self.win32clipboard.CloseClipboard()
+        print("剪贴板被其他程序占用")
+        return False
+
+    def mouse_position(self) -> Point:
+        pos = self.pyautogui.position()
+        return Point(pos.x, pos.y)
+
+
+class GdiRegionCapture:
+    """用 GDI 截取屏幕区域：BitBlt 到预先创建的 DIB，返回的数组直接映射 DIB 的内存（BGRA），不复制"""
+
+    bgr = True
+
+    def __init__(self, width: int, height: int):
+        import ctypes
+        from ctypes import wintypes
+        import numpy
+
+        class BITMAPINFOHEADER(ctypes.Structure):
+            _fields_ = [('biSize', wintypes.DWORD), ('biWidth', wintypes.LONG), ('biHeight', wintypes.LONG),
+                        ('biPlanes', wintypes.WORD), ('biBitCount', wintypes.WORD),
+                        ('biCompression', wintypes.DWORD), ('biSizeImage', wintypes.DWORD),
+                        ('biXPelsPerMeter', wintypes.LONG), ('biYPelsPerMeter', wintypes.LONG),
+                        ('biClrUsed', wintypes.DWORD), ('biClrImportant', wintypes.DWORD)]
+
+        user32, gdi32 = ctypes.windll.user32, ctypes.windll.gdi32
+        # 64位系统上句柄不能按默认的 int 返回
+        user32.GetDC.restype = wintypes.HDC
+        user32.GetDC.argtypes = [wintypes.HWND]
+        user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+        gdi32.CreateCompatibleDC.restype = wintypes.HDC
+        gdi32.CreateCompatibleDC.argtypes = [wintypes.HDC]
+        gdi32.CreateDIBSection.restype = wintypes.HBITMAP
+        gdi32.CreateDIBSection.argtypes = [wintypes.HDC, ctypes.c_void_p, wintypes.UINT,
+                                           ctypes.POINTER(ctypes.c_void_p), wintypes.HANDLE, wintypes.DWORD]
+        gdi32.SelectObject.restype = wintypes.HGDIOBJ
+        gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+        gdi32.BitBlt.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                 wintypes.HDC, ctypes.c_int, ctypes.c_int, wintypes.DWORD]
+        gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+        gdi32.DeleteDC.argtypes = [wintypes.HDC]
+        self._user32, self._gdi32 = user32, gdi32
+
+        self.width, self.height = width, height
+        self._bitmap = None
+        self._screen_dc = user32.GetDC(None)
+        self._memory_dc = gdi32.CreateCompatibleDC(self._screen_dc)
+        # 高度为负数表示从上到下存放，与数组的行顺序一致
+        header = BITMAPINFOHEADER(ctypes.sizeof(BITMAPINFOHEADER), width, -height, 1, 32, 0, 0, 0, 0, 0, 0)
+        bits = ctypes.c_void_p()
+        self._bitmap = gdi32.CreateDIBSection(self._memory_dc, ctypes.byref(header), 0, ctypes.byref(bits), None, 0)
+        if not self._bitmap:
+            self.close()
+            raise OSError("CreateDIBSection 失败")
+        gdi32.SelectObject(self._memory_dc, self._bitmap)
+        buffer = (ctypes.c_ubyte * (width * height * 4)).from_address(bits.value)
+        self.frame = numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(height, width, 4)
+
+    def grab(self, left: int, top: int):
+        SRCCOPY = 0x00CC0020
+        self._gdi32.BitBlt(self._memory_dc, 0, 0, self.width, self.height, self._screen_dc, left, top, SRCCOPY)
+        return self.frame
+
+    def close(self):
+        if self._bitmap:
+            self._gdi32.DeleteObject(self._bitmap)
+            self._bitmap = None
+        if self._memory_dc:
+            self._gdi32.DeleteDC(self._memory_dc)
+            self._memory_dc = None
+        if self._screen_dc:
+            self._user32.ReleaseDC(None, self._screen_dc)
+            self._screen_dc = None
+
+
+class SimulatedRegionCapture:
+    """模拟截图：把模拟聊天列表中的气泡画成灰度图（背景245，对方的气泡255，自己的气泡190）
+
+    内容超过聊天列表高度时和微信一样显示最底部，气泡中画几条深色横线代表文字。
+    输入框上方的工具栏画出表情包按钮（笑脸）和旁边两个外形相近的图标，图标大小随 DPI 变化；
+    面板显示时画出面板、当前页的表情包和底部的标签按钮。
+    """
+
+    bgr = False
+    BACKGROUND, OTHER_BUBBLE, OWN_BUBBLE, TEXT = 245, 255, 190, 60
+    ICON, PANEL, PANEL_BORDER, TAB = 90, 255, 200, 225
+
+    def __init__(self, backend, width: int, height: int):
+        import numpy
+        self._backend = backend
+        self.width, self.height = width, height
+        self.frame = numpy.zeros((height, width), dtype=numpy.uint8)
+        self._icons = None  # 工具栏图标的掩码（按 DPI 画一次）
+
+    def grab(self, left: int, top: int):
+        frame = self.frame
+        frame.fill(self.BACKGROUND)
+        window = next((w for w in self._backend.windows if not w.closed and w.contains(left, top)),
+                      self._backend.window)
+        tree = window.tree
+        with tree._lock:
+            items = list(tree.messages)
+            list_rect = tree.chat_list.CurrentBoundingRectangle
+            offset = 0
+            if items:
+                offset = max(0, items[-1].CurrentBoundingRectangle.bottom - list_rect.bottom)
+            # 从最新的消息向上画，超出聊天列表顶部就停止
+            for item in reversed(items):
+                if item.CurrentBoundingRectangle.bottom - offset < list_rect.top:
+                    break
+                for child in item.children:
+                    if 'Bubble' not in (child.CurrentClassName or ''):
+                        continue
+                    rect = child.CurrentBoundingRectangle
+                    # 只画聊天列表可见范围内的部分
+                    x0 = max(rect.left, list_rect.left, left) - left
+                    x1 = min(rect.right, list_rect.right, left + self.width) - left
+                    y0 = max(rect.top - offset, list_rect.top, top) - top
+                    y1 = min(rect.bottom - offset, list_rect.bottom, top + self.height) - top
+                    if x1 <= x0 or y1 <= y0:
+                        continue
+                    own = child.CurrentClassName.startswith('Self')
+                    frame[y0:y1, x0:x1] = self.OWN_BUBBLE if own else self.OTHER_BUBBLE
+                    # 文字的长度随内容变化（内容不同、长度相同的消息也画得不一样），行的位置按气泡顶部计算
+                    name = child.CurrentName
+                    text_width = min(x1 - x0 - 8, 12 + 9 * len(name) + sum(map(ord, name)) % 7 * 5)
+                    bubble_top = rect.top - offset - top
+                    for line_y in range(bubble_top + 10, bubble_top + rect.bottom - rect.top - 8, 12):
+                        line_top, line_bottom = max(line_y, y0), min(line_y + 4, y1)
+                        if text_width > 0 and line_top < line_bottom:
+                            frame[line_top:line_bottom, x0 + 6:x0 + 6 + text_width] = self.TEXT
+        self._draw_toolbar(window, left, top)
+        if window.panel_visible:
+            self._draw_panel(window, left, top)
+        return frame
+
+    def _fill(self, rect, value, left: int, top: int):
+        """填充屏幕坐标的矩形（超出截图的部分不画）"""
+        x0, y0 = max(rect[0] - left, 0), max(rect[1] - top, 0)
+        x1, y1 = min(rect[2] - left, self.width), min(rect[3] - top, self.height)
+        if x1 > x0 and y1 > y0:
+            self.frame[y0:y1, x0:x1] = value
+
+    def _paste(self, mask, center: Point, left: int, top: int):
+        """按掩码把图标画在屏幕坐标 center 处"""
+        size = mask.shape[0]
+        x, y = center.x - size // 2 - left, center.y - size // 2 - top
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + size, self.width), min(y + size, self.height)
+        if x1 > x0 and y1 > y0:
+            region = self.frame[y0:y1, x0:x1]
+            region[mask[y0 - y:y1 - y, x0 - x:x1 - x]] = self.ICON
+
+    def _draw_toolbar(self, window, left: int, top: int):
+        size = max(8, round(20 * self._backend.dpi / 96))
+        if self._icons is None or self._icons[0].shape[0] != size:
+            self._icons = self._make_icons(size)
+        button = window.emoji_button_pos
+        spacing = size * 2
+        for index, mask in enumerate(self._icons):
+            self._paste(mask, Point(button.x + index * spacing, button.y), left, top)
+
+    @staticmethod
+    def _make_icons(size: int):
+        import numpy
+        stroke = max(1.0, size / 12)
+        y, x = numpy.mgrid[0:size, 0:size] + 0.5
+        center = size / 2
+        distance = numpy.hypot(x - center, y - center)
+        ring = numpy.abs(distance - size * 0.45) <= stroke / 2
+        # 表情包按钮：圆圈、两只眼睛和嘴
+        face = ring.copy()
+        for eye_x in (center - size * 0.16, center + size * 0.16):
+            face |= numpy.hypot(x - eye_x, y - (center - size * 0.1)) <= stroke
+        face |= (numpy.abs(distance - size * 0.25) <= stroke / 2) & (y > center + size * 0.05)
+        # 旁边的图标：只有圆圈（像截图按钮）和方框（像文件按钮）
+        box = numpy.zeros((size, size), dtype=bool)
+        box[1:-1, 1:-1] = True
+        box[1 + int(stroke):-1 - int(stroke), 1 + int(stroke):-1 - int(stroke)] = False
+        return (face, ring, box)
+
+    def _draw_panel(self, window, left: int, top: int):
+        area = window.emoji_panel_area
+        self._fill((area['left'], area['top'], area['right'], area['bottom']), self.PANEL_BORDER, left, top)
+        self._fill((area['left'] + 1, area['top'] + 1, area['right'] - 1, area['bottom'] - 1), self.PANEL, left, top)
+        for index, cell in enumerate(window.panel_cells):
+            self._fill(cell, 120 + index * 37 % 100, left, top)
+        for rect in window.tab_rects:
+            self._fill(rect, self.TAB, left, top)
+
+    def close(self):
+        pass
+
+
+class SimulatedWindow:
+    """模拟的微信窗口（属性与 pygetwindow.Window 一致）
+
+    每个窗口有自己的聊天列表、表情包按钮和表情包面板。
+    """
+
+    def __init__(self, backend, tree, hwnd: int, window_rect):
+        self._backend = backend
+        self.tree = tree
+        left, top, right, bottom = window_rect
+        self.left = left
+        self.top = top
+        self.width = right - left
+        self.height = bottom - top
+        self.isMinimized = False
+        self.closed = False
+        self._hWnd = hwnd
+
+        # 表情包按钮在输入框上方的工具栏，面板在按钮上方弹出
+        self.emoji_button_pos = Point(left + 320, bottom - 130)
+        self.emoji_panel_area = {
+            'left': left + 310,
+            'top': bottom - 480,
+            'right': left + 730,
+            'bottom': bottom - 150,
+        }
+        self.emoji_panel_area['width'] = self.emoji_panel_area['right'] - self.emoji_panel_area['left']
+        self.emoji_panel_area['height'] = self.emoji_panel_area['bottom'] - self.emoji_panel_area['top']
+        self.panel_open = False
+        self.panel_opened_at = 0.0  # 面板开始打开的时间，经过 backend.panel_delay 后才显示
+
+        # 面板中的表情包每页排成 4 行 6 列，格子 56 像素，格子之间有空隙，点到空隙不会发送
+        self.panel_cols, self.panel_rows = 6, 4
+        self.cell_pitch = (70, 80)
+        self.cell_size = 56
+        self.page_cells = []
+        for row in range(self.panel_rows):
+            for col in range(self.panel_cols):
+                cell_left = self.emoji_panel_area['left'] + 7 + col * self.cell_pitch[0]
+                cell_top = self.emoji_panel_area['top'] + 12 + row * self.cell_pitch[1]
+                self.page_cells.append((cell_left, cell_top,
+                                        cell_left + self.cell_size, cell_top + self.cell_size))
+
+        # 标签页：[(名称, 表情包数量), ...]，标签按钮排在面板底部；超过一页的标签页用滚轮翻页
+        self.panel_tabs = list(backend.panel_tabs)
+        self.tab_rects = []
+        for index in range(len(self.panel_tabs)):
+            tab_left = self.emoji_panel_area['left'] + 10 + index * 50
+            tab_top = self.emoji_panel_area['bottom'] - 16
+            self.tab_rects.append((tab_left, tab_top, tab_left + 40, tab_top + 14))
+        self.current_tab = 0
+        self.current_page = 0
+
+        # 输入框中粘贴进来、还没有发送的内容
+        self.draft = None
+        self._geometry_listeners = []
+
+    @property
+    def title(self) -> str:
+        return self.tree.title
+
+    def set_geometry(self, left: int, top: int, width: int, height: int):
+        """模拟移动窗口或改变窗口大小，并发出通知"""
+        if (left, top, width, height) == (self.left, self.top, self.width, self.height):
+            return
+        self.left, self.top, self.width, self.height = left, top, width, height
+        for callback in list(self._geometry_listeners):
+            callback()
+
+    def restore(self):
+        self.isMinimized = False
+
+    def activate(self):
+        self._backend.activations += 1
+        self._backend.foreground = self
+
+    def contains(self, x, y) -> bool:
+        return self.left <= x < self.left + self.width and self.top <= y < self.top + self.height
+
+    def hit_button(self, x, y, radius=12) -> bool:
+        return abs(x - self.emoji_button_pos.x) <= radius and abs(y - self.emoji_button_pos.y) <= radius
+
+    @property
+    def panel_visible(self) -> bool:
+        return self.panel_open and time.time() - self.panel_opened_at >= self._backend.panel_delay
+
+    def hit_panel(self, x, y) -> bool:
+        area = self.emoji_panel_area
+        return area['left'] <= x <= area['right'] and area['top'] <= y <= area['bottom']
+
+    @property
+    def page_count(self) -> int:
+        """当前标签页的页数"""
+        per_page = len(self.page_cells)
+        return max(1, -(-self.panel_tabs[self.current_tab][1] // per_page))
+
+    @property
+    def panel_cells(self) -> List[Tuple[int, int, int, int]]:
+        """当前页显示的表情包格子（最后一页可能不满）"""
+        per_page = len(self.page_cells)
+        remaining = self.panel_tabs[self.current_tab][1] - self.current_page * per_page
+        return self.page_cells[:max(0, min(per_page, remaining))]
+
+    def hit_cell(self, x, y) -> Optional[int]:
+        """点击位置所在的表情包序号，点在空隙中时返回 None"""
+        for index, (left, top, right, bottom) in enumerate(self.panel_cells):
+            if left <= x < right and top <= y < bottom:
+                return index
+        return None
+
+    def hit_tab(self, x, y) -> Optional[int]:
+        for index, (left, top, right, bottom) in enumerate(self.tab_rects):
+            if left <= x < right and top <= y < bottom:
+                return index
+        return None
+
+
+class SimulatedBackend(PlatformBackend):
+    """内存中的模拟后端
+
+    模拟微信主窗口以及任意数量弹出的独立聊天窗口：每个窗口有聊天列表（FakeChatTree）、
+    表情包按钮和表情包面板。点击表情包按钮打开面板，面板打开时点击面板内部会发送一个表情包
+    （作为自己的消息追加到聊天列表），点到表情包之间的空隙没有反应、面板保持打开，
+    点击面板外的位置关闭面板。
+    panel_delay 模拟面板打开需要的时间，面板显示之前点击面板区域相当于点空。
+    panel_tabs 为面板的标签页 [(名称, 表情包数量), ...]：点击面板底部的标签按钮切换标签页，
+    在面板上滚动滚轮翻页，面板每次打开时回到上次标签页的第一页。
+    前台窗口按 Ctrl+V 把剪贴板内容粘贴到输入框，按回车发送（作为自己的图片消息追加到聊天列表）。
+    input_delay 模拟每个输入操作（点击、滚动、按键）的耗时，对应 pyautogui.PAUSE。
+    """
+
+    name = "simulated"
+
+    def __init__(self, tree=None, window_rect=(0, 0, 800, 600), time_scale: float = 0.0,
+                 panel_delay: float = 0.0, panel_tabs: Optional[List[Tuple[str, int]]] = None,
+                 input_delay: float = 0.0):
+        import simulated_uia
+        self.uia_module = simulated_uia
+        self.time_scale = time_scale  # 输入等待的时间倍率，0 表示不等待
+        self.panel_delay = panel_delay  # 点击按钮后面板显示需要的时间（秒）
+        self.input_delay = input_delay  # 每个输入操作的耗时（秒）
+        self.dpi = 96
+        self.panel_tabs = panel_tabs or [("收藏", 24)]
+        self.window_size = (window_rect[2] - window_rect[0], window_rect[3] - window_rect[1])
+
+        main_tree = tree or simulated_uia.FakeChatTree(window_rect=window_rect)
+        self.window = SimulatedWindow(self, main_tree, 1, window_rect)
+        self.windows = [self.window]
+        self.foreground = self.window
+        self._roots = {self.window._hWnd: main_tree.root}  # 窗口句柄 → 模拟元素树的根
+
+        self.cursor = Point(0, 0)
+        self.clicks = []         # [(时间戳, x, y), ...]
+        self.activations = 0
+        self.sent_emojis = 0
+        self.sent_cells = []     # 每次发送的表情包序号
+        self.sent_stickers = []  # 每次发送的表情包位置 (标签页, 页, 格子)
+        self.scrolls = 0
+        self.missed_clicks = 0   # 面板打开时没有点中表情包的次数
+        self.clipboard = None    # (格式, 数据)
+        self.keys = []           # 按过的键和组合键
+        self.sent_pastes = 0     # 粘贴发送的图片数量
+
+    # 主窗口的属性，单聊天场景下直接使用
+
+    @property
+    def tree(self):
+        return self.window.tree
+
+    @property
+    def emoji_button_pos(self) -> Point:
+        return self.window.emoji_button_pos
+
+    @property
+    def emoji_panel_area(self) -> dict:
+        return self.window.emoji_panel_area
+
+    @property
+    def panel_open(self) -> bool:
+        return self.window.panel_open
+
+    def add_chat_window(self, title: str) -> SimulatedWindow:
+        """模拟一个弹出的独立聊天窗口，窗口依次向右排开，互不重叠"""
+        width, height = self.window_size
+        index = len(self.windows)
+        left = self.window.left + index * (width + 10)
+        rect = (left, self.window.top, left + width, self.window.top + height)
+        tree = self.uia_module.FakeChatTree(window_rect=rect, class_name='ChatWnd')
+        tree.set_title(title)
+        window = SimulatedWindow(self, tree, index + 1, rect)
+        self.windows.append(window)
+        self._roots[window._hWnd] = tree.root
+        return window
+
+    def find_windows(self, title: str) -> List:
+        return [w for w in self.windows if not w.closed and title in w.title]
+
+    def list_chat_windows(self) -> List:
+        return [w for w in self.windows if not w.closed]
+
+    def is_window_alive(self, window) -> bool:
+        return bool(window) and not window.closed
+
+    def create_automation(self):
+        return self.uia_module.FakeUIAutomation(self.window.tree.root, self._roots)
+
+    def create_event_source(self, uia) -> Optional[MessageEventSource]:
+        return self.uia_module.FakeTreeEventSource()
+
+    def watch_window_geometry(self, uia, window, callback: Callable[[], None]) -> Optional[Callable[[], None]]:
+        if not window:
+            return None
+        window._geometry_listeners.append(callback)
+        return lambda: window._geometry_listeners.remove(callback)
+
+    def create_region_capture(self, width: int, height: int):
+        try:
+            return SimulatedRegionCapture(self, width, height)
+        except ImportError:
+            return None
+
+    def _input(self):
+        if self.input_delay > 0:
+            time.sleep(self.input_delay)
+
+    def click(self, x: int, y: int):
+        self._input()
+        self.cursor = Point(x, y)
+        self.clicks.append((time.time(), x, y))
+        for window in self.windows:
+            if window.closed:
+                continue
+            if not window.contains(x, y):
+                # 点击其他窗口时，这个窗口失去焦点，面板随之关闭
+                window.panel_open = False
+                continue
+            if window.hit_button(x, y):
+                window.panel_open = not window.panel_open
+                window.panel_opened_at = time.time()
+                window.current_page = 0
+            elif window.panel_visible and window.hit_tab(x, y) is not None:
+                window.current_tab = window.hit_tab(x, y)
+                window.current_page = 0
+            elif window.panel_visible and window.hit_panel(x, y):
+                cell = window.hit_cell(x, y)
+                if cell is None:
+                    # 点到表情包之间的空隙，面板保持打开
+                    self.missed_clicks += 1
+                    continue
+                # 发送表情包后微信会自动关闭面板
+                self.sent_emojis += 1
+                self.sent_cells.append(cell)
+                self.sent_stickers.append((window.current_tab, window.current_page, cell))
+                window.panel_open = False
+                window.tree.add_message("[动画表情]", own=True)
+            elif window.panel_open:
+                self.missed_clicks += 1
+                window.panel_open = False
+
+    def get_dpi(self, window) -> int:
+        return self.dpi
+
+    def is_foreground(self, window) -> Optional[bool]:
+        return self.foreground is window
+
+    def is_emoji_panel_open(self, window) -> Optional[bool]:
+        return window.panel_visible if window else None
+
+    def scroll(self, x: int, y: int, amount: int):
+        self._input()
+        self.cursor = Point(x, y)
+        self.scrolls += 1
+        for window in self.windows:
+            if window.closed or not window.panel_visible or not window.hit_panel(x, y):
+                continue
+            # 每次滚动翻一页，到头后不再变化
+            if amount < 0:
+                window.current_page = min(window.page_count - 1, window.current_page + 1)
+            elif amount > 0:
+                window.current_page = max(0, window.current_page - 1)
+
+    def hotkey(self, *keys: str):
+        self._input()
+        self.keys.append('+'.join(keys))
+        window = self.foreground
+        if keys == ('ctrl', 'v') and window is not None and not window.closed and self.clipboard:
+            window.draft = self.clipboard
+
+    def press(self, key: str):
+        self._input()
+        self.keys.append(key)
+        window = self.foreground
+        if key == 'enter' and window is not None and not window.closed and window.draft:
+            window.draft = None
+            self.sent_pastes += 1
+            window.tree.add_message("[图片]", own=True)
+
+    def set_clipboard(self, format: int, data: bytes) -> bool:
+        self.clipboard = (format, data)
+        return True
+
+    def get_emoji_panel_cells(self, uia, window) -> Optional[List[Tuple[int, int, int, int]]]:
+        if not window or not window.panel_visible:
+            return None
+        return list(window.panel_cells)
+
+    def get_emoji_panel_tabs(self, uia, window) -> Optional[List[Tuple[str, Tuple[int, int, int, int]]]]:
+        if not window or not window.panel_visible:
+            return None
+        return [(name, rect) for (name, _), rect in zip(window.panel_tabs, window.tab_rects)]
+
+    def emoji_panel_signature(self, uia, window) -> Optional[str]:
+        if not window or not window.panel_visible:
+            return None
+        return f"{window.current_tab}:{window.current_page}"
+
+    def mouse_position(self) -> Point:
+        return self.cursor
+
+    def move_to(self, x: int, y: int):
+        """移动模拟鼠标（用于模拟交互式位置设置）"""
+        self.cursor = Point(x, y)
+
+    def sleep(self, seconds: float):
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def receive_message(self, text: str, window: Optional[SimulatedWindow] = None, sender: Optional[str] = None):
+        """模拟收到对方的一条消息（默认发到主窗口），sender 为群聊中消息的发送者"""
+        (window or self.window).tree.add_message(text, own=False, sender=sender)
+
+    def close_window(self, window: Optional[SimulatedWindow] = None):
+        (window or self.window).closed = True
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息检测基准测试
+功能：在模拟后端上用脚本化的聊天流量驱动 monitoring_loop / detect_new_message，
+      统计检测延迟（p50/p99）、漏检和重复检测次数、每秒检测次数以及每次检测的元素树调用次数，
+      结果以JSON输出，便于跟踪性能回退
+
+用法：
+    python bench_detection.py                       # 运行全部场景（轮询和事件两种模式）
+    python bench_detection.py --scenario burst --mode event
+    python bench_detection.py --mode pixel --interval 0.1   # 没有 UI Automation，只用像素变化检测（需要 numpy）
+    python bench_detection.py --engine thread               # 用监控线程代替异步引擎，对比两种引擎
+    python bench_detection.py --output bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+from typing import List, Tuple, Callable
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import SimulatedBackend
+from wechat_auto_emoji import WeChatAutoEmoji
+
+
+class BenchmarkApp(WeChatAutoEmoji):
+    """基准测试用的程序：跳过交互式位置设置，记录每次检测到新消息的时间，发送时不点击"""
+
+    def __init__(self, backend):
+        super().__init__(backend=backend)
+        self.detection_times = []
+        self.calibration_store = None  # 不读写磁盘上的位置配置、表情包选择记录和回复规则
+        self.selection_path = None
+        self.reply_rules = None
+
+    def setup_emoji_positions(self) -> bool:
+        self.emoji_button_pos = self.backend.emoji_button_pos
+        self.emoji_panel_area = self.backend.emoji_panel_area
+        return True
+
+    def detect_new_message(self) -> bool:
+        detected = super().detect_new_message()
+        if detected:
+            self.detection_times.append(time.perf_counter())
+        return detected
+
+    def send_random_emoji(self, decision=None) -> bool:
+        return True
+
+
+# 流量脚本中的一步：(距离上一步的延迟秒数, 类型, 文本)
+# 类型：other 对方消息（应当检测到），own 自己的消息（不应触发），title 标题出现未读数（应当检测到）
+Step = Tuple[float, str, str]
+
+
+def scenario_steady() -> Tuple[int, List[Step]]:
+    """稳定流量：每0.4秒一条消息"""
+    return 50, [(0.4, 'other', f"消息{i}") for i in range(8)]
+
+
+def scenario_burst() -> Tuple[int, List[Step]]:
+    """突发流量：三轮，每轮连续5条，轮间隔0.8秒"""
+    steps = []
+    for burst in range(3):
+        for i in range(5):
+            steps.append((0.8 if i == 0 else 0.02, 'other', f"突发{burst}-{i}"))
+    return 50, steps
+
+
+def scenario_long_history() -> Tuple[int, List[Step]]:
+    """超长聊天记录：预先加载1万条消息后再收到新消息"""
+    return 10000, [(0.4, 'other', f"新消息{i}") for i in range(6)]
+
+
+def scenario_own_echo() -> Tuple[int, List[Step]]:
+    """自己的消息回显：对方消息和自己的消息交替出现，自己的消息不应触发回复"""
+    steps = []
+    for i in range(5):
+        steps.append((0.4, 'other', f"对方{i}"))
+        steps.append((0.3, 'own', f"自己{i}"))
+    return 50, steps
+
+
+def scenario_title_change() -> Tuple[int, List[Step]]:
+    """窗口标题变化：标题出现未读消息数（不会产生结构变化事件）"""
+    steps = []
+    for i in range(3):
+        steps.append((0.8, 'title', f"微信({i + 1})"))
+        steps.append((0.4, 'reset_title', "微信"))
+    return 50, steps
+
+
+SCENARIOS = {
+    'steady': scenario_steady,
+    'burst': scenario_burst,
+    'long_history': scenario_long_history,
+    'own_echo': scenario_own_echo,
+    'title_change': scenario_title_change,
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def match_detections(expected: List[float], detections: List[float]):
+    """把每次检测和它之前尚未被覆盖的期望事件配对
+
+    一次检测覆盖之前所有未处理的期望事件（一次回复对应一轮消息）；
+    没有任何待处理事件的检测记为重复检测，直到结束都没被覆盖的事件记为漏检。
+    """
+    latencies = []
+    duplicates = 0
+    pending_index = 0
+    for detected_at in detections:
+        covered = 0
+        while pending_index < len(expected) and expected[pending_index] <= detected_at:
+            latencies.append(detected_at - expected[pending_index])
+            pending_index += 1
+            covered += 1
+        if covered == 0:
+            duplicates += 1
+    missed = len(expected) - pending_index
+    return latencies, duplicates, missed
+
+
+def run_scenario(name: str, mode: str, check_interval: float = 0.5, speed: float = 1.0,
+                 settle: float = 2.5, engine: str = 'async') -> dict:
+    """运行一个流量场景，返回统计结果"""
+    history_size, steps = SCENARIOS[name]()
+
+    backend = SimulatedBackend()
+    for i in range(history_size):
+        backend.tree.add_message(f"历史消息{i}", own=(i % 3 == 0))
+
+    expected = []
+
+    def make_action(kind: str, text: str) -> Callable[[], None]:
+        def action():
+            if kind == 'other':
+                expected.append(time.perf_counter())
+                backend.receive_message(text)
+            elif kind == 'own':
+                backend.tree.add_message(text, own=True)
+            elif kind == 'title':
+                expected.append(time.perf_counter())
+                backend.tree.set_title(text)
+            elif kind == 'reset_title':
+                backend.tree.set_title(text)
+        return action
+
+    silent = io.StringIO()
+    with contextlib.redirect_stdout(silent):
+        app = BenchmarkApp(backend)
+        if mode == 'pixel':
+            # 模拟 UI Automation 不可用，只能截图比较
+            app.uia = app.uia_module = None
+            app.detection_mode = 'poll'
+        else:
+            app.detection_mode = mode
+        app.check_interval = check_interval
+        app.engine_mode = engine
+        app.start_monitoring()
+
+    if not app.is_monitoring:
+        raise RuntimeError(f"场景 {name} 无法启动监控")
+
+    walk_calls_start = backend.tree.com_calls
+    ticks_start = app.tick_count
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    with contextlib.redirect_stdout(silent):
+        for delay, kind, text in steps:
+            time.sleep(delay / speed)
+            make_action(kind, text)()
+        # 等待最后一批消息被检测（事件模式下标题变化要等兜底轮询）
+        time.sleep(settle)
+        app.stop_monitoring()
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    ticks = app.tick_count - ticks_start
+    walk_calls = backend.tree.com_calls - walk_calls_start
+
+    latencies, duplicates, missed = match_detections(expected, app.detection_times)
+
+    return {
+        'scenario': name,
+        'mode': mode,
+        'engine': engine,
+        'history_size': history_size,
+        'expected_detections': len(expected),
+        'detections': len(app.detection_times),
+        'missed_detections': missed,
+        'duplicate_detections': duplicates,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'latency_max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+        'ticks': ticks,
+        'ticks_per_second': round(ticks / wall_time, 2) if wall_time > 0 else 0.0,
+        'tree_walk_calls_per_tick': round(walk_calls / ticks, 2) if ticks else 0.0,
+        'com_calls_per_tick': round(app.com_calls_total / app.tick_count, 2) if app.tick_count else 0.0,
+        'cpu_seconds': round(cpu_time, 4),
+        'cpu_percent': round(cpu_time / wall_time * 100, 2) if wall_time > 0 else 0.0,
+        'wall_seconds': round(wall_time, 3),
+    }
+
+
+def measure_tick_throughput(history_size: int = 10000, ticks: int = 2000) -> dict:
+    """没有等待地连续调用 detect_new_message，测量单次检测的开销"""
+    backend = SimulatedBackend()
+    for i in range(history_size):
+        backend.tree.add_message(f"历史消息{i}")
+
+    silent = io.StringIO()
+    with contextlib.redirect_stdout(silent):
+        app = BenchmarkApp(backend)
+        app.find_wechat_window()
+        app.find_chat_area(app.get_wechat_automation_element())
+        app.last_message_hash = app.get_latest_message_signature()
+        app.last_window_title = backend.window.title
+
+        walk_calls_start = backend.tree.com_calls
+        start = time.perf_counter()
+        for i in range(ticks):
+            if i % 100 == 0:
+                backend.receive_message(f"新消息{i}")
+            app.detect_new_message()
+        elapsed = time.perf_counter() - start
+
+    return {
+        'scenario': 'tick_throughput',
+        'history_size': history_size,
+        'ticks': ticks,
+        'ticks_per_second': round(ticks / elapsed, 1) if elapsed > 0 else 0.0,
+        'tick_cost_us': round(elapsed / ticks * 1e6, 2),
+        'tree_walk_calls_per_tick': round((backend.tree.com_calls - walk_calls_start) / ticks, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微信消息检测基准测试（模拟后端）")
+    parser.add_argument('--scenario', default='all', choices=['all'] + list(SCENARIOS))
+    parser.add_argument('--mode', default='both', choices=['both', 'poll', 'event', 'pixel'])
+    parser.add_argument('--interval', type=float, default=0.5, help="轮询间隔（秒）")
+    parser.add_argument('--engine', default='async', choices=['async', 'thread'], help="监控引擎")
+    parser.add_argument('--speed', type=float, default=1.0, help="流量脚本回放倍速")
+    parser.add_argument('--output', help="把JSON结果写入文件（默认输出到终端）")
+    args = parser.parse_args()
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    modes = ['poll', 'event'] if args.mode == 'both' else [args.mode]
+
+    results = []
+    for name in scenarios:
+        for mode in modes:
+            print(f"运行场景 {name}（{mode}）...", file=sys.stderr)
+            results.append(run_scenario(name, mode, args.interval, args.speed, engine=args.engine))
+    print("测量单次检测开销...", file=sys.stderr)
+    results.append(measure_tick_throughput())
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'check_interval': args.interval,
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
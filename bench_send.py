@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送方式基准测试
+功能：在模拟后端上比较两种发送方式——打开表情包面板点击（panel）和粘贴本地图片（paste）——
+      每次发送的耗时（p50/p99）、输入操作次数和成功率，以及剪贴板数据缓存的命中率，
+      结果以JSON输出。模拟后端按 --input-delay 模拟每个输入操作的耗时（对应 pyautogui.PAUSE）
+
+用法：
+    python bench_send.py                          # 两种方式各发送50次
+    python bench_send.py --sends 200 --images 40 --cache-mb 1
+    python bench_send.py --output bench_send.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import SimulatedBackend
+from bench_detection import percentile
+from sticker_paste import PayloadCache
+from wechat_auto_emoji import WeChatAutoEmoji
+
+
+def write_test_bitmap(path: str, size: int, seed: int):
+    """写一张 size x size 的24位BMP图片（不需要Pillow）"""
+    row = bytes((seed * 7 + x * 3) % 256 for x in range(size * 3))
+    padding = b'\0' * ((4 - len(row) % 4) % 4)
+    pixels = (row + padding) * size
+    header = struct.pack('<2sIHHI', b'BM', 54 + len(pixels), 0, 0, 54)
+    info = struct.pack('<IiiHHIIiiII', 40, size, size, 1, 24, 0, len(pixels), 2835, 2835, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(header + info + pixels)
+
+
+def make_sticker_dir(count: int, size: int) -> str:
+    directory = tempfile.mkdtemp(prefix='stickers_')
+    for i in range(count):
+        write_test_bitmap(os.path.join(directory, f"sticker{i:03d}.bmp"), size, i)
+    return directory
+
+
+def run_mode(mode: str, sends: int, sticker_dir: str, input_delay: float, panel_delay: float,
+             cache_bytes: int) -> dict:
+    backend = SimulatedBackend(input_delay=input_delay, panel_delay=panel_delay)
+    silent = io.StringIO()
+    with contextlib.redirect_stdout(silent):
+        app = WeChatAutoEmoji(backend=backend)
+        app.calibration_store = None  # 不读写磁盘上的位置配置和表情包选择记录
+        app.selection_path = None
+        app.reply_rules = None
+        app.find_wechat_window()
+        app.find_chat_area(app.get_wechat_automation_element())
+        app.emoji_button_pos = backend.emoji_button_pos
+        app.emoji_panel_area = backend.emoji_panel_area
+        app.payload_cache = PayloadCache(cache_bytes)
+        app.load_sticker_dir(sticker_dir)
+        app.send_mode = mode
+
+        latencies = []
+        succeeded = 0
+        for _ in range(sends):
+            start = time.perf_counter()
+            if app.send_random_emoji():
+                succeeded += 1
+            latencies.append(time.perf_counter() - start)
+
+    delivered = backend.sent_pastes if mode == "paste" else backend.sent_emojis
+    actions = len(backend.clicks) + backend.scrolls + len(backend.keys)
+    result = {
+        'mode': mode,
+        'sends': sends,
+        'succeeded': succeeded,
+        'delivered': delivered,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'input_actions_per_send': round(actions / sends, 2),
+        'steps': app.send_timings.as_dict(),
+    }
+    if mode == "paste":
+        cache = app.payload_cache
+        result['cache'] = {
+            'entries': len(cache),
+            'bytes': cache.bytes,
+            'hit_rate': round(cache.hit_rate, 3),
+            'evictions': cache.evictions,
+            'encode_ms_total': round(cache.encode_seconds * 1000, 2),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="表情包发送方式基准测试（模拟后端）")
+    parser.add_argument('--sends', type=int, default=50, help="每种方式发送的次数")
+    parser.add_argument('--images', type=int, default=20, help="本地图片数量")
+    parser.add_argument('--image-size', type=int, default=240, help="图片边长（像素）")
+    parser.add_argument('--input-delay', type=float, default=0.1, help="每个输入操作的耗时（秒）")
+    parser.add_argument('--panel-delay', type=float, default=0.2, help="表情包面板打开需要的时间（秒）")
+    parser.add_argument('--cache-mb', type=float, default=32, help="剪贴板数据缓存上限（MB）")
+    parser.add_argument('--output', help="把JSON结果写入文件（默认输出到终端）")
+    args = parser.parse_args()
+
+    sticker_dir = make_sticker_dir(args.images, args.image_size)
+    results = []
+    for mode in ('panel', 'paste'):
+        print(f"测试发送方式 {mode}...", file=sys.stderr)
+        results.append(run_mode(mode, args.sends, sticker_dir, args.input_delay, args.panel_delay,
+                                int(args.cache_mb * 1024 * 1024)))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'input_delay': args.input_delay,
+        'panel_delay': args.panel_delay,
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包位置配置文件
+功能：把设置好的表情包按钮和面板位置保存到磁盘，下次启动直接加载，不用再按热键设置。
+      位置以微信窗口左上角为原点保存，窗口移动后仍然有效；配置按窗口大小和DPI分别保存，
+      窗口大小或缩放比例变化时自动回到交互式设置
+"""
+
+import json
+import os
+import time
+from typing import Optional, Tuple
+
+from backends import Point
+
+# 配置文件格式版本，格式不兼容地变化时加一
+PROFILE_VERSION = 1
+
+# 默认配置文件位置：程序所在目录
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration_profiles.json')
+
+# 面板的宽和高都必须大于它的两倍，否则一定是设置错了
+PANEL_MARGIN = 20
+
+
+def profile_key(window, dpi: int) -> str:
+    """配置的键：窗口大小和DPI"""
+    return f"{window.width}x{window.height}@{dpi}"
+
+
+def make_panel_area(left: int, top: int, right: int, bottom: int) -> dict:
+    return {
+        'left': left,
+        'top': top,
+        'right': right,
+        'bottom': bottom,
+        'width': right - left,
+        'height': bottom - top,
+    }
+
+
+class CalibrationStore:
+    """按窗口大小和DPI保存的表情包位置配置"""
+
+    def __init__(self, path: str = DEFAULT_PROFILE_PATH):
+        self.path = path
+        self._profiles = None
+
+    def _load_all(self) -> dict:
+        if self._profiles is None:
+            self._profiles = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('version') == PROFILE_VERSION:
+                        self._profiles = data.get('profiles', {})
+                    else:
+                        print(f"配置文件版本不匹配（{data.get('version')}），忽略已保存的位置")
+                except (OSError, ValueError) as e:
+                    print(f"读取配置文件失败: {e}")
+        return self._profiles
+
+    def load(self, window, dpi: int) -> Optional[Tuple[Point, dict, dict]]:
+        """加载与窗口大小和DPI匹配的配置
+
+        返回换算到当前窗口位置的 (按钮位置, 面板区域, 面板布局)。面板布局中 'grid' 为
+        EmojiGrid.to_dict()、'layout' 为 PanelLayout.to_dict() 的结果（都相对面板左上角），
+        还没有检测过的项不存在。
+        """
+        profile = self._load_all().get(profile_key(window, dpi))
+        if not profile:
+            return None
+        try:
+            button_x, button_y = profile['button']
+            left, top, right, bottom = profile['panel']
+        except (KeyError, TypeError, ValueError):
+            print("配置内容不完整，忽略已保存的位置")
+            return None
+        button = Point(window.left + button_x, window.top + button_y)
+        panel = make_panel_area(window.left + left, window.top + top,
+                                window.left + right, window.top + bottom)
+        extras = {key: profile[key] for key in ('grid', 'layout') if profile.get(key)}
+        return button, panel, extras
+
+    def save(self, window, dpi: int, button: Point, panel: dict, extras: Optional[dict] = None) -> bool:
+        """保存当前窗口的表情包位置（相对窗口左上角）"""
+        profiles = self._load_all()
+        profile = {
+            'button': [button.x - window.left, button.y - window.top],
+            'panel': [panel['left'] - window.left, panel['top'] - window.top,
+                      panel['right'] - window.left, panel['bottom'] - window.top],
+            'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        for key, value in (extras or {}).items():
+            if value:
+                profile[key] = value
+        profiles[profile_key(window, dpi)] = profile
+        data = {'version': PROFILE_VERSION, 'profiles': profiles}
+        try:
+            # 先写临时文件再替换，避免写到一半中断导致配置文件损坏
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            return True
+        except OSError as e:
+            print(f"保存配置文件失败: {e}")
+            return False
+
+
+def validate_calibration(window, button: Point, panel: dict,
+                         chat_rect: Optional[Tuple[int, int, int, int]] = None) -> Optional[str]:
+    """检查加载的位置是否可用，可用时返回None，否则返回原因
+
+    只做几何检查，不需要任何输入操作：按钮和面板在窗口范围内，面板足够大，
+    按钮位于聊天区域下方的工具栏（已知聊天区域时）。
+    """
+    left, top = window.left, window.top
+    right, bottom = left + window.width, top + window.height
+
+    if not (left <= button.x < right and top <= button.y < bottom):
+        return "表情包按钮不在微信窗口内"
+    if panel['width'] <= 2 * PANEL_MARGIN or panel['height'] <= 2 * PANEL_MARGIN:
+        return "表情包面板区域太小"
+    if panel['right'] <= left or panel['left'] >= right or panel['bottom'] <= top or panel['top'] >= bottom:
+        return "表情包面板与微信窗口不重叠"
+    if chat_rect is not None:
+        chat_left, chat_top, chat_right, chat_bottom = chat_rect
+        if not (chat_left <= button.x <= chat_right) or button.y < chat_bottom:
+            return "表情包按钮不在聊天区域下方的工具栏"
+    return None
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天区域定位
+功能：第一次查找聊天区域时遍历整个微信窗口，找到面积最大的列表控件，并记下它从窗口根元素出发的路径
+      和 RuntimeId。之后每次检测只读取一次聊天区域的位置来确认元素仍然有效；微信重建了聊天列表
+      （例如切换聊天）或窗口改变大小时，沿记住的路径逐层查找子元素重新定位，路径断开时只在断开处
+      下面查找，都找不到时才重新遍历整个窗口
+"""
+
+from typing import Optional, List, Tuple
+
+# 路径中的一层：(控件类型, 类名, AutomationId, 在同类型兄弟元素中的序号)
+PathStep = Tuple[int, str, str, int]
+
+# revalidate 的结果
+AREA_OK = 'ok'          # 元素有效，位置没有变化
+AREA_MOVED = 'moved'    # 元素有效，但位置变了（窗口移动、改变大小，或者换成了另一个元素）
+AREA_STALE = 'stale'    # 元素已失效（读取失败或位置为空）
+
+
+def _rect_tuple(rect) -> Tuple[int, int, int, int]:
+    return (rect.left, rect.top, rect.right, rect.bottom)
+
+
+def _area(rect: Tuple[int, int, int, int]) -> int:
+    left, top, right, bottom = rect
+    if right <= left or bottom <= top:
+        return 0
+    return (right - left) * (bottom - top)
+
+
+class ChatAreaLocator:
+    """聊天区域元素的查找、缓存和重新验证"""
+
+    def __init__(self, uia, uia_module, max_depth: int = 16):
+        self.uia = uia
+        self.uia_module = uia_module
+        self.max_depth = max_depth
+        self.path: Optional[List[PathStep]] = None
+        self.runtime_id: Optional[tuple] = None
+        self.rect: Optional[Tuple[int, int, int, int]] = None
+        self._list_condition = None
+        # 统计
+        self.full_searches = 0       # 遍历整个窗口
+        self.path_hits = 0           # 沿路径直接找到
+        self.targeted_searches = 0   # 路径断开后只在断开处下面查找
+        self.revalidations = 0
+        self.rebuilds = 0            # 重新定位后 RuntimeId 变了
+
+    def fork(self) -> 'ChatAreaLocator':
+        """复制记住的路径（独立聊天窗口的元素树结构相同），不复制元素本身"""
+        locator = ChatAreaLocator(self.uia, self.uia_module, self.max_depth)
+        locator.path = list(self.path) if self.path else None
+        return locator
+
+    def _condition_for(self, control_type: int):
+        return self.uia.CreatePropertyCondition(self.uia_module.UIA_ControlTypePropertyId, control_type)
+
+    def _runtime_id(self, element) -> Optional[tuple]:
+        try:
+            return tuple(element.GetRuntimeId())
+        except Exception:
+            return None
+
+    def _largest_list(self, scope_root):
+        """scope_root 下面面积最大的列表控件"""
+        if self._list_condition is None:
+            self._list_condition = self._condition_for(self.uia_module.UIA_ListControlTypeId)
+        lists = scope_root.FindAll(self.uia_module.TreeScope_Descendants, self._list_condition)
+        largest, max_size = None, 0
+        for i in range(lists.Length):
+            element = lists.GetElement(i)
+            try:
+                size = _area(_rect_tuple(element.CurrentBoundingRectangle))
+            except Exception:
+                continue
+            if size > max_size:
+                largest, max_size = element, size
+        return largest
+
+    @staticmethod
+    def _matches(element, class_name: str, automation_id: str) -> bool:
+        return ((element.CurrentClassName or '') == class_name
+                and (element.CurrentAutomationId or '') == automation_id)
+
+    def _compute_path(self, root, element) -> Optional[List[PathStep]]:
+        """从元素向上走到窗口根元素，记下每一层（只在完整查找后执行一次）"""
+        walker = self.uia.RawViewWalker
+        steps = []
+        current = element
+        for _ in range(self.max_depth):
+            if self.uia.CompareElements(current, root):
+                steps.reverse()
+                return steps
+            parent = walker.GetParentElement(current)
+            if parent is None:
+                return None
+            control_type = current.CurrentControlType
+            siblings = parent.FindAll(self.uia_module.TreeScope_Children, self._condition_for(control_type))
+            index = 0
+            for i in range(siblings.Length):
+                if self.uia.CompareElements(siblings.GetElement(i), current):
+                    index = i
+                    break
+            steps.append((control_type, current.CurrentClassName or '', current.CurrentAutomationId or '', index))
+            current = parent
+        return None
+
+    def _follow_path(self, root) -> list:
+        """沿路径逐层查找，返回找到的各层元素（第一个是根元素），路径断开时在断开处停下"""
+        chain = [root]
+        current = root
+        for control_type, class_name, automation_id, index in self.path:
+            children = current.FindAll(self.uia_module.TreeScope_Children, self._condition_for(control_type))
+            match = None
+            if index < children.Length and self._matches(children.GetElement(index), class_name, automation_id):
+                match = children.GetElement(index)
+            else:
+                # 同类型的兄弟元素增减了，按类名和 AutomationId 找
+                for i in range(children.Length):
+                    if self._matches(children.GetElement(i), class_name, automation_id):
+                        match = children.GetElement(i)
+                        break
+            if match is None:
+                break
+            chain.append(match)
+            current = match
+        return chain
+
+    def _remember(self, element):
+        runtime_id = self._runtime_id(element)
+        if self.runtime_id is not None and runtime_id != self.runtime_id:
+            self.rebuilds += 1
+        self.runtime_id = runtime_id
+        self.rect = _rect_tuple(element.CurrentBoundingRectangle)
+        return element
+
+    def locate(self, root):
+        """查找聊天区域，找不到时返回 None"""
+        if self.path:
+            chain = self._follow_path(root)
+            if len(chain) == len(self.path) + 1:
+                element = chain[-1]
+                try:
+                    found = _area(_rect_tuple(element.CurrentBoundingRectangle)) > 0
+                except Exception:
+                    found = False
+                if found:
+                    self.path_hits += 1
+                    return self._remember(element)
+                ancestor = chain[-2]
+            else:
+                ancestor = chain[-1]
+            if len(chain) > 1:
+                self.targeted_searches += 1
+                element = self._largest_list(ancestor)
+                if element is not None:
+                    self.path = self._compute_path(root, element) or self.path
+                    return self._remember(element)
+
+        self.full_searches += 1
+        element = self._largest_list(root)
+        if element is None:
+            return None
+        self.path = self._compute_path(root, element)
+        return self._remember(element)
+
+    def revalidate(self, element) -> str:
+        """确认元素仍然有效（只读取一次位置）"""
+        self.revalidations += 1
+        try:
+            rect = _rect_tuple(element.CurrentBoundingRectangle)
+        except Exception:
+            return AREA_STALE
+        if _area(rect) == 0:
+            return AREA_STALE
+        if rect != self.rect:
+            return AREA_MOVED
+        return AREA_OK
+
+    def describe(self) -> str:
+        depth = f"路径 {len(self.path)} 层" if self.path else "没有记住路径"
+        return (f"聊天区域定位（{depth}）: 完整查找 {self.full_searches} 次，沿路径定位 {self.path_hits} 次，"
+                f"局部查找 {self.targeted_searches} 次，验证 {self.revalidations} 次，重建 {self.rebuilds} 次")
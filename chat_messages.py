@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天消息解析
+功能：把聊天列表快照中的每一项解析成结构化的消息记录（发送者、文本、类型、时间、是否自己发送），
+      并为每条消息生成与位置无关的标识：聊天列表滚动或窗口大小变化时标识不变，
+      消息检测比较标识的集合，不会因为位置变化误判为新消息。
+      解析只依赖快照元素，可以用保存下来的聊天列表（fixture）离线测试
+"""
+
+import datetime
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, List, Tuple
+
+from chat_snapshot import ChatSnapshot, SnapshotElement
+
+FIXTURE_VERSION = 1
+
+# 消息中的头像按钮（UIA_ButtonControlTypeId），按钮名称是发送者的昵称
+SENDER_CONTROL_TYPE = 50000
+
+# 非文本消息在列表项名称中的标记
+KIND_MARKERS = (
+    ('[动画表情]', 'sticker'),
+    ('[表情]', 'sticker'),
+    ('[图片]', 'image'),
+    ('[语音]', 'voice'),
+    ('[视频]', 'video'),
+    ('[文件]', 'file'),
+    ('[链接]', 'link'),
+    ('[位置]', 'location'),
+    ('[名片]', 'card'),
+    ('[聊天记录]', 'forward'),
+)
+
+# 不是消息的列表项：时间分隔行和系统提示
+NON_MESSAGE_KINDS = ('time', 'system')
+
+SYSTEM_PATTERN = re.compile(r'撤回了一条消息|加入了群聊|移出了群聊|修改群名为|拍了拍|以上是打招呼的内容')
+
+WEEKDAYS = '一二三四五六日'
+TIME_PATTERNS = (
+    ('today', re.compile(r'^(\d{1,2}):(\d{2})$')),
+    ('yesterday', re.compile(r'^昨天\s*(\d{1,2}):(\d{2})$')),
+    ('weekday', re.compile(r'^(?:星期|周)([一二三四五六日天])\s*(\d{1,2}):(\d{2})$')),
+    ('date', re.compile(r'^(?:(\d{4})年)?(\d{1,2})月(\d{1,2})日\s*(\d{1,2}):(\d{2})$')),
+    ('slash', re.compile(r'^(\d{4})/(\d{1,2})/(\d{1,2})\s+(\d{1,2}):(\d{2})$')),
+)
+
+
+def parse_time_label(label: str, now: Optional[float] = None) -> Optional[float]:
+    """把聊天列表中的时间分隔行（"14:32"、"昨天 09:15"、"星期三 20:01"、"3月5日 08:00"）
+    换算成时间戳，不是时间分隔行时返回 None"""
+    label = label.strip()
+    today = datetime.datetime.fromtimestamp(time.time() if now is None else now).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    for form, pattern in TIME_PATTERNS:
+        match = pattern.match(label)
+        if not match:
+            continue
+        groups = match.groups()
+        try:
+            if form == 'today':
+                day = today
+            elif form == 'yesterday':
+                day = today - datetime.timedelta(days=1)
+            elif form == 'weekday':
+                weekday = 6 if groups[0] == '天' else WEEKDAYS.index(groups[0])
+                # 微信只对一周之内的消息显示星期
+                day = today - datetime.timedelta(days=(today.weekday() - weekday) % 7 or 7)
+                groups = groups[1:]
+            elif form == 'date':
+                year = int(groups[0]) if groups[0] else today.year
+                day = today.replace(year=year, month=int(groups[1]), day=int(groups[2]))
+                groups = groups[3:]
+            else:
+                day = today.replace(year=int(groups[0]), month=int(groups[1]), day=int(groups[2]))
+                groups = groups[3:]
+            stamp = day.replace(hour=int(groups[-2]), minute=int(groups[-1]))
+        except ValueError:
+            return None
+        return stamp.timestamp()
+    return None
+
+
+class MessageRecord:
+    """聊天列表中的一条消息"""
+    __slots__ = ('sender', 'text', 'kind', 'timestamp', 'own', 'identity')
+
+    def __init__(self, sender: Optional[str], text: str, kind: str, timestamp: Optional[float],
+                 own: bool, identity: str):
+        self.sender = sender          # 头像按钮的名称，没有头像时为 None
+        self.text = text
+        self.kind = kind              # text/sticker/image/.../time/system
+        self.timestamp = timestamp    # 所在时间段的时间（上方最近的时间分隔行），不知道时为 None
+        self.own = own
+        self.identity = identity      # 与位置无关的标识
+
+    @property
+    def is_message(self) -> bool:
+        return self.kind not in NON_MESSAGE_KINDS
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self) -> str:
+        who = "自己" if self.own else (self.sender or "对方")
+        return f"<{self.kind} {who}: {self.text!r} {self.identity}>"
+
+
+class MessageParser:
+    """把快照元素解析成消息记录
+
+    判断自己发送的消息：气泡的类名包含 right/self，或者气泡在 center_x 右侧；
+    center_x 为 None 时用列表项自身的水平中点。每条消息只判断一次，结果按标识和气泡所在的一侧记住
+    （标识不区分两侧：对方在"hi"之后发的"ok"和自己在"hi"之后发的"ok"标识相同），
+    center_x 变化（窗口移动或改变大小）时清空。
+
+    标识由消息内容（类型、发送者、文本）、前一条消息的内容和
+    前面连续相同内容的条数得到，不包含位置和时间分隔行（微信过了零点会把"14:32"改成"昨天 14:32"），
+    所以连续发的几条"好的"各有不同的标识。尾部快照中的第一条不知道前一条消息，
+    它的标识与完整快照中不同，只比较尾部最后几条消息时不受影响。
+    """
+
+    def __init__(self, own_classes: Tuple[str, ...] = ('right', 'self'), cache_size: int = 1024):
+        self.own_classes = own_classes
+        self.cache_size = cache_size
+        self._own_cache: 'OrderedDict[str, bool]' = OrderedDict()  # 标识和一侧 → 是否自己发送
+        self._cache_center_x = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def is_own(self, item: SnapshotElement, center_x: Optional[int] = None) -> bool:
+        if center_x is None and item.rect:
+            center_x = (item.rect[0] + item.rect[2]) // 2
+        for child in item.children:
+            class_name = (child.class_name or '').lower()
+            if any(marker in class_name for marker in self.own_classes):
+                return True
+            if child.rect and center_x is not None and child.rect[0] > center_x:
+                return True
+        return False
+
+    @staticmethod
+    def sender_of(item: SnapshotElement) -> Optional[str]:
+        for element in item.iter_subtree():
+            if element.control_type == SENDER_CONTROL_TYPE and element.name:
+                return element.name
+        return None
+
+    @staticmethod
+    def classify(text: str, sender: Optional[str]) -> str:
+        for marker, kind in KIND_MARKERS:
+            if text.startswith(marker):
+                return kind
+        # 时间分隔行和系统提示没有头像
+        if sender is None:
+            if parse_time_label(text, 0) is not None:
+                return 'time'
+            if SYSTEM_PATTERN.search(text):
+                return 'system'
+        return 'text'
+
+    @staticmethod
+    def side_key(item: SnapshotElement, center_x: Optional[int]) -> str:
+        """列表项两端子元素的类名和是否在中线右侧
+
+        头像和气泡排在列表项的一侧，自己和对方的消息首尾两个子元素的位置不同，
+        只读取两个子元素，比逐个判断所有子元素便宜。
+        """
+        if center_x is None and item.rect:
+            center_x = (item.rect[0] + item.rect[2]) // 2
+        parts = []
+        for child in (item.children[0], item.children[-1]):
+            right = bool(child.rect and center_x is not None and child.rect[0] > center_x)
+            parts.append(f"{child.class_name or ''}:{right:d}")
+        return '|'.join(parts)
+
+    def _classify_own(self, identity: str, item: SnapshotElement, center_x: Optional[int]) -> bool:
+        # 没有子元素（逐个读取属性时只有最新消息有子树）的判断不可靠，不记住
+        if not item.children:
+            self.cache_misses += 1
+            return self.is_own(item, center_x)
+        key = f"{identity}|{self.side_key(item, center_x)}"
+        own = self._own_cache.get(key)
+        if own is not None:
+            self.cache_hits += 1
+            return own
+        self.cache_misses += 1
+        own = self._own_cache[key] = self.is_own(item, center_x)
+        if len(self._own_cache) > self.cache_size:
+            self._own_cache.popitem(last=False)
+        return own
+
+    def parse(self, items: List[SnapshotElement], now: Optional[float] = None,
+              center_x: Optional[int] = None) -> List[MessageRecord]:
+        if center_x != self._cache_center_x:
+            self._own_cache.clear()
+            self._cache_center_x = center_x
+        records = []
+        timestamp = None
+        previous = ''
+        repeats = 0
+        for item in items:
+            text = (item.name or '').strip()
+            sender = self.sender_of(item)
+            kind = self.classify(text, sender)
+            if kind == 'time':
+                timestamp = parse_time_label(text, now)
+
+            content = f"{kind}|{sender or ''}|{text}"
+            repeats = repeats + 1 if content == previous else 0
+            identity = hashlib.blake2b(f"{content}|{previous}|{repeats}".encode('utf-8'),
+                                       digest_size=8).hexdigest()
+            previous = content
+            own = kind not in NON_MESSAGE_KINDS and self._classify_own(identity, item, center_x)
+            records.append(MessageRecord(sender, text, kind, timestamp, own, identity))
+        return records
+
+    def describe(self) -> str:
+        total = self.cache_hits + self.cache_misses
+        rate = self.cache_hits / total * 100 if total else 0.0
+        return f"消息来源判断: 记住 {len(self._own_cache)} 条，命中率 {rate:.0f}%（{self.cache_hits}/{total}）"
+
+    def records(self, snapshot: ChatSnapshot, center_x: Optional[int] = None) -> List[MessageRecord]:
+        """快照的消息记录（每份快照只解析一次）"""
+        if snapshot.records is None:
+            snapshot.records = self.parse(snapshot.items, snapshot.timestamp, center_x)
+        return snapshot.records
+
+
+def save_fixture(path: str, items: List[SnapshotElement], center_x: Optional[int] = None,
+                 timestamp: Optional[float] = None):
+    """把聊天列表保存为 fixture（JSON），用于离线测试解析"""
+    data = {
+        'version': FIXTURE_VERSION,
+        'timestamp': timestamp if timestamp is not None else time.time(),
+        'center_x': center_x,
+        'items': [item.to_dict() for item in items],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def load_fixture(path: str) -> Tuple[List[SnapshotElement], Optional[int], Optional[float]]:
+    """读取 fixture，返回 (列表项, center_x, 保存时间)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != FIXTURE_VERSION:
+        raise ValueError(f"fixture 版本不匹配（{data.get('version')}）")
+    items = [SnapshotElement.from_dict(item) for item in data['items']]
+    return items, data.get('center_x'), data.get('timestamp')
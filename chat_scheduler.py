@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多聊天调度器
+功能：同时监控多个聊天（微信主窗口和弹出的独立聊天窗口），每个聊天有自己的检测状态
+      （签名、历史、冷却、窗口标题）。活跃的聊天检测得更频繁，空闲的聊天逐渐降低频率，
+      支持结构变化事件的聊天在空闲时几乎不占用CPU；所有点击经由同一个输入操作队列执行
+"""
+
+import heapq
+import threading
+import time
+from typing import Optional, List, Dict
+
+from action_queue import ActionQueue
+from adaptive_interval import AdaptiveInterval
+from backends import Point
+
+
+def translate_calibration(button_pos, panel_area: dict, from_rect, to_rect):
+    """把一个窗口里设置的表情包按钮和面板位置换算到另一个窗口
+
+    表情包工具栏紧贴在聊天区域下方，因此以聊天区域的左下角为基准平移。
+    from_rect / to_rect 为两个窗口聊天区域的 (left, top, right, bottom)。
+    """
+    dx = to_rect[0] - from_rect[0]
+    dy = to_rect[3] - from_rect[3]
+    new_button = Point(button_pos.x + dx, button_pos.y + dy)
+    new_panel = dict(panel_area)
+    for key in ('left', 'right'):
+        new_panel[key] = panel_area[key] + dx
+    for key in ('top', 'bottom'):
+        new_panel[key] = panel_area[key] + dy
+    return new_button, new_panel
+
+
+class ChatTarget:
+    """一个被监控的聊天"""
+
+    def __init__(self, detector, pacer: AdaptiveInterval):
+        self.detector = detector          # 该聊天专用的 WeChatAutoEmoji，保存检测状态
+        self.key = detector.wechat_hwnd
+        self.pacer = pacer                # 自适应检测间隔
+        self.next_due = 0.0
+        self.ticks = 0
+        self.detections = 0
+        self.event_source = None
+        self.in_tick = False              # 正在检测中
+        self.woken = False                # 检测过程中又收到了变化通知
+
+    @property
+    def interval(self) -> float:
+        """当前检测间隔"""
+        return self.pacer.interval
+
+    @property
+    def title(self) -> str:
+        window = self.detector.wechat_window
+        return window.title if window else ""
+
+
+class ChatMonitor:
+    """多聊天监控的公共部分：添加聊天窗口、订阅结构变化和调度状态
+
+    ChatScheduler（调度线程）和 AsyncEngine（asyncio 事件循环）共用，
+    子类实现 _register（开始调度新加入的聊天）和 wake（让某个聊天尽快检测）。
+    """
+
+    def __init__(self, backend, uia, detector_factory, min_interval: float = 0.3,
+                 max_interval: float = 5.0, backoff: float = 1.5):
+        self.backend = backend
+        self.uia = uia
+        self.detector_factory = detector_factory  # 创建单个聊天检测器的函数
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.targets: Dict[int, ChatTarget] = {}
+        self.is_running = False
+        self.total_ticks = 0
+
+    def _register(self, target: ChatTarget):
+        raise NotImplementedError
+
+    def wake(self, key):
+        raise NotImplementedError
+
+    def add_window(self, window, button_pos=None, panel_area=None,
+                   reference_rect=None) -> Optional[ChatTarget]:
+        """添加一个聊天窗口
+
+        button_pos / panel_area 为参考窗口中设置的表情包位置，reference_rect 为参考窗口
+        聊天区域的矩形；两者都提供时会换算到这个窗口。
+        """
+        if window._hWnd in self.targets:
+            return self.targets[window._hWnd]
+
+        detector = self.detector_factory()
+        if not detector.attach_window(window):
+            print(f"无法监控聊天窗口: {window.title}")
+            return None
+
+        if button_pos and panel_area:
+            target_rect = detector.get_chat_area_rect()
+            if reference_rect and target_rect:
+                button_pos, panel_area = translate_calibration(
+                    button_pos, panel_area, reference_rect, target_rect)
+            detector.emoji_button_pos = button_pos
+            detector.emoji_panel_area = panel_area
+
+        target = ChatTarget(detector, AdaptiveInterval(self.min_interval, self.max_interval, self.backoff))
+        self._subscribe(target)
+        if target.event_source is None:
+            # 没有结构变化事件的聊天只能靠轮询，空闲间隔不能太长
+            target.pacer.max_interval = max(self.min_interval, self.max_interval / 4)
+        self._register(target)
+        print(f"已添加监控聊天: {target.title}")
+        return target
+
+    def discover(self, button_pos=None, panel_area=None, reference_rect=None) -> List[ChatTarget]:
+        """添加所有当前打开的聊天窗口"""
+        added = []
+        for window in self.backend.list_chat_windows():
+            if window._hWnd not in self.targets:
+                target = self.add_window(window, button_pos, panel_area, reference_rect)
+                if target:
+                    added.append(target)
+        return added
+
+    def _subscribe(self, target: ChatTarget):
+        """订阅聊天列表的结构变化，收到通知时立即唤醒该聊天"""
+        detector = target.detector
+        if not detector.chat_area_element or not self.uia:
+            return
+        source = self.backend.create_event_source(self.uia)
+        if source is None:
+            return
+        source.set_listener(lambda change, target=target: self._on_change(target, change))
+        if source.start(detector.chat_area_element):
+            target.event_source = source
+
+    def _resubscribe(self, target: ChatTarget):
+        """聊天列表被微信重建，结构变化订阅跟着换到新的元素上"""
+        if target.event_source:
+            target.event_source.stop()
+            target.event_source = None
+        self._subscribe(target)
+
+    def _stop_event_sources(self):
+        for target in list(self.targets.values()):
+            if target.event_source:
+                target.event_source.stop()
+                target.event_source = None
+
+    def _on_change(self, target: ChatTarget, change):
+        target.detector.note_change(change.timestamp)
+        self.wake(target.key)
+
+    def status(self) -> List[dict]:
+        """每个聊天的调度状态"""
+        now = time.time()
+        return [{
+            'title': target.title,
+            'interval': target.interval,
+            'rate_per_minute': target.pacer.rate_per_minute(now),
+            'next_in': max(0.0, target.next_due - now),
+            'event_driven': target.event_source is not None,
+            'ticks': target.ticks,
+            'detections': target.detections,
+        } for target in list(self.targets.values())]
+
+
+class ChatScheduler(ChatMonitor):
+    """多聊天调度器
+
+    按每个聊天的下一次检测时间维护一个最小堆，调度线程只在最早的聊天到期
+    或收到结构变化通知时醒来。检测到新消息后把回复操作交给输入操作队列。
+    """
+
+    def __init__(self, backend, uia, detector_factory, min_interval: float = 0.3,
+                 max_interval: float = 5.0, backoff: float = 1.5,
+                 action_queue: Optional[ActionQueue] = None):
+        super().__init__(backend, uia, detector_factory, min_interval, max_interval, backoff)
+        self.action_queue = action_queue or ActionQueue()
+
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _register(self, target: ChatTarget):
+        with self._cond:
+            self.targets[target.key] = target
+            self._schedule(target, time.time())
+            self._cond.notify()
+
+    def remove(self, key):
+        with self._cond:
+            target = self.targets.pop(key, None)
+        if target and target.event_source:
+            target.event_source.stop()
+
+    def wake(self, key):
+        """让某个聊天尽快检测（可在任意线程调用）"""
+        with self._cond:
+            target = self.targets.get(key)
+            if target is None:
+                return
+            if target.in_tick:
+                # 正在检测，检测结束后立即再检测一次
+                target.woken = True
+                return
+            now = time.time()
+            if target.next_due > now:
+                self._schedule(target, now)
+                self._cond.notify()
+
+    def _schedule(self, target: ChatTarget, due: float):
+        # 堆中的旧条目不删除，弹出时与 next_due 不一致的直接跳过
+        target.next_due = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, target.key))
+
+    def start(self):
+        if self.is_running:
+            return
+        self.action_queue.start()
+        self.is_running = True
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        print(f"多聊天监控已启动，共 {len(self.targets)} 个聊天")
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+        self._stop_event_sources()
+        self.action_queue.stop()
+        print("多聊天监控已停止")
+
+    def _pop_due(self) -> Optional[ChatTarget]:
+        """等待下一个到期的聊天"""
+        with self._cond:
+            while self.is_running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, key = self._heap[0]
+                target = self.targets.get(key)
+                if target is None or due != target.next_due:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                target.in_tick = True
+                target.woken = False
+                return target
+        return None
+
+    def _loop(self):
+        while self.is_running:
+            target = self._pop_due()
+            if target is None:
+                break
+            try:
+                self._tick(target)
+            except Exception as e:
+                print(f"检测聊天 {target.title} 时出错: {e}")
+                with self._cond:
+                    target.in_tick = False
+                    if target.key in self.targets:
+                        self._schedule(target, time.time() + self.max_interval)
+
+    def _tick(self, target: ChatTarget):
+        detector = target.detector
+        if not self.backend.is_window_alive(detector.wechat_window):
+            print(f"聊天窗口已关闭，停止监控: {target.title}")
+            target.in_tick = False
+            self.remove(target.key)
+            return
+
+        if self.action_queue.has_pending(target.key):
+            # 回复还没有发送完时不检测：发送线程正在使用同一个检测器（消息解析的缓存、冷却状态）
+            with self._cond:
+                target.in_tick = False
+                if target.key in self.targets:
+                    self._schedule(target, time.time() + target.interval)
+            return
+
+        chat_area = detector.chat_area_element
+        detected = detector.detect_new_message()
+        if detector.chat_area_element is not chat_area:
+            self._resubscribe(target)
+        target.ticks += 1
+        self.total_ticks += 1
+        now = time.time()
+
+        reply = detector.make_reply() if detected else None
+        if detected:
+            target.detections += 1
+        if reply is not None:
+            print(f"聊天 {target.title} 检测到新消息，加入发送队列")
+            self.action_queue.submit(target.key, reply)
+
+        interval = target.pacer.record(detected, now)
+        with self._cond:
+            target.in_tick = False
+            if target.key in self.targets:
+                due = now if target.woken else now + interval
+                self._schedule(target, due)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天列表快照
+功能：每次检测只遍历一次聊天区域，通过 CacheRequest 批量获取子元素的属性，
+      所有检测方法都从同一份快照读取，并统计每次检测的跨进程COM调用次数
+"""
+
+import time
+from typing import Optional, List, Tuple
+
+# 快照中需要的元素属性
+SNAPSHOT_PROPERTIES = (
+    'UIA_NamePropertyId',
+    'UIA_ControlTypePropertyId',
+    'UIA_AutomationIdPropertyId',
+    'UIA_BoundingRectanglePropertyId',
+    'UIA_ClassNamePropertyId',
+)
+
+
+class SnapshotElement:
+    """快照中的一个元素（属性已读取到本地，访问不再产生COM调用）"""
+    __slots__ = ('name', 'control_type', 'automation_id', 'class_name', 'rect', 'children')
+
+    def __init__(self, name='', control_type=0, automation_id='', class_name='',
+                 rect: Optional[Tuple[int, int, int, int]] = None, children=None):
+        self.name = name
+        self.control_type = control_type
+        self.automation_id = automation_id
+        self.class_name = class_name
+        self.rect = rect  # (left, top, right, bottom)，读取失败时为 None
+        self.children = children if children is not None else []
+
+    def iter_subtree(self):
+        """先序遍历自身及所有子孙元素（与 TreeScope_Subtree 的顺序一致）"""
+        yield self
+        for child in self.children:
+            yield from child.iter_subtree()
+
+    def to_dict(self) -> dict:
+        """转换为可以保存为JSON的字典（省略空属性）"""
+        data = {'name': self.name, 'control_type': self.control_type}
+        if self.automation_id:
+            data['automation_id'] = self.automation_id
+        if self.class_name:
+            data['class_name'] = self.class_name
+        if self.rect is not None:
+            data['rect'] = list(self.rect)
+        if self.children:
+            data['children'] = [child.to_dict() for child in self.children]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SnapshotElement':
+        rect = data.get('rect')
+        return cls(
+            name=data.get('name', ''),
+            control_type=data.get('control_type', 0),
+            automation_id=data.get('automation_id', ''),
+            class_name=data.get('class_name', ''),
+            rect=tuple(rect) if rect is not None else None,
+            children=[cls.from_dict(child) for child in data.get('children', [])],
+        )
+
+
+def _rect_tuple(rect) -> Optional[Tuple[int, int, int, int]]:
+    if rect is None:
+        return None
+    return (rect.left, rect.top, rect.right, rect.bottom)
+
+
+class ChatSnapshot:
+    """聊天区域在某一时刻的快照"""
+
+    def __init__(self, items: List[SnapshotElement], com_calls: int, timestamp: Optional[float] = None,
+                 is_tail: bool = False, has_more: bool = False):
+        self.items = items
+        self.com_calls = com_calls  # 构建快照产生的跨进程调用次数
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.is_tail = is_tail      # 是否只包含列表尾部的消息
+        self.has_more = has_more    # 尾部快照之前是否还有更早的消息
+        self.appended = 0           # 与上一次快照相比新增的消息数量（由增量签名引擎填写）
+        self.records = None         # 解析出的消息记录（由 MessageParser 填写）
+
+    @property
+    def count(self) -> int:
+        """快照中的元素数量（尾部快照只是尾部的数量）"""
+        return len(self.items)
+
+    @property
+    def latest(self) -> Optional[SnapshotElement]:
+        return self.items[-1] if self.items else None
+
+
+class ChatSnapshotBuilder:
+    """构建聊天区域快照
+
+    优先使用 CacheRequest + FindAllBuildCache，一次跨进程调用取回所有子元素及其
+    子树的属性；当前环境不支持缓存请求时，退回逐个读取 Current* 属性。
+    """
+
+    def __init__(self, uia, uia_module):
+        self.uia = uia
+        self.uia_module = uia_module
+        self._cache_request = None
+        self._true_condition = None
+        self.use_cache = True
+
+    def _get_cache_request(self):
+        if self._cache_request is None:
+            cache_request = self.uia.CreateCacheRequest()
+            for property_name in SNAPSHOT_PROPERTIES:
+                cache_request.AddProperty(getattr(self.uia_module, property_name))
+            # 缓存每个子元素的整个子树，解析发送者和判断消息来源时不用再查找
+            cache_request.TreeScope = self.uia_module.TreeScope_Subtree
+            self._cache_request = cache_request
+        return self._cache_request
+
+    def build(self, chat_element) -> ChatSnapshot:
+        if self._true_condition is None:
+            self._true_condition = self.uia.CreateTrueCondition()
+
+        if self.use_cache:
+            try:
+                return self._build_cached(chat_element)
+            except (AttributeError, NotImplementedError) as e:
+                print(f"当前环境不支持批量缓存读取，改为逐个读取属性: {e}")
+                self.use_cache = False
+        return self._build_uncached(chat_element)
+
+    def build_tail(self, chat_element, limit: int) -> ChatSnapshot:
+        """只读取聊天列表最后 limit 个子元素"""
+        if self.use_cache:
+            try:
+                return self._build_tail_cached(chat_element, limit)
+            except (AttributeError, NotImplementedError) as e:
+                print(f"当前环境不支持批量缓存读取，改为逐个读取属性: {e}")
+                self.use_cache = False
+        snapshot = self.build(chat_element)
+        has_more = snapshot.count > limit
+        return ChatSnapshot(snapshot.items[-limit:], snapshot.com_calls, snapshot.timestamp,
+                            is_tail=True, has_more=has_more)
+
+    def _build_tail_cached(self, chat_element, limit: int) -> ChatSnapshot:
+        # 用 TreeWalker 从最后一个子元素向前走，每一步都带上缓存请求
+        cache_request = self._get_cache_request()
+        walker = self.uia.RawViewWalker
+        element = walker.GetLastChildElementBuildCache(chat_element, cache_request)
+        com_calls = 1
+
+        items = []
+        while element and len(items) < limit:
+            try:
+                items.append(self._read_cached(element))
+            except Exception:
+                pass
+            element = walker.GetPreviousSiblingElementBuildCache(element, cache_request)
+            com_calls += 1
+
+        items.reverse()
+        return ChatSnapshot(items, com_calls=com_calls, is_tail=True, has_more=bool(element))
+
+    def _build_cached(self, chat_element) -> ChatSnapshot:
+        cache_request = self._get_cache_request()
+        children = chat_element.FindAllBuildCache(
+            self.uia_module.TreeScope_Children, self._true_condition, cache_request)
+
+        items = []
+        for i in range(children.Length):
+            try:
+                items.append(self._read_cached(children.GetElement(i)))
+            except Exception:
+                # 忽略单个元素的错误，继续处理其他元素
+                continue
+        return ChatSnapshot(items, com_calls=1)
+
+    def _read_cached(self, element) -> SnapshotElement:
+        try:
+            rect = _rect_tuple(element.CachedBoundingRectangle)
+        except Exception:
+            rect = None
+
+        children = []
+        cached_children = element.GetCachedChildren()
+        if cached_children:
+            for i in range(cached_children.Length):
+                try:
+                    children.append(self._read_cached(cached_children.GetElement(i)))
+                except Exception:
+                    continue
+
+        return SnapshotElement(
+            name=element.CachedName or '',
+            control_type=element.CachedControlType or 0,
+            automation_id=element.CachedAutomationId or '',
+            class_name=element.CachedClassName or '',
+            rect=rect,
+            children=children,
+        )
+
+    def _build_uncached(self, chat_element) -> ChatSnapshot:
+        com_calls = 1
+        children = chat_element.FindAll(self.uia_module.TreeScope_Children, self._true_condition)
+
+        items = []
+        for i in range(children.Length):
+            try:
+                child = children.GetElement(i)
+                name = getattr(child, 'CurrentName', '') or ''
+                control_type = getattr(child, 'CurrentControlType', 0) or 0
+                automation_id = getattr(child, 'CurrentAutomationId', '') or ''
+                com_calls += 3
+                try:
+                    rect = _rect_tuple(child.CurrentBoundingRectangle)
+                except Exception:
+                    rect = None
+                com_calls += 1
+                items.append(SnapshotElement(name, control_type, automation_id, '', rect))
+            except Exception:
+                continue
+
+        # 只有最新消息需要子树信息（发送者和消息来源判断）
+        if items:
+            try:
+                latest = children.GetElement(children.Length - 1)
+                subtree = latest.FindAll(self.uia_module.TreeScope_Subtree, self._true_condition)
+                com_calls += 1
+                sub_elements = []
+                for j in range(subtree.Length):
+                    sub = subtree.GetElement(j)
+                    sub_elements.append(SnapshotElement(
+                        name=getattr(sub, 'CurrentName', '') or '',
+                        control_type=getattr(sub, 'CurrentControlType', 0) or 0,
+                        class_name=getattr(sub, 'CurrentClassName', '') or '',
+                        rect=_rect_tuple(getattr(sub, 'CurrentBoundingRectangle', None)),
+                    ))
+                    com_calls += 4
+                # subtree 第一个元素是最新消息本身，其余按扁平结构挂在它下面
+                items[-1].children = sub_elements[1:]
+            except Exception:
+                pass
+
+        return ChatSnapshot(items, com_calls=com_calls)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包面板网格模型
+功能：把表情包面板看作行列整齐的网格（行数、列数、间距），只检测一次并缓存。
+      优先从面板的 UI Automation 子元素读取每个表情包的位置，读取不到时按设置的面板区域和
+      表情包间距推算；选择表情包变成按序号直接算出格子中心，不会再点到表情包之间的空隙
+"""
+
+from typing import Optional, List, Tuple
+
+# 100% 缩放（96 DPI）时表情包格子的默认间距（像素），读取不到面板子元素时使用
+DEFAULT_CELL_PITCH = 70
+
+
+def _cluster(values: List[float], tolerance: float) -> List[float]:
+    """把相近的坐标合并成一组，返回每组的平均值（升序）"""
+    groups = []
+    for value in sorted(values):
+        if groups and value - groups[-1][-1] <= tolerance:
+            groups[-1].append(value)
+        else:
+            groups.append([value])
+    return [sum(group) / len(group) for group in groups]
+
+
+def _median(values: List[float]) -> float:
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+class EmojiGrid:
+    """表情包面板的网格布局
+
+    坐标相对于面板区域的左上角保存，面板随窗口移动（或换算到其他聊天窗口）后仍然可用。
+    格子按行优先编号：序号 i 位于第 i // cols 行、第 i % cols 列。
+    """
+
+    def __init__(self, cols: int, rows: int, pitch_x: float, pitch_y: float,
+                 first_x: float, first_y: float, count: Optional[int] = None, source: str = "area"):
+        self.cols = max(1, cols)
+        self.rows = max(1, rows)
+        self.pitch_x = pitch_x
+        self.pitch_y = pitch_y
+        self.first_x = first_x    # 第一个格子中心相对面板左边的距离
+        self.first_y = first_y    # 第一个格子中心相对面板上边的距离
+        self.count = min(count, self.cols * self.rows) if count else self.cols * self.rows
+        self.source = source      # "uia" 从面板子元素检测 / "area" 按面板区域推算
+
+    def cell_center(self, index: int, panel_area: dict) -> Tuple[int, int]:
+        """第 index 个表情包格子中心的屏幕坐标"""
+        row, col = divmod(index % self.count, self.cols)
+        x = panel_area['left'] + self.first_x + col * self.pitch_x
+        y = panel_area['top'] + self.first_y + row * self.pitch_y
+        return int(round(x)), int(round(y))
+
+    @classmethod
+    def from_panel_area(cls, panel_area: dict, pitch: float = DEFAULT_CELL_PITCH) -> 'EmojiGrid':
+        """按面板区域大小和表情包间距推算网格，格子均匀铺满面板"""
+        cols = max(1, int(panel_area['width'] // pitch))
+        rows = max(1, int(panel_area['height'] // pitch))
+        pitch_x = panel_area['width'] / cols
+        pitch_y = panel_area['height'] / rows
+        return cls(cols, rows, pitch_x, pitch_y, pitch_x / 2, pitch_y / 2, source="area")
+
+    @classmethod
+    def from_cells(cls, rects: List[Tuple[int, int, int, int]], panel_area: dict) -> Optional['EmojiGrid']:
+        """根据面板中每个表情包元素的矩形 (left, top, right, bottom) 检测网格
+
+        只使用中心落在面板区域内、大小与多数格子一致的元素（排除标签页按钮等）。
+        """
+        cells = []
+        for left, top, right, bottom in rects:
+            cx, cy = (left + right) / 2, (top + bottom) / 2
+            if (panel_area['left'] <= cx <= panel_area['right']
+                    and panel_area['top'] <= cy <= panel_area['bottom']):
+                cells.append((cx, cy, right - left, bottom - top))
+        if not cells:
+            return None
+
+        width = _median([c[2] for c in cells])
+        height = _median([c[3] for c in cells])
+        cells = [c for c in cells if abs(c[2] - width) <= width * 0.25 and abs(c[3] - height) <= height * 0.25]
+        if not cells:
+            return None
+
+        columns = _cluster([c[0] for c in cells], width / 2)
+        rows = _cluster([c[1] for c in cells], height / 2)
+        pitch_x = _median([b - a for a, b in zip(columns, columns[1:])]) if len(columns) > 1 else width
+        pitch_y = _median([b - a for a, b in zip(rows, rows[1:])]) if len(rows) > 1 else height
+        return cls(len(columns), len(rows), pitch_x, pitch_y,
+                   columns[0] - panel_area['left'], rows[0] - panel_area['top'],
+                   count=len(cells), source="uia")
+
+    def to_dict(self) -> dict:
+        return {
+            'cols': self.cols, 'rows': self.rows,
+            'pitch': [round(self.pitch_x, 2), round(self.pitch_y, 2)],
+            'first': [round(self.first_x, 2), round(self.first_y, 2)],
+            'count': self.count, 'source': self.source,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional['EmojiGrid']:
+        try:
+            return cls(int(data['cols']), int(data['rows']), float(data['pitch'][0]), float(data['pitch'][1]),
+                       float(data['first'][0]), float(data['first'][1]),
+                       count=int(data.get('count', 0)) or None, source=data.get('source', 'area'))
+        except (KeyError, TypeError, ValueError, IndexError):
+            return None
+
+    def describe(self) -> str:
+        source = "面板元素" if self.source == "uia" else "面板区域推算"
+        return (f"{self.rows} 行 x {self.cols} 列，共 {self.count} 个，"
+                f"间距 {self.pitch_x:.0f}x{self.pitch_y:.0f}（{source}）")
+
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多页表情包面板
+功能：表情包面板有多个标签页（收藏、各个表情包合集），每个标签页可以向下翻多页。
+      按页缓存每一页的网格布局，把全局的表情包序号换算成（标签页, 页, 格子）；
+      记录每一步导航（切换标签页、翻页）实际花费的时间，估计到达某个表情包需要的导航代价，
+      选择表情包时优先选择点击次数少、能更快发出的表情包
+"""
+
+import bisect
+from typing import Optional, List, Tuple, Dict
+
+from emoji_grid import EmojiGrid
+
+# 导航步骤的默认耗时估计（秒），测量到实际耗时前使用
+DEFAULT_TAB_COST = 0.25
+DEFAULT_PAGE_COST = 0.15
+
+
+class PanelTab:
+    """面板中的一个标签页"""
+
+    def __init__(self, name: str, center: Optional[Tuple[float, float]] = None, pages: int = 1):
+        self.name = name
+        self.center = center    # 标签按钮中心相对面板左上角的位置，只有一个标签页时为 None
+        self.pages = max(1, pages)
+        self.grids: Dict[int, EmojiGrid] = {}  # 页号 → 这一页检测到的网格
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'center': list(self.center) if self.center else None,
+            'pages': self.pages,
+            'grids': {str(page): grid.to_dict() for page, grid in self.grids.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'PanelTab':
+        tab = cls(data.get('name', ''), tuple(data['center']) if data.get('center') else None,
+                  int(data.get('pages', 1)))
+        for page, grid_data in data.get('grids', {}).items():
+            grid = EmojiGrid.from_dict(grid_data)
+            if grid:
+                tab.grids[int(page)] = grid
+        return tab
+
+
+class NavigationCostModel:
+    """导航步骤的耗时模型：每种步骤（tab 切换标签页 / page 翻页）的耗时用指数滑动平均估计"""
+
+    def __init__(self, tab_cost: float = DEFAULT_TAB_COST, page_cost: float = DEFAULT_PAGE_COST,
+                 smoothing: float = 0.3):
+        self.costs = {'tab': tab_cost, 'page': page_cost}
+        self.counts = {'tab': 0, 'page': 0}
+        self.totals = {'tab': 0.0, 'page': 0.0}
+        self.smoothing = smoothing
+
+    def record(self, kind: str, elapsed: float):
+        """记录一次实际测量的导航耗时"""
+        if self.counts[kind] == 0:
+            self.costs[kind] = elapsed
+        else:
+            self.costs[kind] += self.smoothing * (elapsed - self.costs[kind])
+        self.counts[kind] += 1
+        self.totals[kind] += elapsed
+
+    def steps(self, start: Tuple[int, int], target: Tuple[int, int]) -> Tuple[int, int]:
+        """从 start 到 target 需要的 (切换标签页次数, 翻页次数)；切换标签页后从第一页开始翻"""
+        if start[0] != target[0]:
+            return 1, target[1]
+        return 0, abs(target[1] - start[1])
+
+    def estimate(self, start: Tuple[int, int], target: Tuple[int, int]) -> float:
+        tabs, pages = self.steps(start, target)
+        return tabs * self.costs['tab'] + pages * self.costs['page']
+
+    def describe(self) -> List[str]:
+        names = {'tab': "切换标签页", 'page': "翻页"}
+        lines = []
+        for kind in ('tab', 'page'):
+            if self.counts[kind]:
+                mean = self.totals[kind] / self.counts[kind]
+                lines.append(f"{names[kind]}: 每步平均 {mean * 1000:.0f} ms，当前估计 {self.costs[kind] * 1000:.0f} ms"
+                             f"（{self.counts[kind]} 次）")
+            else:
+                lines.append(f"{names[kind]}: 尚未测量，按 {self.costs[kind] * 1000:.0f} ms 估计")
+        return lines
+
+
+class PanelLayout:
+    """多页表情包面板的布局
+
+    所有表情包按 标签页 → 页 → 格子 的顺序编号为全局序号；还没有检测过的页按 default_grid 估计。
+    """
+
+    def __init__(self, tabs: Optional[List[PanelTab]] = None):
+        self.tabs: List[PanelTab] = tabs or [PanelTab("默认")]
+        self.cost_model = NavigationCostModel()
+        self._starts: List[int] = []   # 每一页第一个表情包的全局序号
+        self._pages: List[Tuple[int, int]] = []
+        self._total = 0
+        self._default_count = 0
+
+    def page_grid(self, tab: int, page: int, default_grid: EmojiGrid) -> EmojiGrid:
+        return self.tabs[tab].grids.get(page, default_grid)
+
+    def set_page_grid(self, tab: int, page: int, grid: EmojiGrid):
+        """缓存某一页检测到的网格（最后一页可能不满）"""
+        self.tabs[tab].grids[page] = grid
+        self._starts = []
+
+    def set_tab_pages(self, tab: int, pages: int):
+        self.tabs[tab].pages = max(1, pages)
+        self._starts = []
+
+    def _index(self, default_grid: EmojiGrid):
+        if self._starts and self._default_count == default_grid.count:
+            return
+        self._starts, self._pages = [], []
+        total = 0
+        for tab_index, tab in enumerate(self.tabs):
+            for page in range(tab.pages):
+                self._starts.append(total)
+                self._pages.append((tab_index, page))
+                total += tab.grids.get(page, default_grid).count
+        self._total = total
+        self._default_count = default_grid.count
+
+    def total(self, default_grid: EmojiGrid) -> int:
+        """表情包总数"""
+        self._index(default_grid)
+        return self._total
+
+    def locate(self, index: int, default_grid: EmojiGrid) -> Tuple[int, int, int]:
+        """全局序号 → (标签页, 页, 页内格子序号)"""
+        self._index(default_grid)
+        position = bisect.bisect_right(self._starts, index) - 1
+        tab, page = self._pages[position]
+        return tab, page, index - self._starts[position]
+
+    def navigation_cost(self, index: int, start: Tuple[int, int], default_grid: EmojiGrid) -> float:
+        tab, page, _ = self.locate(index, default_grid)
+        return self.cost_model.estimate(start, (tab, page))
+
+    def to_dict(self) -> dict:
+        return {'tabs': [tab.to_dict() for tab in self.tabs]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional['PanelLayout']:
+        try:
+            tabs = [PanelTab.from_dict(tab) for tab in data['tabs']]
+        except (KeyError, TypeError, ValueError):
+            return None
+        return cls(tabs) if tabs else None
+
+    def describe(self) -> str:
+        return "，".join(f"{tab.name}（{tab.pages} 页）" for tab in self.tabs)
+
+
+def tabs_from_rects(tab_rects: List[Tuple[str, Tuple[int, int, int, int]]], panel_area: dict,
+                    pages: Optional[Dict[str, int]] = None) -> List[PanelTab]:
+    """根据标签按钮的名称和矩形创建标签页，pages 为 标签名 → 页数 的配置"""
+    pages = pages or {}
+    tabs = []
+    for name, (left, top, right, bottom) in tab_rects:
+        center = ((left + right) / 2 - panel_area['left'], (top + bottom) / 2 - panel_area['top'])
+        tabs.append(PanelTab(name, center, pages.get(name, 1)))
+    return tabs
+
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包选择引擎
+功能：按权重从表情包库中选择要发送的表情包，每个聊天记住最近发过的表情包，
+      在不重复窗口内的不会再选。权重抽样用别名表（O(1)），最近记录用环形缓冲区加集合（O(1)），
+      表情包库增长到几千个时每次选择的开销不变；权重和各聊天的记录紧凑地保存到磁盘
+"""
+
+import json
+import os
+import random
+from typing import Optional, Dict, List, Hashable, Callable
+
+# 选择状态的保存格式版本
+SELECTION_STATE_VERSION = 1
+
+# 默认保存位置：程序所在目录
+DEFAULT_SELECTION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emoji_history.json')
+
+
+class RecentWindow:
+    """最近选过的表情包：固定大小的环形缓冲区保存顺序，集合用于O(1)成员判断"""
+    __slots__ = ('size', '_ring', '_head', '_members')
+
+    def __init__(self, size: int):
+        self.size = max(0, size)
+        self._ring: List[Optional[int]] = [None] * self.size
+        self._head = 0  # 下一个写入位置，也是最旧记录所在的位置
+        self._members = {}  # 序号 → 在环形缓冲区中出现的次数
+
+    def push(self, index: int):
+        if self.size == 0:
+            return
+        oldest = self._ring[self._head]
+        if oldest is not None:
+            remaining = self._members[oldest] - 1
+            if remaining:
+                self._members[oldest] = remaining
+            else:
+                del self._members[oldest]
+        self._ring[self._head] = index
+        self._members[index] = self._members.get(index, 0) + 1
+        self._head = (self._head + 1) % self.size
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._members
+
+    def __len__(self) -> int:
+        return sum(self._members.values())
+
+    def items(self) -> List[int]:
+        """从旧到新的记录"""
+        ordered = self._ring[self._head:] + self._ring[:self._head]
+        return [index for index in ordered if index is not None]
+
+
+class AliasTable:
+    """Vose 别名表：O(n) 建表，O(1) 按权重抽样"""
+
+    def __init__(self, weights: List[float]):
+        n = len(weights)
+        total = sum(weights)
+        self.n = n
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        if n == 0 or total <= 0:
+            return
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩下的（浮点误差导致）概率都是1
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng: random.Random) -> int:
+        i = rng.randrange(self.n)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class EmojiSelector:
+    """表情包选择引擎
+
+    表情包用全局序号 0..count-1 表示（多页面板按页依次编号）。weights 为序号 → 权重，
+    没有指定的表情包权重为1，权重为0的不会被选中。每个聊天（chat_key）有自己的最近记录，
+    最近 no_repeat 次发过的表情包不会再选。
+    """
+
+    def __init__(self, count: int = 0, weights: Optional[Dict[int, float]] = None,
+                 no_repeat: int = 3, max_attempts: int = 16, rng: Optional[random.Random] = None):
+        self.count = count
+        self.weights: Dict[int, float] = dict(weights or {})
+        self.no_repeat = no_repeat
+        self.max_attempts = max_attempts  # 拒绝采样的最多次数
+        self.rng = rng or random.Random()
+        self.histories: Dict[Hashable, RecentWindow] = {}
+        self.selections = 0
+        self._table = None  # 别名表；None 表示需要重新建表，False 表示均匀抽样
+        self.dirty = False  # 有没有保存的变化
+
+    def resize(self, count: int):
+        """表情包总数变化（检测到网格或翻页后）"""
+        if count != self.count:
+            self.count = count
+            self._table = None
+
+    def set_weight(self, index: int, weight: float):
+        self.weights[index] = max(0.0, float(weight))
+        self._table = None
+        self.dirty = True
+
+    def set_weights(self, weights: Dict[int, float]):
+        self.weights = {int(i): max(0.0, float(w)) for i, w in weights.items()}
+        self._table = None
+        self.dirty = True
+
+    def _sample(self) -> int:
+        if self._table is None:
+            # 权重或表情包总数变化后重新建表；没有设置权重时不建表，直接均匀抽样
+            if any(i < self.count and w != 1.0 for i, w in self.weights.items()):
+                self._table = AliasTable([self.weights.get(i, 1.0) for i in range(self.count)])
+            else:
+                self._table = False
+        if self._table is False:
+            return self.rng.randrange(self.count)
+        return self._table.sample(self.rng)
+
+    def history(self, chat_key: Hashable = None) -> RecentWindow:
+        recent = self.histories.get(chat_key)
+        if recent is None or recent.size != self.no_repeat:
+            recent = RecentWindow(self.no_repeat)
+            for index in (self.histories[chat_key].items() if chat_key in self.histories else []):
+                recent.push(index)
+            self.histories[chat_key] = recent
+        return recent
+
+    def choose(self, chat_key: Hashable = None, cost: Optional[Callable[[int], float]] = None,
+               candidates: int = 1) -> int:
+        """为一个聊天选择一个表情包，返回全局序号
+
+        提供 cost（序号 → 发送这个表情包的代价，例如翻页导航的耗时）时，按权重抽取
+        candidates 个候选，选代价最小的一个：候选数量固定，开销仍然与表情包数量无关。
+        """
+        if self.count <= 1:
+            return 0
+        recent = self.history(chat_key)
+
+        index = self._draw(recent)
+        if cost is not None and candidates > 1:
+            best_cost = cost(index)
+            for _ in range(candidates - 1):
+                candidate = self._draw(recent)
+                candidate_cost = cost(candidate)
+                if candidate_cost < best_cost:
+                    index, best_cost = candidate, candidate_cost
+
+        recent.push(index)
+        self.selections += 1
+        self.dirty = True
+        return index
+
+    def choose_from(self, chat_key: Hashable, candidates: List[int]) -> int:
+        """在指定的表情包（例如回复规则指定的表情包集合）中选择一个，仍然按权重并避开最近发过的
+
+        候选通常只有几个到几十个，直接按权重抽样。
+        """
+        allowed = [i for i in candidates if self.weights.get(i, 1.0) > 0] or list(candidates)
+        recent = self.history(chat_key)
+        fresh = [i for i in allowed if i not in recent] or allowed
+        index = self.rng.choices(fresh, weights=[self.weights.get(i, 1.0) or 1.0 for i in fresh])[0]
+        recent.push(index)
+        self.selections += 1
+        self.dirty = True
+        return index
+
+    def _draw(self, recent: RecentWindow) -> int:
+        """按权重抽取一个不在最近记录中的表情包"""
+        index = self._sample()
+        attempts = 1
+        while index in recent and attempts < self.max_attempts:
+            index = self._sample()
+            attempts += 1
+        if index in recent:
+            # 权重集中在最近发过的几个表情包上，拒绝采样多次失败时从随机位置往后找一个没发过的
+            start = self.rng.randrange(self.count)
+            for offset in range(self.count):
+                candidate = (start + offset) % self.count
+                if candidate not in recent and self.weights.get(candidate, 1.0) > 0:
+                    index = candidate
+                    break
+        return index
+
+    # 保存和加载
+
+    def to_dict(self) -> dict:
+        return {
+            'version': SELECTION_STATE_VERSION,
+            'weights': {str(i): w for i, w in self.weights.items()},
+            'history': {str(key): recent.items() for key, recent in self.histories.items()
+                        if key is not None and len(recent)},
+        }
+
+    def load_dict(self, data: dict) -> bool:
+        if data.get('version') != SELECTION_STATE_VERSION:
+            return False
+        self.set_weights({int(i): w for i, w in data.get('weights', {}).items()})
+        self.histories = {}
+        for key, items in data.get('history', {}).items():
+            recent = RecentWindow(self.no_repeat)
+            for index in items[-self.no_repeat:] if self.no_repeat else []:
+                recent.push(int(index))
+            self.histories[key] = recent
+        self.dirty = False
+        return True
+
+    def save(self, path: str = DEFAULT_SELECTION_PATH) -> bool:
+        try:
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, path)
+            self.dirty = False
+            return True
+        except OSError as e:
+            print(f"保存表情包选择记录失败: {e}")
+            return False
+
+    def load(self, path: str = DEFAULT_SELECTION_PATH) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return self.load_dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"读取表情包选择记录失败: {e}")
+            return False
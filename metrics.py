@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+功能：计数器、仪表和直方图，记录检测次数、每次检测的COM调用次数和耗时、检测延迟、发送每一步的耗时、
+      冷却期和二次验证抑制的检测、发送队列长度等。默认关闭，关闭时每个记录调用只检查一次开关；
+      开启后可以在本机提供 Prometheus 文本格式的 HTTP 端点，或者定时把 JSON 快照写入文件，
+      status 命令显示最近一段时间的速率
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Callable, Dict, List, Sequence, Tuple
+
+# 耗时直方图的分桶上限（秒）
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 次数直方图的分桶上限
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# 计算速率时最多比较多久以前的采样（秒）
+RATE_WINDOW = 60.0
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """指标基类：可以有一个标签，每个标签值分别计数（没有标签时标签值为 None）"""
+
+    kind = 'untyped'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help: str, label: Optional[str] = None):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.label = label
+
+    def _series_name(self, suffix: str, label_value: Optional[str], extra: str = '') -> str:
+        labels = []
+        if self.label and label_value is not None:
+            labels.append(f'{self.label}="{_escape(str(label_value))}"')
+        if extra:
+            labels.append(extra)
+        name = f"{self._registry.prefix}_{self.name}{suffix}"
+        return f"{name}{{{','.join(labels)}}}" if labels else name
+
+    def exposition(self) -> List[str]:
+        raise NotImplementedError
+
+    def snapshot(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, label=None):
+        super().__init__(registry, name, help, label)
+        self.values: Dict[Optional[str], float] = {}
+
+    def inc(self, amount: float = 1, label_value: Optional[str] = None):
+        if not self._registry.enabled:
+            return
+        with self._registry.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    @property
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def exposition(self) -> List[str]:
+        return [f"{self._series_name('', label)} {_format_number(value)}" for label, value in self.values.items()]
+
+    def snapshot(self):
+        return {str(label) if label is not None else '': value for label, value in self.values.items()}
+
+
+class Gauge(Metric):
+    """当前值；设置了 fn 时导出时调用它读取（例如发送队列长度）"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, fn: Optional[Callable[[], float]] = None):
+        super().__init__(registry, name, help)
+        self.fn = fn
+        self._value = 0.0
+
+    def set(self, value: float):
+        if self._registry.enabled:
+            self._value = value
+
+    @property
+    def value(self) -> float:
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return 0.0
+        return self._value
+
+    def exposition(self) -> List[str]:
+        return [f"{self._series_name('', None)} {_format_number(self.value)}"]
+
+    def snapshot(self):
+        return self.value
+
+
+class _Buckets:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size   # 每个分桶自己的数量（导出时再累加）
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    """分桶统计，导出为 Prometheus 直方图，status 用分桶估计分位数"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, buckets: Sequence[float] = TIME_BUCKETS, label=None):
+        super().__init__(registry, name, help, label)
+        self.buckets = tuple(buckets)
+        self.seconds = self.buckets == TIME_BUCKETS  # 耗时直方图，显示时换算成毫秒
+        self.series: Dict[Optional[str], _Buckets] = {}
+
+    def observe(self, value: float, label_value: Optional[str] = None):
+        if not self._registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._registry.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = _Buckets(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @property
+    def count(self) -> int:
+        return sum(series.count for series in self.series.values())
+
+    def quantile(self, q: float, label_value: Optional[str] = None) -> Optional[float]:
+        """按分桶估计分位数（返回分桶上限），没有数据时返回 None"""
+        series = self.series.get(label_value)
+        if series is None or not series.count:
+            return None
+        target = q * series.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def exposition(self) -> List[str]:
+        lines = []
+        for label, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                cumulative += count
+                bucket = 'le="%s"' % _format_number(bound)
+                lines.append(f"{self._series_name('_bucket', label, bucket)} {cumulative}")
+            lines.append(f"{self._series_name('_sum', label)} {_format_number(series.sum)}")
+            lines.append(f"{self._series_name('_count', label)} {series.count}")
+        return lines
+
+    def snapshot(self):
+        return {str(label) if label is not None else '': {
+            'count': series.count,
+            'sum': round(series.sum, 6),
+            'p50': self.quantile(0.5, label),
+            'p99': self.quantile(0.99, label),
+        } for label, series in self.series.items()}
+
+
+class MetricsRegistry:
+    """指标的集合，enabled 为 False 时所有记录调用直接返回"""
+
+    def __init__(self, prefix: str = 'wechat_emoji', enabled: bool = False):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.metrics: List[Metric] = []
+        self.started_at = time.time()
+        self._samples = deque()    # [(时间, {计数器名: 总数}), ...]，计算速率用
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        return self._add(Counter(self, name, help, label))
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._add(Gauge(self, name, help, fn))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = TIME_BUCKETS,
+                  label: Optional[str] = None) -> Histogram:
+        return self._add(Histogram(self, name, help, buckets, label))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self.started_at = time.time()
+            # 再次开启时之前的累计数作为速率的基线
+            self._samples.clear()
+            self.sample(self.started_at)
+
+    def disable(self):
+        self.enabled = False
+
+    def _totals(self) -> Dict[str, float]:
+        totals = {}
+        for metric in self.metrics:
+            if isinstance(metric, Counter):
+                totals[metric.name] = metric.total
+            elif isinstance(metric, Histogram):
+                totals[metric.name] = metric.count
+        return totals
+
+    def sample(self, now: Optional[float] = None):
+        """记下当前的累计数，丢弃 RATE_WINDOW 以前的采样"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._samples.append((now, self._totals()))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW:
+                self._samples.popleft()
+
+    def rates(self) -> Tuple[Dict[str, float], float]:
+        """各计数器和直方图在最近一段时间内的每秒次数，返回 (速率, 统计的秒数)
+
+        与最早的采样比较；还没有采样时从开启指标时算起。
+        """
+        now = time.time()
+        self.sample(now)
+        since, before = self._samples[0] if len(self._samples) > 1 else (self.started_at, {})
+        elapsed = max(now - since, 1e-6)
+        current = self._samples[-1][1]
+        return {name: (total - before.get(name, 0)) / elapsed for name, total in current.items()}, elapsed
+
+    def exposition(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                name = f"{self.prefix}_{metric.name}"
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            data = {metric.name: metric.snapshot() for metric in self.metrics}
+        return {'timestamp': time.time(), 'uptime': round(time.time() - self.started_at, 3), 'metrics': data}
+
+    def describe(self) -> List[str]:
+        """每个指标的累计数、最近的速率，直方图另外显示平均值和分位数"""
+        if not self.enabled:
+            return ["运行指标: 未开启（metrics 命令开启）"]
+        rates, window = self.rates()
+        lines = [f"运行指标（最近 {window:.0f} 秒的速率）:"]
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                lines.append(f"{metric.help}: {_format_number(metric.value)}")
+            elif isinstance(metric, Counter):
+                total = metric.total
+                if not total:
+                    continue
+                line = f"{metric.help}: 共 {_format_number(total)}，{rates.get(metric.name, 0):.2f} 次/秒"
+                if metric.label:
+                    parts = [f"{label} {_format_number(value)}" for label, value in list(metric.values.items())]
+                    line += f"（{'，'.join(parts)}）"
+                lines.append(line)
+            elif isinstance(metric, Histogram):
+                if not metric.count:
+                    continue
+                lines.append(f"{metric.help}: 共 {metric.count} 次，{rates.get(metric.name, 0):.2f} 次/秒")
+                for label, series in list(metric.series.items()):
+                    mean = series.sum / series.count
+                    unit, suffix = (1000, " ms") if metric.seconds else (1, "")
+                    p99 = metric.quantile(0.99, label)
+                    p99_text = "超出分桶" if p99 == float('inf') else f"{p99 * unit:g}{suffix}"
+                    name = f"{label}: " if label is not None else ""
+                    lines.append(f"  {name}平均 {mean * unit:.1f}{suffix}，p99 ≤ {p99_text}（{series.count} 次）")
+        return lines
+
+
+class MonitorMetrics(MetricsRegistry):
+    """监控程序记录的指标"""
+
+    def __init__(self, prefix: str = 'wechat_emoji', enabled: bool = False):
+        super().__init__(prefix, enabled)
+        self.ticks = self.counter('ticks_total', "检测次数")
+        self.detections = self.counter('detections_total', "检测到新消息")
+        self.suppressed = self.counter('suppressed_total', "被抑制的检测", label='reason')
+        self.detect_seconds = self.histogram('detect_seconds', "每次检测的耗时")
+        self.com_calls = self.histogram('com_calls_per_tick', "每次检测的COM调用次数", COUNT_BUCKETS)
+        self.detection_latency = self.histogram('detection_latency_seconds', "从结构变化通知到检测到新消息的延迟")
+        self.reply_wait = self.histogram('reply_wait_seconds', "回复从加入发送队列到开始执行的等待")
+        self.send_step = self.histogram('send_step_seconds', "发送流程每一步的耗时", label='step')
+        self.queue_depth = self.gauge('queue_depth', "发送队列中等待的回复")
+
+
+class MetricsServer:
+    """本机的 Prometheus 端点：GET /metrics 返回文本格式的指标"""
+
+    def __init__(self, registry: MetricsRegistry, port: int = 9464, host: str = '127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                registry.sample()
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.registry = registry
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def describe(self) -> str:
+        host, port = self.address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class JsonDumper:
+    """每隔 interval 秒把指标快照写入 JSON 文件（先写临时文件再替换）"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.writes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def dump(self) -> bool:
+        self.registry.sample()
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.path)
+            self.writes += 1
+            return True
+        except OSError as e:
+            print(f"写入运行指标失败: {e}")
+            return False
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def describe(self) -> str:
+        return f"每 {self.interval:g} 秒写入 {self.path}（已写入 {self.writes} 次）"
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self.dump()
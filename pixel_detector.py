@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+像素变化检测
+功能：没有 UI Automation 时的备选检测方案。每次只截取聊天区域，隔行隔列缩小并换算成灰度后与上一帧比较：
+      先按每行像素之和估计聊天记录向上滚动了多少行，对齐后按块比较差异，
+      变化出现在聊天内容的最下方、并且在左侧（对方的气泡在左侧）时判断为收到新消息。
+      居中的时间分隔行、右侧自己发送的气泡和鼠标指针这样的小范围变化都不算。
+      需要 numpy；所有缓冲区在区域大小不变时重复使用，每帧几乎不分配内存
+"""
+
+from typing import List, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+# 灰度换算系数（ITU-R BT.601，放大256倍取整）
+GRAY_WEIGHTS = (77, 150, 29)
+
+
+class PixelChangeDetector:
+    """比较聊天区域相邻两帧，判断底部是否出现了对方的新气泡
+
+    帧为 (高, 宽, 3或4) 的 uint8 数组（RGB 或 Windows 截图的 BGRA），或 (高, 宽) 的灰度数组。
+    """
+
+    def __init__(self, block: int = 6, scale: int = 2, tolerance: float = 6.0, bubble_fraction: float = 0.3,
+                 center_band: float = 0.2, max_shift_fraction: float = 0.5, cursor_blocks: int = 3,
+                 bgr: bool = False):
+        if not HAS_NUMPY:
+            raise RuntimeError("像素变化检测需要安装 numpy")
+        self.block = block                      # 比较差异的块大小（缩小后的像素）
+        self.scale = scale                      # 缩小倍数，每隔 scale 个像素取一个
+        self.tolerance = tolerance              # 块内平均灰度差超过它才算变化（白色气泡和浅灰背景只差10左右）
+        self.bubble_fraction = bubble_fraction  # 最下方变化向上多高（占高度的比例）以内算作新气泡
+        self.center_band = center_band          # 中间忽略的宽度比例（时间分隔行、系统提示居中显示）
+        self.max_shift_fraction = max_shift_fraction
+        self.cursor_blocks = cursor_blocks      # 不超过这个大小（块）的孤立变化视为鼠标指针或光标
+        self.bgr = bgr
+        self._ignored: List[Tuple[int, int, int, int]] = []
+        self._shape = None
+        self.frames = 0
+        self.detections = 0
+        self.last_shift = 0
+        self.last_changed = 0     # 上一帧变化的块数（不含忽略区域）
+        self.last_own = False     # 上一帧只在右侧出现了新内容（自己发送的消息）
+
+    def ignore(self, left: int, top: int, right: int, bottom: int):
+        """忽略区域内的变化（相对截图左上角的像素坐标），例如会闪烁的提示"""
+        scale = self.scale
+        self._ignored.append((left // scale, top // scale, -(-right // scale), -(-bottom // scale)))
+        self._shape = None
+
+    def reset(self):
+        """丢弃上一帧，下一帧只作为基线"""
+        self._shape = None
+
+    def _allocate(self, height: int, width: int):
+        block = self.block
+        rows, cols = height // block, width // block
+        self._height, self._width = rows * block, cols * block
+        self._gray = np.zeros((self._height, self._width), dtype=np.uint16)
+        self._previous = np.zeros_like(self._gray)
+        self._scratch = np.zeros_like(self._gray)
+        self._diff = np.zeros((self._height, self._width), dtype=np.int32)
+        self._profile = np.zeros(self._height, dtype=np.int64)
+        self._previous_profile = np.zeros_like(self._profile)
+        self._profile_scratch = np.zeros_like(self._profile)
+        self._blocks = np.zeros((rows, cols), dtype=np.int64)
+        self._levels = np.zeros((rows, cols), dtype=np.int64)
+        self._changed = np.zeros((rows, cols), dtype=bool)
+
+        # 有效区域：去掉中间（时间分隔行、系统提示）和忽略区域
+        self._bubble_rows = max(1, int(round(rows * self.bubble_fraction)))
+        self._left_cols = max(1, int(cols * (0.5 - self.center_band / 2)))
+        self._right_start = min(cols - 1, int(cols * (0.5 + self.center_band / 2)))
+        self._center = np.zeros((rows, cols), dtype=bool)
+        self._center[:, self._left_cols:self._right_start] = True
+        valid = np.ones((rows, cols), dtype=bool)
+        for left, top, right, bottom in self._ignored:
+            valid[max(0, top // block):max(0, -(-bottom // block)), max(0, left // block):max(0, -(-right // block))] = False
+        self._valid = valid & ~self._center
+        self._max_shift = int(self._height * self.max_shift_fraction)
+        self._shape = None
+
+    def _to_gray(self, frame, out):
+        height, width = self._height, self._width
+        if frame.ndim == 2:
+            np.copyto(out, frame[:height, :width], casting='unsafe')
+            return
+        red, green, blue = (2, 1, 0) if self.bgr else (0, 1, 2)
+        weights = GRAY_WEIGHTS
+        np.multiply(frame[:height, :width, red], weights[0], out=out, dtype=np.uint16)
+        np.multiply(frame[:height, :width, green], weights[1], out=self._scratch, dtype=np.uint16)
+        np.add(out, self._scratch, out=out)
+        np.multiply(frame[:height, :width, blue], weights[2], out=self._scratch, dtype=np.uint16)
+        np.add(out, self._scratch, out=out)
+        np.right_shift(out, 8, out=out)
+
+    def _estimate_shift(self) -> int:
+        """估计聊天记录向上滚动的行数：上一帧第 s 行之后与这一帧对齐的误差最小。
+        负数表示向下滚动（翻看更早的消息）"""
+        current, previous = self._profile, self._previous_profile
+        scratch = self._profile_scratch
+        height = self._height
+        # 上一帧底部还有空白、变化都在空白里：消息没有占满聊天区域，新消息直接接在下面，不会滚动
+        # （相邻的气泡外观相同时，只看每行之和分不清"新增一条"和"滚动一条"）
+        content = np.flatnonzero(previous != previous[-1])
+        changed = np.flatnonzero(previous != current)
+        if len(changed) and (not len(content) or changed[0] > content[-1]):
+            return 0
+        best_shift, best_error = 0, None
+        for step in range(0, 2 * self._max_shift + 1):
+            # 按 0, 1, -1, 2, -2 ... 的顺序尝试，误差相同时取滚动最少的
+            shift = (step + 1) // 2 if step % 2 else -(step // 2)
+            length = height - abs(shift)
+            if shift >= 0:
+                np.subtract(previous[shift:], current[:length], out=scratch[:length])
+            else:
+                np.subtract(previous[:length], current[-shift:], out=scratch[:length])
+            np.abs(scratch[:length], out=scratch[:length])
+            error = scratch[:length].sum() / length
+            if best_error is None or error < best_error:
+                best_shift, best_error = shift, error
+                if error == 0:
+                    break
+        return best_shift
+
+    def feed(self, frame) -> bool:
+        """输入一帧，底部左侧出现了新内容时返回 True"""
+        frame = np.asarray(frame)
+        if self.scale > 1:
+            frame = frame[::self.scale, ::self.scale]
+        height, width = frame.shape[:2]
+        if self._shape != (height, width):
+            self._allocate(height, width)
+            self._to_gray(frame, self._previous)
+            np.sum(self._previous, axis=1, out=self._previous_profile)
+            self._shape = (height, width)
+            self.frames += 1
+            self.last_shift = self.last_changed = 0
+            self.last_own = False
+            return False
+
+        self.frames += 1
+        gray = self._gray
+        self._to_gray(frame, gray)
+        np.sum(gray, axis=1, out=self._profile)
+
+        if np.array_equal(self._profile, self._previous_profile) and np.array_equal(gray, self._previous):
+            self.last_shift = self.last_changed = 0
+            self.last_own = False
+            return False
+
+        shift = self._estimate_shift() if self._max_shift > 0 else 0
+        if shift < 0:
+            # 向下滚动翻看更早的消息，底部没有新内容
+            self._gray, self._previous = self._previous, self._gray
+            self._profile, self._previous_profile = self._previous_profile, self._profile
+            self.last_shift, self.last_changed = shift, 0
+            self.last_own = False
+            return False
+        overlap = self._height - shift
+        diff = self._diff
+        # 对齐部分与上一帧比较，滚动露出的底部与背景（这一帧最常见的灰度）比较
+        np.subtract(gray[:overlap], self._previous[shift:], out=diff[:overlap], dtype=np.int32)
+        if shift:
+            # 背景是出现最多的灰度，隔几个像素取样统计
+            background = int(np.bincount(gray[::4, ::4].ravel(), minlength=256).argmax())
+            np.subtract(gray[overlap:], background, out=diff[overlap:], dtype=np.int32)
+        np.abs(diff, out=diff)
+
+        block = self.block
+        rows, cols = self._blocks.shape
+        np.sum(diff.reshape(rows, block, cols, block), axis=(1, 3), out=self._blocks)
+        np.greater(self._blocks, self.tolerance * block * block, out=self._changed)
+        changed = self._changed
+        changed &= self._valid
+        self.last_changed = int(changed.sum())
+        self.last_shift = shift
+
+        # 上一帧和这一帧交换缓冲区
+        self._gray, self._previous = self._previous, self._gray
+        self._profile, self._previous_profile = self._previous_profile, self._profile
+
+        if self.last_changed == 0:
+            self.last_own = False
+            return False
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        changed_cols = np.flatnonzero(changed.any(axis=0))
+        if (shift == 0 and changed_rows[-1] - changed_rows[0] < self.cursor_blocks
+                and changed_cols[-1] - changed_cols[0] < self.cursor_blocks):
+            # 没有滚动、变化范围很小：鼠标指针或光标
+            self.last_own = False
+            return False
+
+        # 变化必须到达聊天内容的最下方（中间的消息被撤回、图片加载完成等不算）
+        area = block * block
+        np.sum(self._previous.reshape(rows, block, cols, block), axis=(1, 3), out=self._levels)
+        background = int(np.median(self._levels))
+        content_rows = np.flatnonzero((np.abs(self._levels - background) > self.tolerance * area).any(axis=1))
+        lowest = changed_rows[-1]
+        if len(content_rows) and lowest < content_rows[-1] - 1:
+            self.last_own = False
+            return False
+
+        bubble = changed[max(0, lowest - self._bubble_rows + 1):lowest + 1]
+        incoming = bool(bubble[:, :self._left_cols].any())
+        self.last_own = not incoming and bool(bubble[:, self._right_start:].any())
+        if incoming:
+            self.detections += 1
+        return incoming
+
+    def describe(self) -> str:
+        if self._shape is None:
+            return "像素变化检测: 尚未截图"
+        height, width = self._shape
+        return (f"像素变化检测（{width}x{height}，块 {self.block} 像素）: 已比较 {self.frames} 帧，"
+                f"检测到 {self.detections} 次，上一帧滚动 {self.last_shift} 行、变化 {self.last_changed} 块")
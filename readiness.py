@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送流程的就绪等待
+功能：用真实的就绪信号（窗口已在前台、表情包面板已显示、表情包消息已出现在聊天列表）
+      代替固定的等待时间，每一步都有超时；并记录每一步的耗时，便于调整和跟踪发送延迟
+"""
+
+import time
+from typing import Callable, Optional, Dict, List
+
+# 发送流程的各个步骤，按执行顺序排列
+SEND_STEPS = ('encode', 'activate', 'button', 'panel', 'navigate', 'emoji', 'paste', 'appended', 'total')
+
+STEP_NAMES = {
+    'encode': "准备图片",
+    'activate': "激活窗口",
+    'button': "点击按钮",
+    'panel': "等待面板",
+    'navigate': "翻页导航",
+    'emoji': "点击表情包",
+    'paste': "粘贴发送",
+    'appended': "等待消息出现",
+    'total': "总计",
+}
+
+
+def wait_until(predicate: Callable[[], Optional[bool]], timeout: float,
+               poll_interval: float = 0.02) -> Optional[bool]:
+    """反复检查 predicate 直到返回True或超时
+
+    返回True表示条件已满足，False表示超时；predicate 返回None表示无法判断
+    （当前平台不支持这个就绪信号），此时立即返回None，由调用方退回固定等待。
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        result = predicate()
+        if result is None:
+            return None
+        if result:
+            return True
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(poll_interval)
+
+
+class StepStats:
+    """一个步骤的累计耗时统计"""
+    __slots__ = ('count', 'total', 'max', 'last', 'timeouts')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.timeouts = 0  # 就绪等待超时次数
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class SendTimings:
+    """发送流程每一步的耗时
+
+    每次发送开始时调用 begin()，每完成一步调用 step()，结束时调用 finish()。
+    设置了 histogram（metrics.Histogram）时每一步的耗时同时按步骤名记入直方图。
+    """
+
+    def __init__(self, histogram=None):
+        self.stats: Dict[str, StepStats] = {name: StepStats() for name in SEND_STEPS}
+        self.histogram = histogram
+        self.last: Dict[str, float] = {}
+        self.sends = 0
+        self._start = 0.0
+        self._mark = 0.0
+
+    def begin(self):
+        self._start = self._mark = time.perf_counter()
+        self.last = {}
+
+    def step(self, name: str, timed_out: bool = False):
+        """记录从上一步结束到现在的耗时"""
+        now = time.perf_counter()
+        self._record(name, now - self._mark)
+        if timed_out:
+            self.stats[name].timeouts += 1
+        self._mark = now
+
+    def finish(self):
+        self._record('total', time.perf_counter() - self._start)
+        self.sends += 1
+
+    def _record(self, name: str, elapsed: float):
+        stats = self.stats[name]
+        stats.count += 1
+        stats.total += elapsed
+        stats.last = elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        self.last[name] = elapsed
+        if self.histogram is not None:
+            self.histogram.observe(elapsed, name)
+
+    def summary(self) -> List[str]:
+        """每一步的最近、平均和最大耗时（毫秒）"""
+        lines = []
+        for name in SEND_STEPS:
+            stats = self.stats[name]
+            if not stats.count:
+                continue
+            line = (f"{STEP_NAMES[name]}: 最近 {stats.last * 1000:.0f} ms，"
+                    f"平均 {stats.mean * 1000:.0f} ms，最大 {stats.max * 1000:.0f} ms")
+            if stats.timeouts:
+                line += f"，超时 {stats.timeouts} 次"
+            lines.append(line)
+        return lines
+
+    def as_dict(self) -> dict:
+        return {name: {'count': s.count, 'mean_ms': round(s.mean * 1000, 2),
+                       'max_ms': round(s.max * 1000, 2), 'timeouts': s.timeouts}
+                for name, s in self.stats.items() if s.count}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快照轨迹回放
+功能：把 record 命令录制的聊天列表快照轨迹按录制顺序交给 detect_new_message，
+      比较回放时检测到的新消息和录制时是否一致（回归测试），并统计每次检测的耗时和吞吐量，
+      结果以JSON输出。不需要微信，可以在Linux上运行
+
+用法：
+    python replay_trace.py trace_20250101_120000.wxtrace              # 尽快回放
+    python replay_trace.py trace.wxtrace --speed 1                    # 按录制时的速度回放
+    python replay_trace.py trace.wxtrace --chat 65822 --output replay.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_detection import percentile
+from snapshot_trace import read_trace, TraceReplayBackend, EVENT_SENT, EVENT_DETECTED
+from wechat_auto_emoji import WeChatAutoEmoji
+
+
+def replay(path: str, chat: str = None, speed: float = 0.0) -> dict:
+    """回放轨迹文件，speed 为回放倍速，0 表示尽快回放"""
+    frames = list(read_trace(path))
+    backend = TraceReplayBackend(frames, chat)
+    recorded, replayed, tick_costs = [], [], []
+
+    silent = io.StringIO()
+    with contextlib.redirect_stdout(silent):
+        app = WeChatAutoEmoji(backend=backend)
+        app.calibration_store = None  # 不读写磁盘上的位置配置、表情包选择记录和回复规则
+        app.selection_path = None
+        app.reply_rules = None
+        app.find_wechat_window()
+        app.find_chat_area(app.get_wechat_automation_element())
+        app.reset_detection_baseline()
+        backend.finish_setup()
+
+        start = time.perf_counter()
+        origin = backend.now()
+        while backend.pending:
+            if backend.begin_setup():
+                # 同一个文件中新的一段录制：以开始录制时的快照为基线
+                app.reset_detection_baseline()
+                backend.finish_setup()
+                continue
+            event = backend.next_event()
+            if event is not None:
+                if event.kind == EVENT_SENT:
+                    # 录制时发送了表情包，回放时同样进入冷却期
+                    app.just_sent_emoji = True
+                    app.emoji_send_time = event.timestamp
+                    if event.cooldown is not None:
+                        app.emoji_cooldown = event.cooldown
+                elif event.kind == EVENT_DETECTED:
+                    recorded.append(event.text)
+                continue
+
+            if speed > 0:
+                delay = (backend.now() - origin) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            before = len(backend.pending)
+            tick_start = time.perf_counter()
+            detected = app.detect_new_message()
+            tick_costs.append(time.perf_counter() - tick_start)
+            if detected:
+                replayed.append(app.last_message_text)
+            if len(backend.pending) == before:
+                # 检测器没有读取快照（例如仍在冷却期），丢弃这一帧
+                backend.skip()
+        wall = time.perf_counter() - start
+
+    return {
+        'trace': path,
+        'chat': backend.chat,
+        'frames': len(frames),
+        'snapshot_frames': backend.snapshot_frames,
+        'ticks': len(tick_costs),
+        'recorded_detections': len(recorded),
+        'replayed_detections': len(replayed),
+        'consistent': recorded == replayed,
+        'missing': [text for text in recorded if text not in replayed],
+        'extra': [text for text in replayed if text not in recorded],
+        'tick_cost_p50_us': round(percentile(tick_costs, 50) * 1e6, 1),
+        'tick_cost_p99_us': round(percentile(tick_costs, 99) * 1e6, 1),
+        'ticks_per_second': round(len(tick_costs) / wall, 1) if wall > 0 else 0.0,
+        'wall_seconds': round(wall, 3),
+        'speed': speed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放聊天列表快照轨迹")
+    parser.add_argument('trace', help="record 命令录制的轨迹文件")
+    parser.add_argument('--chat', help="回放的聊天（窗口句柄），默认是快照最多的聊天")
+    parser.add_argument('--speed', type=float, default=0.0, help="回放倍速，1 为录制时的速度，0 为尽快回放")
+    parser.add_argument('--output', help="把JSON结果写入文件（默认输出到终端）")
+    args = parser.parse_args()
+
+    result = replay(args.trace, args.chat, args.speed)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if not result['consistent']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
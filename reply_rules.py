@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复规则
+功能：根据最新消息的内容、发送者和所在聊天决定要不要回复、回复哪些表情包。
+      规则从JSON文件加载，所有规则的关键词编译成一个 Aho-Corasick 自动机，一遍扫描消息文本
+      就得到所有命中的规则；各种条件用位集合合并，按优先级取第一条满足的规则，
+      几千条规则时每条消息的匹配仍然在微秒级。规则文件修改后自动重新加载，不需要重启
+
+规则文件格式（reply_rules.json）：
+    {
+      "version": 1,
+      "default": {"reply": true, "probability": 1.0},
+      "rules": [
+        {"name": "晚安", "keywords": ["晚安", "good night"], "stickers": [3, 7], "max_per_minute": 2},
+        {"name": "大笑", "regex": "哈{3,}", "tags": ["开心"], "probability": 0.5},
+        {"name": "老板", "senders": ["老板"], "reply": false},
+        {"name": "工作群", "chats": ["工作群"], "keywords": ["收到"], "reply": false}
+      ]
+    }
+"""
+
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Optional, List, Dict, Tuple, Iterable, Pattern
+
+RULES_VERSION = 1
+
+# 默认规则文件位置：程序所在目录
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reply_rules.json')
+
+# 正则中引用前面分组的写法：\1、(?P=name)、(?(1)...)
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def combine_patterns(patterns: List[str]) -> Optional[Pattern]:
+    """把几个正则合成一个（任意一个匹配即匹配），不区分英文大小写
+
+    合在一起后第二个起的正则分组编号会变，其中有引用分组的写法时不能合并，返回 None
+    """
+    if any(GROUP_REFERENCE.search(pattern) for pattern in patterns[1:]):
+        return None
+    return re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 自动机：一遍扫描文本，返回命中的所有关键词对应的规则位集合
+
+    关键词不区分英文大小写。每个状态的输出是规则位集合（整数），沿失败链合并好了，
+    扫描时每个字符平均只做常数次字典查找和一次按位或。
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, int]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[int] = [0]
+        for keyword, rule_bit in keywords:
+            keyword = keyword.lower()
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append(0)
+                state = next_state
+            self._output[state] |= rule_bit
+        self._build()
+
+    def _build(self):
+        """按广度优先计算失败链，并把失败链上的输出合并到每个状态"""
+        fail = [0] * len(self._goto)
+        queue = deque()
+        for char, state in self._goto[0].items():
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                target = fail[state]
+                while target and char not in self._goto[target]:
+                    target = fail[target]
+                fallback = self._goto[target].get(char, 0)
+                fail[next_state] = fallback if fallback != next_state else 0
+                self._output[next_state] |= self._output[fail[next_state]]
+        self._fail = fail
+
+    @property
+    def states(self) -> int:
+        return len(self._goto)
+
+    def scan(self, text: str) -> int:
+        goto = self._goto
+        output = self._output
+        fail = self._fail
+        state = 0
+        matched = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            matched |= output[state]
+        return matched
+
+
+class ReplyRule:
+    """一条回复规则"""
+
+    def __init__(self, name: str, keywords: List[str], patterns: List[str], senders: List[str],
+                 chats: List[str], reply: bool = True, probability: float = 1.0,
+                 max_per_minute: int = 0, stickers: Optional[List[int]] = None,
+                 tags: Optional[List[str]] = None, priority: int = 0):
+        self.name = name
+        self.keywords = keywords
+        self.patterns = patterns
+        # 能合并时只有一个正则，否则逐个检查
+        combined = combine_patterns(patterns) if patterns else None
+        self.regexes = [combined] if combined else [re.compile(p, re.IGNORECASE) for p in patterns]
+        self.senders = senders
+        self.chats = chats
+        self.reply = reply
+        self.probability = probability
+        self.max_per_minute = max_per_minute
+        self.stickers = stickers or []   # 表情包面板中的表情包序号
+        self.tags = tags or []           # 本地表情包库的标签（粘贴发送时使用）
+        self.priority = priority
+        self.matches = 0
+
+    @classmethod
+    def from_dict(cls, data: dict, index: int) -> 'ReplyRule':
+        def as_list(value) -> list:
+            if value is None:
+                return []
+            return value if isinstance(value, list) else [value]
+
+        return cls(
+            name=str(data.get('name', f"规则{index + 1}")),
+            keywords=[str(k) for k in as_list(data.get('keywords'))],
+            patterns=[str(p) for p in as_list(data.get('regex'))],
+            senders=[str(s) for s in as_list(data.get('senders'))],
+            chats=[str(c) for c in as_list(data.get('chats'))],
+            reply=bool(data.get('reply', True)),
+            probability=float(data.get('probability', 1.0)),
+            max_per_minute=int(data.get('max_per_minute', 0)),
+            stickers=[int(i) for i in as_list(data.get('stickers'))],
+            tags=[str(t) for t in as_list(data.get('tags'))],
+            priority=int(data.get('priority', 0)),
+        )
+
+
+class ReplyDecision:
+    """规则引擎对一条消息的决定"""
+    __slots__ = ('reply', 'rule', 'stickers', 'tags', 'reason')
+
+    def __init__(self, reply: bool, rule: Optional[ReplyRule] = None, reason: str = ""):
+        self.reply = reply
+        self.rule = rule
+        self.stickers = rule.stickers if rule else []
+        self.tags = rule.tags if rule else []
+        self.reason = reason
+
+    def describe(self) -> str:
+        name = f"规则 {self.rule.name}" if self.rule else "默认规则"
+        return f"{name}: {'回复' if self.reply else '不回复'}{'（' + self.reason + '）' if self.reason else ''}"
+
+
+class CompiledRules:
+    """编译好的规则集合
+
+    规则按优先级（数字大的优先）和在文件中的顺序排列，第 i 条规则对应位集合的第 i 位，
+    位越低优先级越高。每种条件（关键词、正则、发送者、聊天）编译成"命中的规则"位集合，
+    没有这种条件的规则总是满足它。
+    """
+
+    def __init__(self, rules: List[ReplyRule], default_reply: bool = True, default_probability: float = 1.0):
+        self.rules = sorted(rules, key=lambda rule: -rule.priority)
+        self.default_reply = default_reply
+        self.default_probability = default_probability
+
+        keywords = []
+        self.sender_masks: Dict[str, int] = {}
+        self.chat_masks: Dict[str, int] = {}
+        self.no_keyword = self.no_sender = self.no_chat = self.regex_mask = 0
+        patterns = []
+        for index, rule in enumerate(self.rules):
+            bit = 1 << index
+            if rule.keywords:
+                keywords.extend((keyword, bit) for keyword in rule.keywords)
+            else:
+                self.no_keyword |= bit
+            for sender in rule.senders:
+                self.sender_masks[sender] = self.sender_masks.get(sender, 0) | bit
+            if not rule.senders:
+                self.no_sender |= bit
+            for chat in rule.chats:
+                self.chat_masks[chat] = self.chat_masks.get(chat, 0) | bit
+            if not rule.chats:
+                self.no_chat |= bit
+            if rule.regexes:
+                self.regex_mask |= bit
+                patterns.extend(rule.patterns)
+        self.automaton = KeywordAutomaton(keywords)
+
+        # 所有正则合成一个预筛选：一个都匹配不上时不用逐条检查（不能合并时不做预筛选）
+        self.regex_filter = None
+        if patterns:
+            try:
+                self.regex_filter = combine_patterns(patterns)
+            except re.error:
+                self.regex_filter = None
+
+    def match(self, text: str, sender: Optional[str] = None, chat: Optional[str] = None) -> Optional[ReplyRule]:
+        """优先级最高的满足条件的规则，没有时返回 None"""
+        if not self.rules:
+            return None
+        candidates = ((self.automaton.scan(text) | self.no_keyword)
+                      & (self.sender_masks.get(sender, 0) | self.no_sender)
+                      & (self.chat_masks.get(chat, 0) | self.no_chat))
+        if candidates & self.regex_mask and self.regex_filter is not None and not self.regex_filter.search(text):
+            candidates &= ~self.regex_mask
+        while candidates:
+            lowest = candidates & -candidates
+            rule = self.rules[lowest.bit_length() - 1]
+            if not rule.regexes or any(regex.search(text) for regex in rule.regexes):
+                return rule
+            candidates ^= lowest
+        return None
+
+
+class RuleEngine:
+    """回复规则引擎：加载和自动重新加载规则文件，对每条消息做出回复决定
+
+    规则文件不存在时没有规则，所有消息都按默认规则回复（与没有规则引擎时一样）。
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_RULES_PATH, reload_interval: float = 1.0,
+                 rng: Optional[random.Random] = None):
+        self.path = path
+        self.reload_interval = reload_interval  # 检查规则文件是否修改的最小间隔（秒）
+        self.rng = rng or random.Random()
+        self.compiled = CompiledRules([])
+        self._mtime = None
+        self._checked_at = 0.0
+        self._recent: Dict[Tuple[int, str], deque] = {}  # (规则, 聊天) → 最近回复的时间
+        self.loads = 0
+        self.decisions = 0
+        self.maybe_reload(force=True)
+
+    def load_dict(self, data: dict) -> CompiledRules:
+        if data.get('version', RULES_VERSION) != RULES_VERSION:
+            raise ValueError(f"规则文件版本不匹配（{data.get('version')}）")
+        default = data.get('default', {})
+        rules = [ReplyRule.from_dict(rule, index) for index, rule in enumerate(data.get('rules', []))]
+        return CompiledRules(rules, bool(default.get('reply', True)), float(default.get('probability', 1.0)))
+
+    def maybe_reload(self, force: bool = False) -> bool:
+        """规则文件修改后重新加载，返回是否重新加载了；文件有错误时保留原来的规则"""
+        now = time.time()
+        if not self.path or (not force and now - self._checked_at < self.reload_interval):
+            return False
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            if self.compiled.rules:
+                print("规则文件已删除，所有消息按默认规则回复")
+            self.compiled = CompiledRules([])
+            return True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                compiled = self.load_dict(json.load(f))
+        except (OSError, ValueError, TypeError, re.error) as e:
+            print(f"加载回复规则失败，继续使用原来的规则: {e}")
+            return False
+        self.compiled = compiled
+        self._recent = {}
+        self.loads += 1
+        print(f"已加载 {len(compiled.rules)} 条回复规则（关键词自动机 {compiled.automaton.states} 个状态）")
+        return True
+
+    def decide(self, text: Optional[str], sender: Optional[str] = None, chat: Optional[str] = None,
+               now: Optional[float] = None) -> ReplyDecision:
+        """对一条消息做出回复决定；text 为 None 表示不知道消息内容（例如只从窗口标题检测到）"""
+        self.maybe_reload()
+        self.decisions += 1
+        compiled = self.compiled
+        rule = compiled.match(text or "", sender, chat)
+        if rule is None:
+            if not compiled.default_reply:
+                return ReplyDecision(False, reason="没有匹配的规则")
+            if compiled.default_probability < 1.0 and self.rng.random() >= compiled.default_probability:
+                return ReplyDecision(False, reason="按概率跳过")
+            return ReplyDecision(True)
+
+        rule.matches += 1
+        if not rule.reply:
+            return ReplyDecision(False, rule)
+        if rule.probability < 1.0 and self.rng.random() >= rule.probability:
+            return ReplyDecision(False, rule, "按概率跳过")
+        if rule.max_per_minute > 0:
+            now = time.time() if now is None else now
+            recent = self._recent.setdefault((id(rule), chat or ""), deque())
+            while recent and now - recent[0] >= 60.0:
+                recent.popleft()
+            if len(recent) >= rule.max_per_minute:
+                return ReplyDecision(False, rule, f"超过每分钟 {rule.max_per_minute} 次")
+            recent.append(now)
+        return ReplyDecision(True, rule)
+
+    def describe(self) -> List[str]:
+        compiled = self.compiled
+        if not compiled.rules:
+            return [f"没有回复规则（{self.path}），所有消息都回复"]
+        lines = [f"{len(compiled.rules)} 条规则，关键词自动机 {compiled.automaton.states} 个状态，"
+                 f"已判断 {self.decisions} 条消息"]
+        for rule in compiled.rules:
+            if rule.matches:
+                lines.append(f"{rule.name}: 命中 {rule.matches} 次")
+        return lines
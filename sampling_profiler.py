@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+采样分析
+功能：在运行中的程序里看时间花在哪里（COM遍历、MD5、pyautogui、等待）。后台线程每隔几毫秒用
+      sys._current_frames() 读取监控线程和发送线程当前的调用栈并计数，不插桩、不影响被采样的线程。
+      结果写成火焰图工具（flamegraph.pl、speedscope 等）可以直接读取的折叠栈文件，
+      并按自身时间（采样时正在执行这个函数本身）列出最耗时的函数
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Dict, List, Sequence, Tuple
+
+# 默认采样的线程（按线程名）：监控线程、多聊天监控的调度线程、发送队列的执行线程（两种引擎都叫 actuator），
+# 以及异步引擎的事件循环线程和执行检测调用的线程
+PROFILED_THREADS = ('monitor', 'scheduler', 'actuator', 'engine', 'blocking')
+
+# 最内层是这些函数时算作空闲等待：(文件名, 函数名)，函数名为 None 表示整个文件
+IDLE_FRAMES = (('threading.py', None), ('queue.py', None), ('selectors.py', None),
+               ('async_engine.py', '_worker'))  # 执行线程只有在等下一个任务时最内层才是 _worker
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def _is_idle(code) -> bool:
+    filename = os.path.basename(code.co_filename)
+    return any(filename == idle_file and (idle_name is None or code.co_name == idle_name)
+               for idle_file, idle_name in IDLE_FRAMES)
+
+
+class SamplingProfiler:
+    """按固定间隔采样指定线程的调用栈"""
+
+    def __init__(self, thread_names: Sequence[str] = PROFILED_THREADS, interval: float = 0.005):
+        self.thread_names = tuple(thread_names)
+        self.interval = interval                # 采样间隔（秒）
+        self.stacks: Counter = Counter()        # (线程名, 代码对象...) → 采样数，栈从外到内
+        self.leaf_lines: Counter = Counter()    # (代码对象, 行号) → 作为最内层的采样数
+        self.samples = 0                        # 采到的调用栈数（每个线程每次一个）
+        self.rounds = 0                         # 采样次数
+        self.overhead = 0.0                     # 采样本身花的时间（秒）
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self._thread = None
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _targets(self) -> Dict[int, str]:
+        return {thread.ident: thread.name for thread in threading.enumerate()
+                if thread.name in self.thread_names and thread.ident is not None}
+
+    def _loop(self):
+        targets, refreshed = self._targets(), time.perf_counter()
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            if start - refreshed >= 1.0:
+                # 监控重新启动时线程会换，每秒重新找一次
+                targets, refreshed = self._targets(), start
+            self.sample(targets)
+            self.overhead += time.perf_counter() - start
+
+    def sample(self, targets: Dict[int, str]):
+        """采样一次：记录每个目标线程当前的调用栈"""
+        self.rounds += 1
+        frames = sys._current_frames()
+        for ident, name in targets.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            self.leaf_lines[(frame.f_code, frame.f_lineno)] += 1
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.append(name)
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def collapsed(self) -> List[str]:
+        """折叠栈格式的行：线程;最外层函数;...;最内层函数 采样数"""
+        merged: Counter = Counter()
+        for stack, count in self.stacks.items():
+            name, codes = stack[0], stack[1:]
+            merged[';'.join([name] + [self._label(code).replace(';', ':') for code in codes])] += count
+        return [f"{stack} {count}" for stack, count in sorted(merged.items())]
+
+    def write(self, path: str) -> bool:
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for line in self.collapsed():
+                    f.write(line + '\n')
+            return True
+        except OSError as e:
+            print(f"写入采样结果失败: {e}")
+            return False
+
+    def top_self(self, limit: int = 15) -> List[Tuple[str, int, int]]:
+        """自身时间最多的函数：(函数, 采样数, 采样最多的行号)"""
+        functions: Counter = Counter()
+        hottest: Dict[str, Tuple[int, int]] = {}
+        for (code, line), count in self.leaf_lines.items():
+            label = self._label(code)
+            functions[label] += count
+            if count > hottest.get(label, (0, 0))[0]:
+                hottest[label] = (count, line)
+        return [(label, count, hottest[label][1]) for label, count in functions.most_common(limit)]
+
+    def summary(self, limit: int = 15) -> List[str]:
+        if not self.samples:
+            return ["没有采到调用栈（监控或发送线程没有运行）"]
+        lines = [f"采样 {self.elapsed:.1f} 秒，共 {self.rounds} 次、{self.samples} 个调用栈，"
+                 f"采样本身占用 {self.overhead / max(self.elapsed, 1e-9) * 100:.2f}% 的时间"]
+        threads = Counter()
+        for stack, count in self.stacks.items():
+            threads[stack[0]] += count
+        lines.append("各线程: " + "，".join(f"{name} {count}" for name, count in threads.most_common()))
+        idle = sum(count for (code, _), count in self.leaf_lines.items() if _is_idle(code))
+        lines.append(f"空闲等待（发送队列空、等下一次检测、事件循环没有任务）: {idle / self.samples * 100:.1f}%")
+        lines.append("自身时间最多的函数（在 sleep、wait 等里等待的时间算在调用它的那一行）:")
+        for label, count, line in self.top_self(limit):
+            lines.append(f"  {count / self.samples * 100:5.1f}%  {count:6d}  {label} 第 {line} 行最多")
+        return lines
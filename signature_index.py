@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量签名引擎
+功能：只读取并计算聊天列表尾部K条消息的签名，记住上一次的尾部位置，
+      只有尾部移动超过K条时才扩大读取窗口；最近签名保存在有界索引中，成员判断为O(1)
+"""
+
+import hashlib
+from collections import deque
+from typing import Optional, List, Iterable
+
+from chat_snapshot import ChatSnapshot, SnapshotElement
+
+
+class SignatureIndex:
+    """有界的最近签名索引：deque 保存顺序，dict 计数用于O(1)成员判断"""
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._order = deque()
+        self._counts = {}
+
+    def add(self, signature: str):
+        if len(self._order) >= self.maxlen:
+            oldest = self._order.popleft()
+            remaining = self._counts[oldest] - 1
+            if remaining:
+                self._counts[oldest] = remaining
+            else:
+                del self._counts[oldest]
+        self._order.append(signature)
+        self._counts[signature] = self._counts.get(signature, 0) + 1
+
+    def replace(self, signatures: Iterable[str]):
+        """用新的签名序列替换索引内容（只保留最后 maxlen 个）"""
+        self.clear()
+        for signature in signatures:
+            self.add(signature)
+
+    def clear(self):
+        self._order.clear()
+        self._counts.clear()
+
+    def __contains__(self, signature) -> bool:
+        return signature in self._counts
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+
+def anchor_key(item: SnapshotElement) -> str:
+    """与位置无关的元素特征，用于在新尾部中定位上一次的尾部"""
+    data = f"{item.name}|{item.control_type}|{item.automation_id}"
+    return hashlib.md5(data.encode('utf-8')).hexdigest()[:12]
+
+
+def anchor_span(anchors: List[str], length: int) -> int:
+    """从尾部数起需要的条数：包含最后 length 条，以及其中最早一条所在的那串相同消息之前的一条
+
+    返回值比 len(anchors) 大时，说明这串相同的消息一直延续到了读取窗口之外。
+    """
+    start = max(0, len(anchors) - length)
+    while 0 < start < len(anchors) and anchors[start - 1] == anchors[start]:
+        start -= 1
+    return len(anchors) - start + 1
+
+
+class IncrementalSignatureEngine:
+    """聊天列表尾部的增量签名引擎
+
+    每次只读取最后 window 条消息。用上一次尾部最后几条消息的位置无关特征
+    在新尾部中定位：找到则说明新增了 appended 条；找不到且列表还有更早的消息，
+    说明尾部移动超过了窗口，窗口翻倍后重新读取。
+    尾部是一串内容相同的消息（例如连续的"哈哈"）时，窗口扩大到包含这一串之前的那条消息，
+    锚点也从那条消息开始，否则既无法定位新增的条数，消息标识中的重复次数也只在窗口内计数，
+    窗口移动后同一条消息的标识会变化。
+    """
+
+    def __init__(self, initial_window: int = 8, max_window: int = 512, anchor_length: int = 3):
+        self.initial_window = initial_window
+        self.max_window = max_window
+        self.anchor_length = anchor_length
+        self.window = initial_window
+        self._last_anchors: Optional[List[str]] = None
+
+    def reset(self):
+        """清除记住的尾部（例如切换了聊天区域）"""
+        self._last_anchors = None
+        self.window = self.initial_window
+
+    def _locate(self, anchors: List[str]) -> int:
+        """在新尾部中查找上一次尾部最后一条消息的下标，找不到返回-1"""
+        expected = self._last_anchors
+        for end in range(len(anchors) - 1, -1, -1):
+            if anchors[end] != expected[-1]:
+                continue
+            # 向前核对更多条，避免内容相同的消息（例如连续的"好的"）误匹配
+            matched = True
+            for offset in range(1, len(expected)):
+                index = end - offset
+                if index < 0:
+                    break
+                if anchors[index] != expected[-1 - offset]:
+                    matched = False
+                    break
+            if matched:
+                return end
+        return -1
+
+    def fetch(self, builder, chat_element) -> ChatSnapshot:
+        """读取聊天列表尾部，返回的快照 appended 字段为新增的消息数量"""
+        com_calls = 0
+        while True:
+            snapshot = builder.build_tail(chat_element, self.window)
+            com_calls += snapshot.com_calls
+            anchors = [anchor_key(item) for item in snapshot.items]
+            span = anchor_span(anchors, self.anchor_length)
+
+            if span > len(anchors) and snapshot.has_more and self.window < self.max_window:
+                # 最后几条所在的那串相同消息延续到了窗口之外，扩大窗口直到读到这一串之前的消息
+                self.window = min(self.max_window, self.window * 2)
+                continue
+
+            if self._last_anchors is None:
+                # 第一次读取，只建立基线
+                appended = 0
+                break
+            if not self._last_anchors:
+                # 上一次列表为空，现在的消息全部是新增的
+                appended = len(anchors)
+                break
+
+            position = self._locate(anchors)
+            if position >= 0:
+                appended = len(anchors) - 1 - position
+                # 新增消息很少时逐步收缩窗口，收缩后仍要包含尾部相同消息之前的那条
+                if (appended <= self.window // 4 and self.window > self.initial_window
+                        and span <= self.window // 2):
+                    self.window = max(self.initial_window, self.window // 2)
+                break
+
+            if snapshot.has_more and self.window < self.max_window:
+                # 尾部移动超过了窗口，扩大窗口重新读取
+                self.window = min(self.max_window, self.window * 2)
+                continue
+
+            # 窗口已经覆盖整个列表或达到上限，整个尾部都视为新消息
+            appended = len(anchors)
+            break
+
+        self._last_anchors = anchors[-span:]
+        snapshot.com_calls = com_calls
+        snapshot.appended = appended
+        return snapshot
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟的UI Automation聊天树
+功能：在内存中模拟微信聊天列表（元素属性、FindAll、结构变化事件），
+      用于在没有微信、甚至非Windows的环境下测试消息检测逻辑
+"""
+
+import itertools
+import threading
+import time
+from typing import Optional, List, Callable
+
+from uia_events import (
+    MessageEventSource,
+    CHANGE_CHILD_ADDED,
+    CHANGE_CHILD_REMOVED,
+    CHANGE_CHILDREN_INVALIDATED,
+)
+
+# 与 UIAutomationClient 中取值一致的常量
+TreeScope_Element = 1
+TreeScope_Children = 2
+TreeScope_Descendants = 4
+TreeScope_Subtree = 7
+
+UIA_BoundingRectanglePropertyId = 30001
+UIA_ControlTypePropertyId = 30003
+UIA_NamePropertyId = 30005
+UIA_AutomationIdPropertyId = 30011
+UIA_ClassNamePropertyId = 30012
+UIA_ButtonControlTypeId = 50000
+UIA_ListItemControlTypeId = 50007
+UIA_ListControlTypeId = 50008
+UIA_TextControlTypeId = 50020
+UIA_PaneControlTypeId = 50033
+UIA_WindowControlTypeId = 50032
+
+
+class FakeRect:
+    """模拟的 BoundingRectangle"""
+    __slots__ = ('left', 'top', 'right', 'bottom')
+
+    def __init__(self, left=0, top=0, right=0, bottom=0):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+
+
+class FakeCondition:
+    """模拟的查找条件，property_id 为 None 表示 TrueCondition"""
+    __slots__ = ('property_id', 'value')
+
+    def __init__(self, property_id=None, value=None):
+        self.property_id = property_id
+        self.value = value
+
+    def matches(self, element) -> bool:
+        if self.property_id is None:
+            return True
+        if self.property_id == UIA_ControlTypePropertyId:
+            return element.CurrentControlType == self.value
+        if self.property_id == UIA_NamePropertyId:
+            return element.CurrentName == self.value
+        return False
+
+
+class FakeCacheRequest:
+    """模拟的 IUIAutomationCacheRequest"""
+
+    def __init__(self):
+        self.properties = []
+        self.TreeScope = TreeScope_Element
+
+    def AddProperty(self, property_id):
+        self.properties.append(property_id)
+
+
+class FakeElementArray:
+    """模拟的 IUIAutomationElementArray"""
+
+    def __init__(self, elements):
+        self._elements = elements
+        self.Length = len(elements)
+
+    def GetElement(self, index):
+        return self._elements[index]
+
+
+class FakeElement:
+    """模拟的 IUIAutomationElement"""
+
+    _runtime_ids = itertools.count(1)
+
+    def __init__(self, name='', control_type=UIA_TextControlTypeId, automation_id='',
+                 class_name='', rect: Optional[FakeRect] = None, children=None):
+        self.CurrentName = name
+        self.CurrentControlType = control_type
+        self.CurrentAutomationId = automation_id
+        self.CurrentClassName = class_name
+        self.CurrentBoundingRectangle = rect or FakeRect()
+        self.children = list(children or [])
+        self.parent = None
+        for child in self.children:
+            child.parent = self
+        self.tree = None  # 所属的 FakeChatTree，用于统计调用次数
+        self._listeners = []
+        self._runtime_id = (42, next(FakeElement._runtime_ids))
+
+    def _walk(self, include_self: bool):
+        if include_self:
+            yield self
+        for child in self.children:
+            yield from child._walk(True)
+
+    def FindAll(self, scope, condition):
+        if self.tree is not None:
+            self.tree.com_calls += 1
+        if scope == TreeScope_Children:
+            candidates = self.children
+        elif scope == TreeScope_Element:
+            candidates = [self]
+        else:
+            candidates = list(self._walk(scope == TreeScope_Subtree))
+        return FakeElementArray([e for e in candidates if condition.matches(e)])
+
+    def FindAllBuildCache(self, scope, condition, cache_request):
+        # 模拟元素的属性本来就在内存中，只需要和真实接口一样只计一次调用
+        return self.FindAll(scope, condition)
+
+    # 缓存属性与当前属性相同
+    CachedName = property(lambda self: self.CurrentName)
+    CachedControlType = property(lambda self: self.CurrentControlType)
+    CachedAutomationId = property(lambda self: self.CurrentAutomationId)
+    CachedClassName = property(lambda self: self.CurrentClassName)
+    CachedBoundingRectangle = property(lambda self: self.CurrentBoundingRectangle)
+
+    def GetCachedChildren(self):
+        return FakeElementArray(self.children)
+
+    def GetRuntimeId(self):
+        return self._runtime_id
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """订阅本元素的子元素结构变化"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[int], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def emit(self, change_type: int):
+        for callback in list(self._listeners):
+            callback(change_type)
+
+
+class FakeTreeWalker:
+    """模拟的 IUIAutomationTreeWalker（RawView）"""
+
+    @staticmethod
+    def _count(element):
+        if element is not None and element.tree is not None:
+            element.tree.com_calls += 1
+
+    def GetParentElement(self, element):
+        self._count(element)
+        return element.parent
+
+    def GetLastChildElementBuildCache(self, element, cache_request):
+        self._count(element)
+        return element.children[-1] if element.children else None
+
+    def GetPreviousSiblingElementBuildCache(self, element, cache_request):
+        self._count(element)
+        parent = element.parent
+        if parent is None:
+            return None
+        siblings = parent.children
+        # 从尾部向前查找：沿尾部遍历时只需要很少的比较
+        for index in range(len(siblings) - 1, -1, -1):
+            if siblings[index] is element:
+                return siblings[index - 1] if index > 0 else None
+        return None
+
+
+class FakeUIAutomation:
+    """模拟的 IUIAutomation，只实现本程序用到的方法"""
+
+    def __init__(self, root: FakeElement, roots=None):
+        self.root = root
+        self.roots = roots or {}  # 窗口句柄 → 窗口根元素
+        self.RawViewWalker = FakeTreeWalker()
+
+    def CreateTrueCondition(self):
+        return FakeCondition()
+
+    def CreatePropertyCondition(self, property_id, value):
+        return FakeCondition(property_id, value)
+
+    def CreateCacheRequest(self):
+        return FakeCacheRequest()
+
+    def ElementFromHandle(self, hwnd):
+        return self.roots.get(hwnd, self.root)
+
+    def CompareElements(self, first, second):
+        return first is second
+
+
+class FakeChatTree:
+    """模拟的微信窗口元素树：窗口 → 面板 → 聊天消息列表
+
+    消息按从上到下的顺序排列，对方的消息气泡在左侧，自己的消息气泡在右侧。
+    """
+
+    def __init__(self, window_rect=(0, 0, 800, 600), item_height=60, class_name='WeChatMainWndForPC'):
+        self.window_rect = FakeRect(*window_rect)
+        self.item_height = item_height
+        self.com_calls = 0
+        self.title = "微信"
+        self._lock = threading.RLock()
+
+        left, top, right, bottom = window_rect
+        self.chat_list = FakeElement('消息', UIA_ListControlTypeId,
+                                     rect=FakeRect(left + 300, top + 60, right, bottom - 150))
+        # 会话列表也是一个列表控件，但比聊天区域小
+        self.session_list = FakeElement('会话', UIA_ListControlTypeId,
+                                        rect=FakeRect(left + 60, top + 60, left + 300, bottom))
+        self.root = FakeElement('微信', UIA_WindowControlTypeId, class_name=class_name,
+                                rect=FakeRect(*window_rect),
+                                children=[FakeElement('', UIA_PaneControlTypeId,
+                                                      children=[self.session_list, self.chat_list])])
+        for element in self.root._walk(True):
+            element.tree = self
+
+    @property
+    def messages(self) -> List[FakeElement]:
+        return self.chat_list.children
+
+    def _make_item(self, text: str, own: bool, sender: Optional[str] = None) -> FakeElement:
+        index = len(self.chat_list.children)
+        list_rect = self.chat_list.CurrentBoundingRectangle
+        top = list_rect.top + index * self.item_height
+        center = (list_rect.left + list_rect.right) // 2
+        if own:
+            bubble_rect = FakeRect(center + 40, top + 5, list_rect.right - 60, top + self.item_height - 5)
+            bubble_class = 'SelfBubble'
+        else:
+            bubble_rect = FakeRect(list_rect.left + 60, top + 5, center - 40, top + self.item_height - 5)
+            bubble_class = 'OtherBubble'
+        bubble = FakeElement(text, UIA_TextControlTypeId, class_name=bubble_class, rect=bubble_rect)
+        children = [bubble]
+        if sender:
+            # 头像按钮的名称是发送者的昵称，在气泡外侧
+            avatar_left = bubble_rect.right + 10 if own else list_rect.left + 10
+            children.insert(0, FakeElement(sender, UIA_ButtonControlTypeId,
+                                           rect=FakeRect(avatar_left, top + 5, avatar_left + 40, top + 45)))
+        item = FakeElement(text, UIA_ListItemControlTypeId, automation_id='',
+                           rect=FakeRect(list_rect.left, top, list_rect.right, top + self.item_height),
+                           children=children)
+        item.parent = self.chat_list
+        item.tree = self
+        for child in children:
+            child.tree = self
+        return item
+
+    def add_message(self, text: str, own: bool = False, sender: Optional[str] = None) -> FakeElement:
+        """追加一条消息并发出 ChildAdded 通知，sender 为群聊中消息的发送者"""
+        with self._lock:
+            item = self._make_item(text, own, sender)
+            self.chat_list.children.append(item)
+        self.chat_list.emit(CHANGE_CHILD_ADDED)
+        return item
+
+    def remove_oldest(self, count: int = 1):
+        """移除最旧的消息（模拟微信回收不可见的消息元素）"""
+        with self._lock:
+            del self.chat_list.children[:count]
+        self.chat_list.emit(CHANGE_CHILD_REMOVED)
+
+    def clear(self):
+        """清空聊天列表（模拟切换聊天）"""
+        with self._lock:
+            self.chat_list.children = []
+        self.chat_list.emit(CHANGE_CHILDREN_INVALIDATED)
+
+    def rebuild_chat_list(self):
+        """模拟微信重建聊天列表控件（例如切换聊天）：旧元素失效，新元素接管现有的消息"""
+        with self._lock:
+            old = self.chat_list
+            rect = old.CurrentBoundingRectangle
+            new = FakeElement(old.CurrentName, UIA_ListControlTypeId,
+                              rect=FakeRect(rect.left, rect.top, rect.right, rect.bottom), children=old.children)
+            new.tree = self
+            pane = old.parent
+            pane.children[pane.children.index(old)] = new
+            new.parent = pane
+            old.children = []
+            old.parent = None
+            old.CurrentBoundingRectangle = FakeRect()
+            self.chat_list = new
+        old.emit(CHANGE_CHILDREN_INVALIDATED)
+
+    def set_title(self, title: str):
+        self.title = title
+
+
+class FakeTreeEventSource(MessageEventSource):
+    """订阅模拟聊天树结构变化的事件源"""
+
+    def __init__(self, max_pending: int = 256):
+        super().__init__(max_pending)
+        self._element = None
+
+    def start(self, chat_element) -> bool:
+        if self.is_active:
+            return True
+        if chat_element is None or not hasattr(chat_element, 'add_listener'):
+            return False
+        chat_element.add_listener(self.notify)
+        self._element = chat_element
+        self.is_active = True
+        return True
+
+    def stop(self):
+        if self._element is not None:
+            self._element.remove_listener(self.notify)
+            self._element = None
+        super().stop()
+
+
+def play_script(script, speed: float = 1.0) -> threading.Thread:
+    """在后台线程中按时间脚本执行操作
+
+    script 为 [(延迟秒数, 操作), ...]，操作是无参函数，通常是对 FakeChatTree 的修改，
+    例如 lambda: tree.add_message("你好")。speed 为回放倍速，0 表示不等待。
+    """
+    def _play():
+        for delay, action in script:
+            if delay > 0 and speed > 0:
+                time.sleep(delay / speed)
+            action()
+
+    thread = threading.Thread(target=_play, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天列表快照的录制和回放
+功能：监控时把每次检测读取的聊天列表快照（以及发送、检测到新消息等事件）追加写入压缩的轨迹文件；
+      回放后端按录制的顺序把快照交给 detect_new_message，可以按原速或尽快回放，
+      在没有微信的环境（包括Linux）上重现检测问题、做回归测试和吞吐量测试
+
+轨迹文件格式：8字节文件头，之后是一个个帧，每帧为 (标志, 时间戳, 数据长度) 帧头 + 数据。
+快照帧的数据是 zlib 压缩的JSON，以上一个快照帧的原始数据为预置字典（相邻快照大部分相同，压缩率很高）；
+每次打开文件后的第一个快照帧不使用字典（关键帧）。与该聊天上一个快照相同的快照只写一个不带内容的帧。
+开始录制时先为每个聊天写一个基线帧：检测器最近一次读取的快照，回放时以它作为检测基线。
+文件只追加，程序异常退出时最多丢失最后一个不完整的帧。
+"""
+
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from typing import Optional, List, Iterator, Iterable, Tuple
+
+from backends import SimulatedBackend
+from chat_snapshot import ChatSnapshot, SnapshotElement
+
+TRACE_MAGIC = b'WXTRACE1'
+
+# 帧头：标志、时间戳、数据长度
+FRAME_HEADER = struct.Struct('<BdI')
+
+FLAG_KEYFRAME = 1    # 压缩时没有使用预置字典
+FLAG_UNCHANGED = 2   # 与该聊天上一个快照相同，数据只有聊天标识
+FLAG_EVENT = 4       # 事件帧（发送、检测到新消息），数据是独立压缩的JSON
+FLAG_BASELINE = 8    # 开始录制时的基线快照（录制之前检测器已经见过的消息）
+
+EVENT_SENT = 'sent'
+EVENT_DETECTED = 'detected'
+
+
+class TraceFrame:
+    """轨迹中的一帧：一份快照或一个事件"""
+    __slots__ = ('kind', 'timestamp', 'chat', 'title', 'window', 'items', 'is_tail', 'has_more',
+                 'appended', 'text', 'cooldown', 'baseline')
+
+    def __init__(self, kind: str, timestamp: float, chat: str, title: str = '',
+                 window: Optional[Tuple[int, int, int, int]] = None, items: Optional[List[SnapshotElement]] = None,
+                 is_tail: bool = False, has_more: bool = False, appended: int = 0, text: Optional[str] = None,
+                 cooldown: Optional[float] = None, baseline: bool = False):
+        self.kind = kind            # 'snapshot' 或事件名称
+        self.timestamp = timestamp
+        self.chat = chat            # 聊天标识（窗口句柄）
+        self.title = title
+        self.window = window        # (left, top, width, height)
+        self.items = items or []
+        self.is_tail = is_tail
+        self.has_more = has_more
+        self.appended = appended
+        self.text = text            # 事件附带的消息文本
+        self.cooldown = cooldown    # 发送事件时的冷却时间
+        self.baseline = baseline    # 是否为开始录制时的基线快照
+
+    def to_snapshot(self) -> ChatSnapshot:
+        snapshot = ChatSnapshot(self.items, com_calls=0, timestamp=self.timestamp,
+                                is_tail=self.is_tail, has_more=self.has_more)
+        snapshot.appended = self.appended
+        return snapshot
+
+
+class TraceRecorder:
+    """把快照和事件追加写入轨迹文件（线程安全，检测线程和发送线程都会写入）"""
+
+    def __init__(self, path: str, level: int = 6):
+        self.path = path
+        self.level = level
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(TRACE_MAGIC)
+        self._dictionary = None            # 上一个快照帧的原始数据
+        self._last_payload = {}            # 聊天 → 该聊天上一个快照的原始数据
+        self.frames = 0
+        self.unchanged = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def _write(self, flags: int, timestamp: float, data: bytes):
+        self._file.write(FRAME_HEADER.pack(flags, timestamp, len(data)))
+        self._file.write(data)
+        # 每帧都写到文件，程序异常退出时不丢失已录制的内容
+        self._file.flush()
+        self.frames += 1
+        self.written_bytes += FRAME_HEADER.size + len(data)
+
+    def record_snapshot(self, snapshot: ChatSnapshot, chat: str, title: str,
+                        window: Optional[Tuple[int, int, int, int]], baseline: bool = False):
+        payload = json.dumps({
+            'chat': chat,
+            'title': title,
+            'window': list(window) if window else None,
+            'tail': snapshot.is_tail,
+            'more': snapshot.has_more,
+            'appended': snapshot.appended,
+            'items': [item.to_dict() for item in snapshot.items],
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            self.raw_bytes += len(payload)
+            marker = FLAG_BASELINE if baseline else 0
+            if self._last_payload.get(chat) == payload:
+                self.unchanged += 1
+                self._write(FLAG_UNCHANGED | marker, snapshot.timestamp, chat.encode('utf-8'))
+                return
+            self._last_payload[chat] = payload
+            if self._dictionary is None:
+                flags = FLAG_KEYFRAME | marker
+                compressor = zlib.compressobj(self.level)
+            else:
+                flags = marker
+                compressor = zlib.compressobj(self.level, zdict=self._dictionary)
+            self._write(flags, snapshot.timestamp, compressor.compress(payload) + compressor.flush())
+            self._dictionary = payload
+
+    def record_event(self, event: str, chat: str, text: Optional[str] = None, timestamp: Optional[float] = None,
+                     cooldown: Optional[float] = None):
+        payload = json.dumps({'chat': chat, 'event': event, 'text': text, 'cooldown': cooldown},
+                             ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            self._write(FLAG_EVENT, time.time() if timestamp is None else timestamp, zlib.compress(payload))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def describe(self) -> str:
+        ratio = self.raw_bytes / self.written_bytes if self.written_bytes else 0.0
+        return (f"{self.path}: {self.frames} 帧（未变化 {self.unchanged} 帧），"
+                f"写入 {self.written_bytes / 1024:.1f} KB，压缩比 {ratio:.1f}")
+
+
+def read_trace(path: str) -> Iterator[TraceFrame]:
+    """按顺序读取轨迹文件中的帧，末尾不完整的帧被忽略"""
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"不是快照轨迹文件: {path}")
+        dictionary = None
+        last_payload = {}
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            flags, timestamp, length = FRAME_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+
+            if flags & FLAG_EVENT:
+                event = json.loads(zlib.decompress(data))
+                yield TraceFrame(event['event'], timestamp, event['chat'], text=event.get('text'),
+                                 cooldown=event.get('cooldown'))
+                continue
+            if flags & FLAG_UNCHANGED:
+                payload = last_payload.get(data.decode('utf-8'))
+                if payload is None:
+                    continue
+            else:
+                if flags & FLAG_KEYFRAME:
+                    decompressor = zlib.decompressobj()
+                else:
+                    decompressor = zlib.decompressobj(zdict=dictionary)
+                payload = decompressor.decompress(data) + decompressor.flush()
+                dictionary = payload
+
+            snapshot = json.loads(payload)
+            last_payload[snapshot['chat']] = payload
+            window = snapshot.get('window')
+            yield TraceFrame('snapshot', timestamp, snapshot['chat'], snapshot.get('title', ''),
+                             tuple(window) if window else None,
+                             [SnapshotElement.from_dict(item) for item in snapshot['items']],
+                             snapshot.get('tail', False), snapshot.get('more', False),
+                             snapshot.get('appended', 0), baseline=bool(flags & FLAG_BASELINE))
+
+
+class TraceReplayBackend(SimulatedBackend):
+    """回放轨迹的后端
+
+    只回放一个聊天（默认是快照最多的聊天）。检测器每次读取快照时按录制顺序取下一个快照帧，
+    同时把窗口标题和位置更新为录制时的值；now() 返回下一帧的录制时间，
+    检测中的冷却期和检测间隔判断与录制时一致。事件帧由回放循环用 next_event() 取出。
+    轨迹以基线帧开始时，调用 finish_setup() 之前（查找聊天区域、记录检测基线）读取快照都只得到基线帧，
+    now() 也返回基线帧的时间，不会用掉录制的第一次检测的快照；
+    轨迹中间的基线帧（同一个文件录制了多段）由回放循环用 begin_setup() 取出后重新记录基线。
+    """
+
+    name = "replay"
+
+    def __init__(self, frames: Iterable[TraceFrame], chat: Optional[str] = None):
+        frames = list(frames)
+        if chat is None:
+            counts = Counter(frame.chat for frame in frames if frame.kind == 'snapshot')
+            chat = counts.most_common(1)[0][0] if counts else None
+        self.chat = chat
+        self.pending = deque(frame for frame in frames if frame.chat == chat)
+        self.snapshot_frames = sum(1 for frame in self.pending if frame.kind == 'snapshot')
+        first = next((frame for frame in self.pending if frame.kind == 'snapshot'), None)
+        left, top, width, height = first.window if first and first.window else (0, 0, 800, 600)
+        super().__init__(window_rect=(left, top, left + width, top + height))
+        if first is not None:
+            self.window.tree.set_title(first.title)
+        self.current: Optional[TraceFrame] = None
+        self.replayed = 0
+        # 开始录制时写入的基线帧，检测器记录基线时读取
+        self.setup_frame: Optional[TraceFrame] = None
+        self.setting_up = True
+        self.begin_setup()
+
+    def now(self) -> float:
+        if self.setting_up and self.setup_frame is not None:
+            return self.setup_frame.timestamp
+        if self.pending:
+            return self.pending[0].timestamp
+        return self.current.timestamp if self.current else time.time()
+
+    def begin_setup(self) -> bool:
+        """下一帧是基线帧（开始了新的一段录制）时取出，finish_setup() 之前读取快照都得到这一帧"""
+        if not (self.pending and self.pending[0].kind == 'snapshot' and self.pending[0].baseline):
+            return False
+        self.setup_frame = self.pending.popleft()
+        self.setting_up = True
+        return True
+
+    def finish_setup(self):
+        """检测器已经记录了基线，之后读取快照按顺序回放"""
+        self.setting_up = False
+
+    def next_event(self) -> Optional[TraceFrame]:
+        """下一帧是事件帧时取出并返回，否则返回 None"""
+        if self.pending and self.pending[0].kind != 'snapshot':
+            return self.pending.popleft()
+        return None
+
+    def skip(self):
+        """丢弃下一帧（检测器没有读取快照时避免回放停住）"""
+        if self.pending:
+            self.current = self.pending.popleft()
+
+    def replay_snapshot(self, window) -> Optional[ChatSnapshot]:
+        if self.setting_up and self.setup_frame is not None:
+            self.current = self.setup_frame
+            return self.setup_frame.to_snapshot()
+        while self.pending and self.pending[0].kind != 'snapshot':
+            # 快照之间的事件由回放循环处理，这里只跳过检测器自己没有消费的
+            self.pending.popleft()
+        if not self.pending:
+            # 轨迹放完后一直返回最后一个快照（没有新增消息）
+            if self.current is None or self.current.kind != 'snapshot':
+                return ChatSnapshot([], com_calls=0, timestamp=self.now())
+            snapshot = self.current.to_snapshot()
+            snapshot.appended = 0
+            return snapshot
+
+        self.current = self.pending.popleft()
+        self.replayed += 1
+        if self.current.window:
+            self.window.set_geometry(*self.current.window)
+        self.window.tree.set_title(self.current.title)
+        return self.current.to_snapshot()
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地表情包库索引
+功能：扫描本地图片目录，按内容哈希去掉重复的图片，读取尺寸、帧数和标签（来自目录名和文件名），
+      写成紧凑的二进制索引，缩略图和编码好的剪贴板数据写入一个数据文件。两个文件都用 mmap 打开，
+      启动时不需要解析，记录在用到时才解码；重新索引时按文件大小和修改时间增量进行，
+      没有变化的文件不重新读取，内容没变只是改名或修改时间变化的文件按哈希复用已有数据
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from typing import Optional, List, Dict, Tuple
+
+from sticker_paste import IMAGE_EXTENSIONS, CF_DIB, ClipboardPayload, encode_payload
+
+# 索引文件格式
+INDEX_MAGIC = b'STKIDX\0\0'
+INDEX_VERSION = 1
+INDEX_NAME = '.stickers.idx'
+STORE_NAME = '.stickers.dat'
+
+# 文件头：魔数、版本、不重复的记录数、重复文件的记录数、字符串表偏移
+HEADER = struct.Struct('<8sIIIQ')
+
+# 每条记录：内容哈希、文件大小、修改时间、路径和标签在字符串表中的位置、
+# 宽、高、帧数、图片格式、剪贴板数据格式、缩略图和剪贴板数据在数据文件中的位置
+RECORD = struct.Struct('<16sQdIIIIHHHBBQIQI')
+
+HASH_SIZE = 16
+TAG_SEPARATOR = '\x1f'
+
+# 图片格式编号
+FORMATS = ('unknown', 'png', 'gif', 'jpeg', 'bmp', 'webp')
+
+# 缩略图边长（需要 Pillow）
+THUMBNAIL_SIZE = 64
+
+
+def content_hash(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def _png_info(data: bytes) -> Tuple[int, int, int]:
+    width, height = struct.unpack_from('>II', data, 16)
+    frames = 1
+    pos = 8
+    # APNG 的 acTL 块在第一个 IDAT 之前
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack_from('>I4s', data, pos)
+        if kind == b'acTL' and pos + 12 <= len(data):
+            frames = struct.unpack_from('>I', data, pos + 8)[0]
+            break
+        if kind in (b'IDAT', b'IEND'):
+            break
+        pos += 12 + length
+    return width, height, frames
+
+
+def _skip_sub_blocks(data: bytes, pos: int) -> int:
+    while pos < len(data):
+        size = data[pos]
+        pos += 1
+        if size == 0:
+            break
+        pos += size
+    return pos
+
+
+def _gif_info(data: bytes) -> Tuple[int, int, int]:
+    width, height = struct.unpack_from('<HH', data, 6)
+    flags = data[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 * (2 << (flags & 7))
+    frames = 0
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x2C:      # 图像描述符
+            frames += 1
+            local_flags = data[pos + 9] if pos + 9 < len(data) else 0
+            pos += 10
+            if local_flags & 0x80:
+                pos += 3 * (2 << (local_flags & 7))
+            pos = _skip_sub_blocks(data, pos + 1)  # 跳过 LZW 最小码长后的数据块
+        elif block == 0x21:    # 扩展块
+            pos = _skip_sub_blocks(data, pos + 2)
+        else:                  # 0x3B 结束或数据损坏
+            break
+    return width, height, max(1, frames)
+
+
+def _jpeg_info(data: bytes) -> Tuple[int, int, int]:
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from('>HH', data, pos + 5)
+            return width, height, 1
+        pos += 2 + struct.unpack_from('>H', data, pos + 2)[0]
+    return 0, 0, 1
+
+
+def _webp_info(data: bytes) -> Tuple[int, int, int]:
+    width = height = 0
+    frames = 0
+    pos = 12
+    while pos + 8 <= len(data):
+        kind, length = struct.unpack_from('<4sI', data, pos)
+        body = pos + 8
+        if kind == b'VP8X':
+            width = 1 + int.from_bytes(data[body + 4:body + 7], 'little')
+            height = 1 + int.from_bytes(data[body + 7:body + 10], 'little')
+        elif kind == b'VP8 ' and not width:
+            width, height = (v & 0x3FFF for v in struct.unpack_from('<HH', data, body + 6))
+        elif kind == b'VP8L' and not width:
+            bits = struct.unpack_from('<I', data, body + 1)[0]
+            width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        elif kind == b'ANMF':
+            frames += 1
+        pos = body + length + (length & 1)
+    return width, height, max(1, frames)
+
+
+def probe_image(data: bytes) -> Tuple[str, int, int, int]:
+    """从文件头读取 (格式, 宽, 高, 帧数)，不需要解码图片；无法识别时格式为 unknown"""
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return ('png',) + _png_info(data)
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return ('gif',) + _gif_info(data)
+        if data.startswith(b'\xff\xd8'):
+            return ('jpeg',) + _jpeg_info(data)
+        if data.startswith(b'BM') and len(data) >= 26:
+            width, height = struct.unpack_from('<ii', data, 18)
+            return 'bmp', width, abs(height), 1
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return ('webp',) + _webp_info(data)
+    except (struct.error, IndexError):
+        pass
+    return 'unknown', 0, 0, 1
+
+
+def path_tags(relative_path: str) -> List[str]:
+    """标签：所在的各级目录名，以及文件名中按分隔符拆开的词（去掉纯数字）"""
+    parts = relative_path.replace('\\', '/').split('/')
+    tags = [part for part in parts[:-1] if part]
+    stem = os.path.splitext(parts[-1])[0]
+    for word in re.split(r'[\s_\-.,，、]+', stem):
+        if word and not word.isdigit() and word not in tags:
+            tags.append(word)
+    return tags
+
+
+def make_thumbnail(path: str) -> bytes:
+    """PNG 缩略图，需要 Pillow；没有安装或无法解码时返回空"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b''
+    try:
+        import io
+        with Image.open(path) as image:
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            output = io.BytesIO()
+            image.convert('RGBA').save(output, 'PNG')
+            return output.getvalue()
+    except (OSError, ValueError):
+        return b''
+
+
+class StickerEntry:
+    """表情包库中的一张图片"""
+    __slots__ = ('index', 'hash', 'path', 'size', 'mtime', 'width', 'height', 'frames', 'format', 'tags')
+
+    def __init__(self, index: int, hash: bytes, path: str, size: int, mtime: float,
+                 width: int, height: int, frames: int, format: str, tags: List[str]):
+        self.index = index
+        self.hash = hash
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.format = format
+        self.tags = tags
+
+    @property
+    def animated(self) -> bool:
+        return self.frames > 1
+
+
+class StickerLibrary:
+    """用 mmap 打开的表情包库，可以像列表一样按序号取得图片路径
+
+    打开时只读取文件头，记录、路径和数据在用到时才从 mmap 中解码。
+    """
+
+    def __init__(self, directory: str, index_dir: Optional[str] = None):
+        self.directory = os.path.abspath(directory)
+        self.index_dir = index_dir or self.directory
+        self.lock = threading.RLock()
+        self._index_file = self._store_file = None
+        self._index = self._store = None
+        self.count = 0
+        self.duplicates = 0
+        self._strings_offset = 0
+        self._by_path: Optional[Dict[str, int]] = None
+        self._by_tag: Optional[Dict[str, List[int]]] = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.index_dir, INDEX_NAME)
+
+    @property
+    def store_path(self) -> str:
+        return os.path.join(self.index_dir, STORE_NAME)
+
+    @classmethod
+    def open(cls, directory: str, index_dir: Optional[str] = None) -> Optional['StickerLibrary']:
+        """打开已有的索引，没有索引或格式不匹配时返回 None"""
+        library = cls(directory, index_dir)
+        return library if library.reopen() else None
+
+    def reopen(self) -> bool:
+        with self.lock:
+            self._close()
+            try:
+                index_file = open(self.index_path, 'rb')
+            except OSError:
+                return False
+            try:
+                index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, count, duplicates, strings_offset = HEADER.unpack_from(index, 0)
+            except (OSError, ValueError, struct.error):
+                index_file.close()
+                return False
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                index.close()
+                index_file.close()
+                return False
+            self._index_file, self._index = index_file, index
+            self.count, self.duplicates, self._strings_offset = count, duplicates, strings_offset
+            try:
+                self._store_file = open(self.store_path, 'rb')
+                if os.fstat(self._store_file.fileno()).st_size:
+                    self._store = mmap.mmap(self._store_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._store = None
+            self._by_path = None
+            self._by_tag = None
+            return True
+
+    def _close(self):
+        for handle in (self._index, self._index_file, self._store, self._store_file):
+            if handle is not None:
+                handle.close()
+        self._index_file = self._store_file = None
+        self._index = self._store = None
+        self.count = 0
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> str:
+        return self.path(index)
+
+    def _record(self, index: int) -> tuple:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self._index, HEADER.size + index * RECORD.size)
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._index[start:start + length].decode('utf-8')
+
+    def relative_path(self, index: int) -> str:
+        record = self._record(index)
+        return self._string(record[3], record[4])
+
+    def path(self, index: int) -> str:
+        with self.lock:
+            return os.path.join(self.directory, self.relative_path(index))
+
+    def entry(self, index: int) -> StickerEntry:
+        (hash_, size, mtime, path_offset, path_length, tags_offset, tags_length,
+         width, height, frames, format_code, _, _, _, _, _) = self._record(index)
+        tags = self._string(tags_offset, tags_length)
+        return StickerEntry(index, hash_, os.path.join(self.directory, self._string(path_offset, path_length)),
+                            size, mtime, width, height, frames,
+                            FORMATS[format_code] if format_code < len(FORMATS) else 'unknown',
+                            tags.split(TAG_SEPARATOR) if tags else [])
+
+    def _blob(self, offset: int, length: int) -> bytes:
+        if not length or self._store is None:
+            return b''
+        return self._store[offset:offset + length]
+
+    def thumbnail(self, index: int) -> bytes:
+        record = self._record(index)
+        return self._blob(record[12], record[13])
+
+    def payload(self, path: str) -> Optional[ClipboardPayload]:
+        """某个文件保存的剪贴板数据，没有保存时返回 None（PayloadCache 的数据来源）"""
+        with self.lock:
+            if self._by_path is None:
+                self._by_path = {self.path(i): i for i in range(self.count)}
+            index = self._by_path.get(path)
+            if index is None:
+                return None
+            record = self._record(index)
+            data = self._blob(record[14], record[15])
+            if not data:
+                return None
+            return ClipboardPayload(path, record[11], data, record[2], 0.0)
+
+    def find(self, tag: str) -> List[int]:
+        """带有某个标签的图片序号（第一次查找时建立标签索引）"""
+        with self.lock:
+            if self._by_tag is None:
+                self._by_tag = {}
+                for i in range(self.count):
+                    record = self._record(i)
+                    tags = self._string(record[5], record[6])
+                    for name in tags.split(TAG_SEPARATOR) if tags else []:
+                        self._by_tag.setdefault(name, []).append(i)
+            return list(self._by_tag.get(tag, []))
+
+    def describe(self) -> str:
+        store = self._store.size() if self._store is not None else 0
+        return (f"{self.count} 张（跳过重复 {self.duplicates} 张），"
+                f"索引 {self._index.size() / 1024 if self._index is not None else 0:.0f} KB，"
+                f"数据 {store / 1024 / 1024:.1f} MB")
+
+
+class StickerIndexer:
+    """扫描图片目录并（增量）写入索引
+
+    store_payloads 为 True 时把编码好的剪贴板数据也写入数据文件，粘贴发送时不用再编码。
+    """
+
+    def __init__(self, directory: str, index_dir: Optional[str] = None,
+                 store_payloads: bool = True, payload_mode: str = "auto"):
+        self.directory = os.path.abspath(directory)
+        self.index_dir = index_dir or self.directory
+        self.store_payloads = store_payloads
+        self.payload_mode = payload_mode
+        self.stats = {}
+
+    def _scan(self) -> List[Tuple[str, os.stat_result]]:
+        """目录中的图片文件 [(相对路径, stat), ...]，按路径排序"""
+        files = []
+        pending = [self.directory]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            files.append((os.path.relpath(entry.path, self.directory), entry.stat()))
+            except OSError as e:
+                print(f"无法读取目录 {current}: {e}")
+        files.sort()
+        return files
+
+    def refresh(self, library: Optional[StickerLibrary] = None) -> StickerLibrary:
+        """重新索引目录，返回打开的表情包库
+
+        传入已打开的 library 时复用其中没有变化的记录，写完后让它重新打开新的索引。
+        数据文件只追加新的缩略图和剪贴板数据，复用的数据留在原来的位置；
+        不再使用的数据超过数据文件的一半时才重写整个数据文件。什么都没有变化时两个文件都不写。
+        """
+        start = time.perf_counter()
+        if library is None:
+            library = StickerLibrary.open(self.directory, self.index_dir) or StickerLibrary(self.directory, self.index_dir)
+
+        # 旧索引中的记录：按路径和按哈希（只有不重复的记录有数据）查找
+        old_by_path = {}
+        old_by_hash = {}
+        with library.lock:
+            for i in range(library.count + library.duplicates):
+                record = RECORD.unpack_from(library._index, HEADER.size + i * RECORD.size)
+                relative = library._string(record[3], record[4])
+                old_by_path[relative] = record
+                if i < library.count:
+                    old_by_hash[record[0]] = (relative, record)
+            # 按磁盘上的文件大小计算：没有索引时残留的数据文件全部算作不再使用的数据
+            try:
+                old_store_size = os.path.getsize(library.store_path)
+            except OSError:
+                old_store_size = 0
+
+        stats = {'scanned': 0, 'unchanged': 0, 'hashed': 0, 'reused': 0, 'encoded': 0, 'duplicates': 0,
+                 'store': 'unchanged', 'appended_bytes': 0}
+        strings = bytearray()
+        # 不重复的记录：[记录字段, 缩略图, 剪贴板数据]，数据为旧数据文件中的 (位置, 长度)
+        # 或新数据在追加文件中的 (位置, 长度, True)，写文件时才确定最终位置
+        entries = []
+        duplicate_records = []  # 重复的文件也记下大小和修改时间，下次不用再读取
+        seen_hashes = set()
+
+        def add_string(text: str) -> Tuple[int, int]:
+            encoded = text.encode('utf-8')
+            offset = len(strings)
+            strings.extend(encoded)
+            return offset, len(encoded)
+
+        def add_blob(data: bytes) -> tuple:
+            offset = pending.tell()
+            pending.write(data)
+            stats['appended_bytes'] += len(data)
+            return offset, len(data), True
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        pending_path = os.path.join(self.index_dir, STORE_NAME + '.new')
+        with open(pending_path, 'w+b') as pending:
+            for relative, stat in self._scan():
+                stats['scanned'] += 1
+                full_path = os.path.join(self.directory, relative)
+                old = old_by_path.get(relative)
+                data = None
+                if old and old[1] == stat.st_size and old[2] == stat.st_mtime:
+                    # 大小和修改时间都没变：不读取文件
+                    stats['unchanged'] += 1
+                    hash_ = old[0]
+                else:
+                    try:
+                        with open(full_path, 'rb') as f:
+                            data = f.read()
+                    except OSError as e:
+                        print(f"无法读取 {full_path}: {e}")
+                        continue
+                    stats['hashed'] += 1
+                    hash_ = content_hash(data)
+
+                path_offset, path_length = add_string(relative)
+                if hash_ in seen_hashes:
+                    stats['duplicates'] += 1
+                    duplicate_records.append(RECORD.pack(
+                        hash_, stat.st_size, stat.st_mtime, path_offset, path_length, 0, 0,
+                        0, 0, 0, 0, 0, 0, 0, 0, 0))
+                    continue
+                seen_hashes.add(hash_)
+
+                payload = None
+                same = old_by_hash.get(hash_)
+                if same:
+                    # 内容相同的图片已经索引过（没有变化、改名或只是修改时间变化）：复用尺寸和缩略图；
+                    # 位图剪贴板数据与路径无关，文件剪贴板数据只在路径相同时复用
+                    if data is not None:
+                        stats['reused'] += 1
+                    source_path, record = same
+                    width, height, frames, format_code = record[7], record[8], record[9], record[10]
+                    thumbnail = (record[12], record[13])
+                    if record[15] and (record[11] == CF_DIB or source_path == relative):
+                        payload, payload_format = (record[14], record[15]), record[11]
+                else:
+                    if data is None:
+                        with open(full_path, 'rb') as f:
+                            data = f.read()
+                    format_name, width, height, frames = probe_image(data)
+                    format_code = FORMATS.index(format_name)
+                    thumbnail = add_blob(make_thumbnail(full_path))
+                if payload is None:
+                    payload, payload_format = (0, 0), 0
+                    if self.store_payloads:
+                        encoded = encode_payload(full_path, self.payload_mode)
+                        payload, payload_format = add_blob(encoded.data), encoded.format
+                        stats['encoded'] += 1
+
+                tags_offset, tags_length = add_string(TAG_SEPARATOR.join(path_tags(relative)))
+                entries.append([
+                    [hash_, stat.st_size, stat.st_mtime, path_offset, path_length, tags_offset, tags_length,
+                     min(width, 0xFFFF), min(height, 0xFFFF), min(frames, 0xFFFF), format_code, payload_format],
+                    thumbnail, payload])
+
+            # 旧数据文件中仍然被引用的数据量，其余是已经删除或改变了的图片留下的
+            live = {blob for _, thumbnail, payload in entries for blob in (thumbnail, payload)
+                    if blob[1] and len(blob) == 2}
+            garbage = old_store_size - sum(length for _, length in live)
+            compact = garbage * 2 > old_store_size
+
+            # 新数据追加在原来的数据文件末尾；重写时依次复制仍然被引用的旧数据，新数据接在后面
+            relocated = {}
+            if compact:
+                offset = 0
+                for blob in sorted(live):
+                    relocated[blob] = offset
+                    offset += blob[1]
+                new_base = offset
+            else:
+                new_base = old_store_size
+
+            def place(blob: tuple) -> Tuple[int, int]:
+                if not blob[1]:
+                    return 0, 0
+                if len(blob) == 3:
+                    return new_base + blob[0], blob[1]
+                return (relocated[blob] if compact else blob[0]), blob[1]
+
+            records = []
+            for fields, thumbnail, payload in entries:
+                records.append(RECORD.pack(*fields, *place(thumbnail), *place(payload)))
+
+            # 不重复的记录在前，重复文件的记录在后
+            strings_offset = HEADER.size + (len(records) + len(duplicate_records)) * RECORD.size
+            index_data = b''.join([
+                HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(records), len(duplicate_records), strings_offset),
+                b''.join(records), b''.join(duplicate_records), bytes(strings)])
+
+            with library.lock:
+                unchanged = (not stats['appended_bytes'] and not compact and library._index is not None
+                             and library._index[:] == index_data)
+            if not unchanged:
+                self._write(library, index_data, pending, compact, sorted(live) if compact else [])
+                stats['store'] = 'rewritten' if compact else ('appended' if stats['appended_bytes'] else 'unchanged')
+        os.remove(pending_path)
+
+        stats['elapsed'] = time.perf_counter() - start
+        self.stats = stats
+        return library
+
+    def _write(self, library: StickerLibrary, index_data: bytes, pending, compact: bool, live: List[tuple]):
+        """写入数据文件和索引，让 library 重新打开"""
+        pending.flush()
+        pending.seek(0)
+        index_temp = os.path.join(self.index_dir, INDEX_NAME + '.tmp')
+        with open(index_temp, 'wb') as f:
+            f.write(index_data)
+
+        if compact:
+            store_temp = os.path.join(self.index_dir, STORE_NAME + '.tmp')
+            with open(store_temp, 'wb') as store:
+                with library.lock:
+                    for offset, length in live:
+                        store.write(library._blob(offset, length))
+                shutil.copyfileobj(pending, store)
+
+        # 追加和替换前先关闭旧的 mmap（Windows 上不能替换已映射的文件）；
+        # 追加的数据写完后才替换索引，中途退出时旧索引仍然有效
+        with library.lock:
+            library._close()
+            if compact:
+                os.replace(store_temp, library.store_path)
+            else:
+                with open(library.store_path, 'ab') as store:
+                    shutil.copyfileobj(pending, store)
+            os.replace(index_temp, library.index_path)
+        library.reopen()
+
+    def describe(self) -> str:
+        stats = self.stats
+        if not stats:
+            return "尚未索引"
+        store = {'unchanged': "数据文件未改写",
+                 'appended': f"数据文件追加 {stats['appended_bytes'] / 1024:.0f} KB",
+                 'rewritten': "数据文件已重写"}[stats['store']]
+        return (f"扫描 {stats['scanned']} 个文件，未变化 {stats['unchanged']} 个，读取 {stats['hashed']} 个"
+                f"（按哈希复用 {stats['reused']} 个），编码 {stats['encoded']} 个，"
+                f"重复 {stats['duplicates']} 个，{store}，耗时 {stats['elapsed']:.2f} 秒")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+粘贴发送本地图片
+功能：从本地图片目录选择表情包，把预先编码好的剪贴板数据放到剪贴板，粘贴到输入框后回车发送，
+      不需要打开表情包面板。编码结果按文件缓存在有内存上限的LRU中，重复发送同一张图片不用重新编码
+"""
+
+import io
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Optional, List
+
+# Windows 剪贴板格式
+CF_DIB = 8       # 设备无关位图（BMP 去掉文件头），粘贴后作为图片发送
+CF_HDROP = 15    # 文件列表，粘贴后按文件发送，GIF 保留动画
+
+# 作为表情包发送的图片类型
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+# 保留动画的格式只能以文件方式粘贴
+ANIMATED_EXTENSIONS = ('.gif', '.webp')
+
+# 剪贴板数据缓存的默认内存上限（字节）
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def list_sticker_files(directory: str) -> List[str]:
+    """目录（含子目录）中的图片文件，按路径排序"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths
+
+
+def encode_file_drop(paths: List[str]) -> bytes:
+    """CF_HDROP 数据：DROPFILES 结构 + 以两个空字符结尾的 UTF-16 路径列表"""
+    # DROPFILES: pFiles（路径列表的偏移）、pt.x、pt.y、fNC、fWide
+    header = struct.pack('<IiiII', 20, 0, 0, 0, 1)
+    files = ''.join(os.path.abspath(path) + '\0' for path in paths) + '\0'
+    return header + files.encode('utf-16-le')
+
+
+def encode_dib(path: str) -> Optional[bytes]:
+    """CF_DIB 数据，需要 Pillow；没有安装或图片无法解码时返回 None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as image:
+            output = io.BytesIO()
+            image.convert('RGB').save(output, 'BMP')
+    except (OSError, ValueError) as e:
+        print(f"图片编码失败 {path}: {e}")
+        return None
+    # 去掉14字节的 BMP 文件头就是 DIB
+    return output.getvalue()[14:]
+
+
+class ClipboardPayload:
+    """一张图片编码好的剪贴板数据"""
+    __slots__ = ('path', 'format', 'data', 'mtime', 'encode_time')
+
+    def __init__(self, path: str, format: int, data: bytes, mtime: float, encode_time: float):
+        self.path = path
+        self.format = format
+        self.data = data
+        self.mtime = mtime
+        self.encode_time = encode_time
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+def encode_payload(path: str, mode: str = "auto") -> ClipboardPayload:
+    """把图片编码成剪贴板数据
+
+    mode 为 "image" 时以位图粘贴（需要 Pillow），"file" 时以文件粘贴；
+    "auto" 时动图以文件粘贴，静态图片能编码成位图就用位图，否则退回文件。
+    """
+    start = time.perf_counter()
+    mtime = os.path.getmtime(path)
+    data = None
+    format = CF_HDROP
+    if mode == "image" or (mode == "auto" and not path.lower().endswith(ANIMATED_EXTENSIONS)):
+        data = encode_dib(path)
+        if data is not None:
+            format = CF_DIB
+    if data is None:
+        data = encode_file_drop([path])
+    return ClipboardPayload(path, format, data, mtime, time.perf_counter() - start)
+
+
+class PayloadCache:
+    """剪贴板数据的LRU缓存，所有缓存数据的总大小不超过 max_bytes
+
+    文件修改时间变化时重新编码；单个数据超过上限时不缓存。
+    source 为保存了剪贴板数据的表情包库（StickerLibrary），未命中时先从库中读取，读不到才编码。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES, mode: str = "auto"):
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.source = None
+        self._entries: 'OrderedDict[str, ClipboardPayload]' = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0      # 从表情包库读取的次数
+        self.encode_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str) -> ClipboardPayload:
+        payload = self._entries.get(path)
+        if payload is not None:
+            if self._is_fresh(payload):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return payload
+            self._remove(path)
+
+        self.misses += 1
+        payload = self.source.payload(path) if self.source is not None else None
+        if payload is not None and self._is_fresh(payload):
+            self.loads += 1
+        else:
+            payload = encode_payload(path, self.mode)
+            self.encode_seconds += payload.encode_time
+        if payload.size <= self.max_bytes:
+            self._entries[path] = payload
+            self.bytes += payload.size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return payload
+
+    @staticmethod
+    def _is_fresh(payload: ClipboardPayload) -> bool:
+        try:
+            return os.path.getmtime(payload.path) == payload.mtime
+        except OSError:
+            return False
+
+    def _remove(self, path: str):
+        payload = self._entries.pop(path)
+        self.bytes -= payload.size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe(self) -> str:
+        return (f"缓存 {len(self._entries)} 张，{self.bytes / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:.0f} MB，"
+                f"命中率 {self.hit_rate * 100:.0f}%，从表情包库读取 {self.loads} 次，淘汰 {self.evictions} 次，"
+                f"编码共 {self.encode_seconds * 1000:.0f} ms")
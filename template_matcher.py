@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板匹配
+功能：在截图中查找小图标（例如表情包按钮）。用归一化互相关（NCC）比较模板和截图中同样大小的每个窗口：
+      分子用 FFT 一次算出模板在所有位置的相关，分母（每个窗口的灰度和与平方和）用积分图直接得到，
+      灰度几乎不变的平坦区域直接跳过。多个缩放比例先在缩小的灰度金字塔上粗找，
+      再回到原图只在候选位置附近精确匹配，4K 截图也能在一秒内完成。需要 numpy
+"""
+
+import time
+from typing import Optional, List, Tuple, NamedTuple, Sequence
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+
+class Match(NamedTuple):
+    """匹配结果（截图中的像素坐标）"""
+    left: int
+    top: int
+    width: int
+    height: int
+    score: float    # 归一化互相关，1 表示完全一致
+    scale: float    # 模板的缩放比例
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        return (self.left + self.width // 2, self.top + self.height // 2)
+
+
+def to_gray(frame, bgr: bool = False):
+    """(高, 宽, 3或4) 的 uint8 截图（RGB 或 Windows 截图的 BGRA）换算成 float32 灰度"""
+    frame = np.asarray(frame)
+    if frame.ndim == 2:
+        return frame.astype(np.float32)
+    red, blue = (2, 0) if bgr else (0, 2)
+    gray = np.multiply(frame[..., red], 0.299, dtype=np.float32)
+    gray += np.multiply(frame[..., 1], 0.587, dtype=np.float32)
+    gray += np.multiply(frame[..., blue], 0.114, dtype=np.float32)
+    return gray
+
+
+def downsample(gray):
+    """长和宽各缩小一半（2x2 取平均）"""
+    height, width = gray.shape[0] // 2 * 2, gray.shape[1] // 2 * 2
+    g = gray[:height, :width]
+    return (g[0::2, 0::2] + g[1::2, 0::2] + g[0::2, 1::2] + g[1::2, 1::2]) * np.float32(0.25)
+
+
+def resize(gray, scale: float):
+    """双线性插值缩放（用于模板，模板很小）"""
+    height, width = gray.shape
+    new_height, new_width = max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+    if (new_height, new_width) == (height, width):
+        return gray.astype(np.float32)
+
+    def axis(size, new_size):
+        coords = np.clip((np.arange(new_size) + 0.5) * (size / new_size) - 0.5, 0, size - 1)
+        low = np.floor(coords).astype(np.intp)
+        high = np.minimum(low + 1, size - 1)
+        return low, high, (coords - low).astype(np.float32)
+
+    y0, y1, wy = axis(height, new_height)
+    x0, x1, wx = axis(width, new_width)
+    top = gray[y0][:, x0] * (1 - wx) + gray[y0][:, x1] * wx
+    bottom = gray[y1][:, x0] * (1 - wx) + gray[y1][:, x1] * wx
+    return (top * (1 - wy)[:, None] + bottom * wy[:, None]).astype(np.float32)
+
+
+def _fast_length(n: int) -> int:
+    """不小于 n、只含因子 2、3、5 的长度（FFT 在这样的长度上最快）"""
+    while True:
+        m = n
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return n
+        n += 1
+
+
+class _Level:
+    """金字塔的一层：灰度图、它的频谱和积分图（每层只计算一次，所有模板和缩放比例共用）"""
+
+    def __init__(self, gray):
+        self.gray = gray
+        height, width = gray.shape
+        self.fft_shape = (_fast_length(height), _fast_length(width))
+        self._spectrum = None
+        self._tables = None
+
+    @property
+    def spectrum(self):
+        if self._spectrum is None:
+            self._spectrum = np.fft.rfft2(self.gray, self.fft_shape)
+        return self._spectrum
+
+    @property
+    def tables(self):
+        """灰度和平方的积分图，前面补一行一列 0：窗口和 = 右下 - 右上 - 左下 + 左上"""
+        if self._tables is None:
+            height, width = self.gray.shape
+            data = self.gray.astype(np.float64)
+            sums = np.zeros((height + 1, width + 1))
+            squares = np.zeros((height + 1, width + 1))
+            np.cumsum(np.cumsum(data, axis=0), axis=1, out=sums[1:, 1:])
+            np.cumsum(np.cumsum(data * data, axis=0), axis=1, out=squares[1:, 1:])
+            self._tables = (sums, squares)
+        return self._tables
+
+    def window_sums(self, table, height: int, width: int):
+        return table[height:, width:] - table[:-height, width:] - table[height:, :-width] + table[:-height, :-width]
+
+
+def match_template(level: _Level, template, min_std: float = 2.0):
+    """模板在每个位置的归一化互相关，返回 (高-模板高+1, 宽-模板宽+1) 的分数，模板比图大时返回 None
+
+    标准差小于 min_std 的窗口（纯色背景）分数为 0。
+    """
+    height, width = template.shape
+    image_height, image_width = level.gray.shape
+    if height > image_height or width > image_width:
+        return None
+    count = height * width
+    centered = template.astype(np.float64) - float(template.mean())
+    template_norm = float(np.sqrt((centered * centered).sum()))
+    if template_norm < 1e-6:
+        return None
+
+    # 模板已减去均值，相关 = Σ(窗口 - 窗口均值)·模板；循环相关中不跨边界的部分就是有效位置
+    kernel = np.conj(np.fft.rfft2(centered, level.fft_shape))
+    correlation = np.fft.irfft2(level.spectrum * kernel, level.fft_shape)
+    numerator = correlation[:image_height - height + 1, :image_width - width + 1]
+
+    sum_table, square_table = level.tables
+    sums = level.window_sums(sum_table, height, width)
+    variance = level.window_sums(square_table, height, width) - sums * sums / count  # 窗口方差 × 像素数
+    flat = variance < count * min_std * min_std
+    scores = numerator / (np.sqrt(np.maximum(variance, 1e-6)) * template_norm)
+    scores[flat] = 0.0
+    return scores
+
+
+def _peaks(scores, count: int, radius: int) -> List[Tuple[int, int, float]]:
+    """分数最高的几个位置 (x, y, 分数)，相距 radius 以内的只取最高的一个"""
+    peaks = []
+    for _ in range(count):
+        index = int(np.argmax(scores))
+        y, x = divmod(index, scores.shape[1])
+        score = float(scores[y, x])
+        if score <= 0:
+            break
+        peaks.append((x, y, score))
+        scores[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = 0.0
+    return peaks
+
+
+class ImagePyramid:
+    """截图的灰度金字塔，第 n 层长宽是原图的 1/2^n，按需计算"""
+
+    def __init__(self, gray):
+        self._levels = [_Level(gray)]
+
+    @property
+    def gray(self):
+        return self._levels[0].gray
+
+    def level(self, index: int) -> _Level:
+        while len(self._levels) <= index:
+            self._levels.append(_Level(downsample(self._levels[-1].gray)))
+        return self._levels[index]
+
+
+class TemplateMatcher:
+    """多尺度模板匹配：先在金字塔上层粗找，再在原图候选位置附近精确匹配"""
+
+    def __init__(self, min_size: int = 8, max_levels: int = 4, candidates: int = 3, min_std: float = 2.0):
+        self.min_size = min_size        # 粗找时模板缩小后的最小边长（像素）
+        self.max_levels = max_levels
+        self.candidates = candidates    # 每个缩放比例保留的候选位置数
+        self.min_std = min_std
+        self.last_elapsed = 0.0         # 上一次查找的耗时（秒）
+        self.searches = 0
+
+    def find(self, pyramid: ImagePyramid, template, scales: Sequence[float],
+             threshold: float = 0.6) -> Optional[Match]:
+        """按给定的缩放比例查找模板，最高分低于 threshold 时返回 None"""
+        start = time.perf_counter()
+        self.searches += 1
+        template = np.asarray(template, dtype=np.float32)
+
+        coarse_hits = []  # (粗找分数, 缩放比例, 缩放后的模板, x, y, 层)
+        for scale in scales:
+            scaled = resize(template, scale)
+            coarse, level = scaled, 0
+            while level < self.max_levels and min(coarse.shape) // 2 >= self.min_size:
+                coarse, level = downsample(coarse), level + 1
+            scores = match_template(pyramid.level(level), coarse, self.min_std)
+            if scores is None:
+                continue
+            radius = max(1, min(coarse.shape) // 2)
+            for x, y, score in _peaks(scores, self.candidates, radius):
+                coarse_hits.append((score, scale, scaled, x << level, y << level, level))
+
+        best = None
+        gray = pyramid.gray
+        coarse_hits.sort(key=lambda hit: -hit[0])
+        for _, scale, scaled, x, y, level in coarse_hits[:2 * self.candidates]:
+            # 粗找的位置误差不超过上层的一两个像素，只在附近精确匹配
+            height, width = scaled.shape
+            margin = 2 << level
+            left, top = max(0, x - margin), max(0, y - margin)
+            right = min(gray.shape[1], x + width + margin)
+            bottom = min(gray.shape[0], y + height + margin)
+            scores = match_template(_Level(gray[top:bottom, left:right]), scaled, self.min_std)
+            if scores is None:
+                continue
+            index = int(np.argmax(scores))
+            dy, dx = divmod(index, scores.shape[1])
+            score = float(scores[dy, dx])
+            if best is None or score > best.score:
+                best = Match(left + dx, top + dy, width, height, score, scale)
+
+        self.last_elapsed = time.perf_counter() - start
+        if best is None or best.score < threshold:
+            return None
+        return best
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送队列测试脚本
+用给定的时间检查两种合并策略（一轮消息只回复一次、每分钟最多回复N次），
+再在真实的执行线程上检查同一个聊天的回复合并、不同聊天互不影响和 wait_idle。不需要微信，也不需要Windows
+
+用法：
+    python test_action_queue.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import threading
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from action_queue import ActionQueue, OnePerBurstPolicy, RateLimitPolicy
+from testkit import run_tests
+
+
+def test_one_per_burst():
+    """有待执行的回复时合并；回复完成后 quiet_period 秒内仍算同一轮，各聊天分别计算"""
+    policy = OnePerBurstPolicy(quiet_period=10.0)
+    assert policy.admit("群1", 100.0, False)
+    assert not policy.admit("群1", 100.5, True), "有待执行的回复时没有合并"
+
+    policy.on_executed("群1", 101.0)
+    assert not policy.admit("群1", 105.0, False), "回复后 quiet_period 内的检测没有算作同一轮"
+    assert not policy.admit("群1", 110.9, False)
+    assert policy.admit("群1", 111.0, False)
+    assert policy.admit("群2", 105.0, False), "其他聊天受到影响"
+
+    # quiet_period 为0时回复完成后的下一次检测就是新的一轮
+    immediate = OnePerBurstPolicy()
+    immediate.on_executed("群1", 50.0)
+    assert immediate.admit("群1", 50.0, False)
+    assert not immediate.admit("群1", 50.0, True)
+
+
+def test_rate_limit():
+    """每个聊天60秒内最多回复 max_per_minute 次，最早的回复满60秒后空出名额"""
+    policy = RateLimitPolicy(max_per_minute=2)
+    for now in (0.0, 20.0):
+        assert policy.admit("群1", now, False)
+        policy.on_executed("群1", now)
+    assert not policy.admit("群1", 30.0, False), "超过每分钟次数限制"
+    assert not policy.admit("群1", 59.9, False)
+    assert policy.admit("群2", 30.0, False), "其他聊天的次数被算在一起"
+
+    assert policy.admit("群1", 60.0, False), "60秒前的回复没有过期"
+    policy.on_executed("群1", 60.0)
+    assert not policy.admit("群1", 79.9, False)
+    assert policy.admit("群1", 80.0, False)
+    assert not policy.admit("群1", 80.0, True), "有待执行的回复时没有合并"
+
+
+def test_queue_coalesces_per_chat():
+    """执行线程上：同一个聊天正在发送时新的回复被合并，其他聊天照常排队，完成后 wait_idle 返回"""
+    queue = ActionQueue(OnePerBurstPolicy())
+    started = threading.Event()
+    release = threading.Event()
+    done = []
+
+    def slow_reply():
+        started.set()
+        release.wait(5.0)
+        done.append("群1")
+        return True
+
+    # 合并了后续检测的回复完成时执行线程会打印提示
+    with contextlib.redirect_stdout(io.StringIO()):
+        queue.start()
+        try:
+            assert queue.submit("群1", slow_reply)
+            assert started.wait(5.0)
+            assert queue.has_pending("群1")
+            assert not queue.submit("群1", lambda: done.append("群1 第二次")), "正在发送时没有合并"
+            assert queue.submit("群2", lambda: done.append("群2"))
+            assert not queue.wait_idle("群1", timeout=0.05), "发送还没完成时 wait_idle 返回了"
+
+            release.set()
+            assert queue.wait_idle("群1", timeout=5.0) and queue.wait_idle("群2", timeout=5.0)
+        finally:
+            queue.stop()
+    assert done == ["群1", "群2"], f"执行顺序: {done}"
+    assert queue.executed == 2 and queue.coalesced == 1
+    assert not queue.has_pending("群1")
+
+
+def main():
+    return run_tests("发送队列测试", [
+        ("一轮消息只回复一次", test_one_per_burst),
+        ("每分钟次数限制", test_rate_limit),
+        ("执行线程上按聊天合并", test_queue_coalesces_per_chat),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
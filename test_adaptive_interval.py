@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应检测间隔测试脚本
+用给定的时间检查 AdaptiveInterval：空闲时指数退避到上限、有活动时回到最快间隔、
+到达频率按指数衰减估计，消息密集时退避不超过估计的消息间隔的一半。不需要微信，也不需要Windows
+
+用法：
+    python test_adaptive_interval.py
+"""
+
+import math
+import os
+import sys
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from adaptive_interval import AdaptiveInterval
+from testkit import run_tests
+
+
+def close(a: float, b: float) -> bool:
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_backoff_and_reset_on_activity():
+    """没有活动时按倍数退避到 max_interval，有活动时立即回到 min_interval"""
+    interval = AdaptiveInterval(min_interval=0.5, max_interval=5.0, backoff=2.0)
+    waits = [interval.record(False, now=float(t)) for t in range(6)]
+    assert waits == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0], f"退避: {waits}"
+
+    assert interval.record(True, now=10.0) == 0.5
+    assert interval.last_activity == 10.0 and interval.activity_count == 1
+    # 一条消息的频率很低（约每分钟一条），不限制退避
+    waits = [interval.record(False, now=10.0 + t) for t in range(1, 5)]
+    assert waits == [1.0, 2.0, 4.0, 5.0], f"活动后的退避: {waits}"
+
+
+def test_rate_estimate_decays():
+    """到达频率每次活动加 1/rate_window，之后按 rate_window 指数衰减"""
+    interval = AdaptiveInterval(rate_window=60.0)
+    assert interval.rate(now=0.0) == 0.0
+
+    interval.on_activity(now=0.0)
+    assert close(interval.rate(now=0.0), 1 / 60)
+    assert close(interval.rate(now=60.0), math.exp(-1) / 60)
+    assert close(interval.rate_per_minute(now=0.0), 1.0)
+    # 早于最近一次活动的时间不会让频率变大
+    assert close(interval.rate(now=-5.0), 1 / 60)
+
+    interval.on_activity(now=60.0)
+    assert close(interval.rate(now=60.0), (math.exp(-1) + 1) / 60)
+
+
+def test_backoff_capped_by_rate():
+    """消息密集时退避不超过估计消息间隔的一半，频率衰减后上限随之放宽"""
+    interval = AdaptiveInterval(min_interval=0.5, max_interval=5.0, backoff=3.0, rate_window=60.0)
+    for _ in range(20):
+        interval.on_activity(now=100.0)
+    # 频率 20/60 次/秒，估计的消息间隔为3秒，退避上限1.5秒
+    waits = [interval.record(False, now=100.0) for _ in range(3)]
+    assert waits == [1.5, 1.5, 1.5], f"密集时的退避: {waits}"
+
+    # 过了 rate_window * ln2 秒频率减半，上限变为3秒
+    later = 100.0 + 60.0 * math.log(2)
+    assert close(interval.record(False, now=later), 3.0)
+    # 很久以后频率接近0，退避到 max_interval
+    assert interval.record(False, now=100.0 + 600.0) == 5.0
+
+
+def test_never_below_min_interval():
+    """频率再高也不会低于 min_interval；reset 后回到初始状态"""
+    interval = AdaptiveInterval(min_interval=0.5, max_interval=5.0, backoff=2.0)
+    for _ in range(600):
+        interval.on_activity(now=0.0)
+    assert interval.record(False, now=0.0) == 0.5
+
+    interval.reset()
+    assert interval.interval == 0.5 and interval.last_activity is None and interval.activity_count == 0
+    assert interval.rate(now=0.0) == 0.0
+    assert interval.record(False, now=0.0) == 1.0
+
+
+def main():
+    return run_tests("自适应检测间隔测试", [
+        ("空闲退避和有活动时回到最快", test_backoff_and_reset_on_activity),
+        ("到达频率的衰减", test_rate_estimate_decays),
+        ("消息密集时限制退避", test_backoff_capped_by_rate),
+        ("不低于最快间隔", test_never_below_min_interval),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息解析测试脚本
+在录制的聊天列表（fixture）和模拟的聊天树上检查消息解析、消息标识和新消息检测，不需要微信，也不需要Windows
+
+用法：
+    python test_chat_messages.py
+"""
+
+import datetime
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import SimulatedBackend
+from chat_messages import MessageParser, load_fixture
+from chat_snapshot import SnapshotElement
+from testkit import detect, make_app, run_tests
+
+# 录制的群聊列表（python test_message_detection.py --fixture fixtures/group_chat.json 可以查看）
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'group_chat.json')
+
+# fixture 中每一项的解析结果：(发送者, 类型, 是否自己发送, 文本)
+FIXTURE_RECORDS = [
+    (None, 'time', False, '14:32'),
+    ('张三', 'text', False, '大家好'),
+    ('李四', 'image', False, '[图片]'),
+    ('我', 'text', True, '好的'),
+    ('张三', 'text', False, '好的'),
+    ('张三', 'text', False, '好的'),
+    (None, 'system', False, '张三撤回了一条消息'),
+    (None, 'time', False, '15:01'),
+    ('李四', 'sticker', False, '[动画表情]'),
+    ('我', 'sticker', True, '[动画表情]'),
+    ('王五', 'text', False, '收到'),
+]
+
+
+def moved(item: SnapshotElement, dx: int, dy: int) -> SnapshotElement:
+    """平移后的列表项（模拟滚动聊天记录或移动窗口）"""
+    rect = item.rect
+    return SnapshotElement(item.name, item.control_type, item.automation_id, item.class_name,
+                           (rect[0] + dx, rect[1] + dy, rect[2] + dx, rect[3] + dy) if rect else None,
+                           [moved(child, dx, dy) for child in item.children])
+
+
+def test_fixture_records():
+    """fixture 中每一项的发送者、类型、来源和所在时间段"""
+    items, center_x, timestamp = load_fixture(FIXTURE)
+    records = MessageParser().parse(items, timestamp, center_x)
+
+    parsed = [(record.sender, record.kind, record.own, record.text) for record in records]
+    assert parsed == FIXTURE_RECORDS, f"解析结果: {parsed}"
+    # 连续几条"好的"也各有不同的标识
+    assert len({record.identity for record in records}) == len(records)
+
+    day = datetime.datetime.fromtimestamp(timestamp)
+    assert records[1].timestamp == day.replace(hour=14, minute=32, second=0, microsecond=0).timestamp()
+    assert records[-1].timestamp == day.replace(hour=15, minute=1, second=0, microsecond=0).timestamp()
+
+
+def test_identity_stable_across_scroll():
+    """滚动聊天记录、移动窗口后消息的标识和来源不变"""
+    items, center_x, timestamp = load_fixture(FIXTURE)
+    records = MessageParser().parse(items, timestamp, center_x)
+    height = items[0].rect[3] - items[0].rect[1]
+
+    # 向下滚动：所有消息上移
+    scrolled = MessageParser().parse([moved(item, 0, -3 * height) for item in items], timestamp, center_x)
+    assert [r.identity for r in scrolled] == [r.identity for r in records]
+
+    # 最早的两条滚出列表被回收：第一条不知道前一条消息，之后的标识不变
+    recycled = MessageParser().parse([moved(item, 0, -2 * height) for item in items[2:]], timestamp, center_x)
+    assert [r.identity for r in recycled[1:]] == [r.identity for r in records[3:]]
+
+    # 窗口向右移动：中线随之移动，来源判断不变
+    shifted = MessageParser().parse([moved(item, 150, 0) for item in items], timestamp, center_x + 150)
+    assert [(r.identity, r.own) for r in shifted] == [(r.identity, r.own) for r in records]
+
+
+def test_same_identity_on_both_sides():
+    """对方发的消息和之前自己发的消息标识相同时，不会沿用"自己发送"的判断"""
+    backend = SimulatedBackend()
+    app = make_app(backend)
+
+    detections = []
+    for text, own in [("hi", False), ("ok", True), ("hi", False), ("ok", False)]:
+        backend.tree.add_message(text, own=own)
+        detections.append(detect(app))
+    assert detections == [True, False, True, True], f"检测结果: {detections}"
+
+
+def test_repeated_messages_beyond_window():
+    """连续相同的消息比读取窗口还长时，每一条都能检测到，没有新消息时不误报"""
+    backend = SimulatedBackend()
+    backend.tree.add_message("你好")
+    app = make_app(backend)
+
+    count = app.signature_engine.initial_window + 4
+    detections = []
+    for _ in range(count):
+        backend.tree.add_message("哈哈")
+        detections.append(detect(app))
+    assert detections == [True] * count, f"检测结果: {detections}"
+    assert not detect(app), "没有新消息时误报"
+
+
+def main():
+    return run_tests("消息解析测试", [
+        ("解析录制的群聊列表", test_fixture_records),
+        ("滚动和移动窗口后标识不变", test_identity_stable_across_scroll),
+        ("两侧标识相同的消息", test_same_identity_on_both_sides),
+        ("连续相同的消息超过读取窗口", test_repeated_messages_beyond_window),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包选择测试脚本
+用固定种子的 random.Random 检查别名表和选择引擎：抽样频率符合权重，权重为0的表情包不会被选中，
+保存再加载后每个聊天的不重复窗口仍然有效。不需要微信，也不需要Windows
+
+用法：
+    python test_emoji_selector.py
+"""
+
+import json
+import os
+import random
+import sys
+from collections import Counter
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from emoji_selector import AliasTable, EmojiSelector, RecentWindow
+from testkit import run_tests
+
+SAMPLES = 100000
+
+
+def assert_frequencies(counts: Counter, weights, samples: int, tolerance: float = 0.01):
+    total = sum(weights)
+    for index, weight in enumerate(weights):
+        share = counts[index] / samples
+        assert abs(share - weight / total) < tolerance, f"第 {index} 个: 频率 {share:.3f}，权重占比 {weight / total:.3f}"
+
+
+def test_alias_table_distribution():
+    """别名表的抽样频率符合权重，权重为0的从不抽中"""
+    weights = [1, 2, 3, 0, 4, 0.5]
+    table = AliasTable(weights)
+    rng = random.Random(1)
+    counts = Counter(table.sample(rng) for _ in range(SAMPLES))
+    assert counts[3] == 0, "权重为0的表情包被抽中"
+    assert_frequencies(counts, weights, SAMPLES)
+
+
+def test_recent_window():
+    """环形缓冲区只保留最近 size 条，重复的序号按次数计算"""
+    recent = RecentWindow(3)
+    for index in [5, 7, 5, 9]:
+        recent.push(index)
+    assert recent.items() == [7, 5, 9]
+    assert 5 in recent and 7 in recent and 9 in recent
+    recent.push(1)
+    assert recent.items() == [5, 9, 1] and 7 not in recent
+    recent.push(2)
+    assert 5 not in recent and len(recent) == 3
+
+    empty = RecentWindow(0)
+    empty.push(1)
+    assert 1 not in empty and empty.items() == []
+
+
+def test_selector_follows_weights():
+    """选择引擎按权重选择（不重复窗口为0时），权重为0的表情包不会被选中"""
+    weights = [0, 0, 5, 1, 1, 2]
+    selector = EmojiSelector(len(weights), dict(enumerate(weights)), no_repeat=0, rng=random.Random(2))
+    counts = Counter(selector.choose("群") for _ in range(SAMPLES))
+    assert counts[0] == 0 and counts[1] == 0, f"权重为0的表情包被选中: {counts}"
+    assert_frequencies(counts, weights, SAMPLES)
+
+
+def test_zero_weight_with_no_repeat():
+    """不重复窗口排除了所有权重不为0的表情包时，宁可重复也不选权重为0的"""
+    selector = EmojiSelector(5, {0: 0, 1: 0, 2: 0}, no_repeat=3, rng=random.Random(3))
+    chosen = [selector.choose("群") for _ in range(200)]
+    assert set(chosen) == {3, 4}, f"选中了 {set(chosen)}"
+
+    picked = {selector.choose_from("群", [0, 1, 4]) for _ in range(50)}
+    assert picked == {4}, f"指定范围内选中了 {picked}"
+
+
+def test_no_repeat_across_save_and_load():
+    """保存再加载后，加载之前最近发过的表情包仍然不会马上再选"""
+    no_repeat = 3
+    selector = EmojiSelector(8, {0: 10, 1: 10}, no_repeat=no_repeat, rng=random.Random(4))
+    sent = {"群1": [], "群2": []}
+    for _ in range(20):
+        for chat in sent:
+            sent[chat].append(selector.choose(chat))
+
+    # 经过 JSON 保存和读取，用另一个种子继续选择
+    data = json.loads(json.dumps(selector.to_dict()))
+    restored = EmojiSelector(8, no_repeat=no_repeat, rng=random.Random(5))
+    assert restored.load_dict(data)
+    assert restored.weights == {0: 10, 1: 10}
+    for chat in sent:
+        assert restored.history(chat).items() == sent[chat][-no_repeat:]
+
+    for _ in range(200):
+        for chat in sent:
+            index = restored.choose(chat)
+            assert index not in sent[chat][-no_repeat:], f"{chat} 重复选了最近发过的 {index}"
+            sent[chat].append(index)
+
+    # 加载时不重复窗口变小，只保留最近的记录
+    smaller = EmojiSelector(8, no_repeat=1, rng=random.Random(6))
+    smaller.load_dict(restored.to_dict())
+    assert smaller.history("群1").items() == sent["群1"][-1:]
+
+
+def main():
+    return run_tests("表情包选择测试", [
+        ("别名表按权重抽样", test_alias_table_distribution),
+        ("最近记录的环形缓冲区", test_recent_window),
+        ("选择引擎按权重选择", test_selector_follows_weights),
+        ("不重复窗口和权重为0", test_zero_weight_with_no_repeat),
+        ("保存加载后不重复窗口仍然有效", test_no_repeat_across_save_and_load),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
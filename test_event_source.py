@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件驱动检测测试脚本
+在模拟的聊天树和模拟后端上验证：结构变化通知能立即唤醒等待的检测；通知被丢弃或完全收不到时，
+兜底轮询仍然能发现新消息。不需要微信，也不需要Windows
+
+用法：
+    python test_event_source.py
+"""
+
+import sys
+import os
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import SimulatedBackend
+from simulated_uia import (FakeChatTree, FakeTreeEventSource, FakeUIAutomation, play_script,
+                           TreeScope_Children, UIA_ControlTypePropertyId, UIA_ListItemControlTypeId)
+from testkit import detect, make_app, run_tests
+
+FALLBACK_INTERVAL = 0.5  # 兜底轮询间隔（秒）
+WAIT_INTERVAL = 3.0      # 没有通知时的检测间隔（秒），远大于事件唤醒需要的时间
+
+
+def count_messages(tree: FakeChatTree) -> int:
+    """像轮询那样查询聊天列表中的消息数量"""
+    uia = FakeUIAutomation(tree.root)
+    condition = uia.CreatePropertyCondition(UIA_ControlTypePropertyId, UIA_ListItemControlTypeId)
+    return tree.chat_list.FindAll(TreeScope_Children, condition).Length
+
+
+def test_event_wakes_waiter():
+    """新消息的 ChildAdded 通知立即唤醒等待，不用等到兜底轮询"""
+    tree = FakeChatTree()
+    source = FakeTreeEventSource()
+    assert source.start(tree.chat_list)
+
+    script = play_script([(0.1, lambda: tree.add_message("你好"))])
+    start = time.perf_counter()
+    changes = source.wait_for_change(FALLBACK_INTERVAL)
+    waited = time.perf_counter() - start
+    script.join()
+    assert len(changes) == 1, f"收到 {len(changes)} 个通知"
+    assert waited < FALLBACK_INTERVAL, f"等了 {waited:.2f} 秒，不是被通知唤醒的"
+
+
+def test_dropped_events_still_wake():
+    """通知队列已满时多余的通知被丢弃，已经入队的通知仍然唤醒一次，轮询读到这一批消息"""
+    tree = FakeChatTree()
+    source = FakeTreeEventSource(max_pending=1)
+    source.start(tree.chat_list)
+
+    messages = ["在吗", "有空吗", "看消息", "人呢"]
+    play_script([(0, lambda text=text: tree.add_message(text)) for text in messages], speed=0).join()
+    assert source.dropped_events == len(messages) - 1
+
+    assert source.wait_for_change(FALLBACK_INTERVAL), "通知被丢弃后没有唤醒"
+    assert count_messages(tree) == len(messages)
+    assert not source.wait_for_change(0.05), "同一批消息唤醒了两次"
+
+
+def test_polling_without_events():
+    """完全收不到通知时（例如订阅失效），等待在兜底间隔后超时，轮询发现新消息"""
+    tree = FakeChatTree()
+    source = FakeTreeEventSource()
+    source.start(tree.chat_list)
+    tree.chat_list.remove_listener(source.notify)
+    before = count_messages(tree)
+
+    script = play_script([(0.1, lambda: tree.add_message("收到请回复"))])
+    start = time.perf_counter()
+    changes = source.wait_for_change(FALLBACK_INTERVAL)
+    waited = time.perf_counter() - start
+    script.join()
+    assert not changes
+    assert waited >= FALLBACK_INTERVAL * 0.9, f"等了 {waited:.2f} 秒"
+    assert count_messages(tree) == before + 1, "兜底轮询没有发现新消息"
+
+
+def test_stop_wakes_waiter():
+    """停止订阅时立即唤醒正在等待的线程"""
+    tree = FakeChatTree()
+    source = FakeTreeEventSource()
+    source.start(tree.chat_list)
+
+    play_script([(0.1, source.stop)])
+    start = time.perf_counter()
+    assert not source.wait_for_change(FALLBACK_INTERVAL * 4)
+    assert time.perf_counter() - start < FALLBACK_INTERVAL
+    assert not source.is_active
+
+
+def make_event_app(backend, event_source=None):
+    """在模拟后端上创建一个订阅了结构变化通知的检测实例"""
+    def configure(app):
+        app.event_source = event_source
+        app.event_fallback_interval = FALLBACK_INTERVAL
+        app.check_interval = app.max_check_interval = WAIT_INTERVAL
+        app.pacer = app.make_pacer()
+        app.setup_event_source()
+
+    app = make_app(backend, configure)
+    app.is_monitoring = True
+    return app
+
+
+def wait_and_detect(app):
+    """等待下一次检测时机并检测一次，返回 (等待的秒数, 是否检测到新消息)"""
+    app.last_check_time = time.time()
+    start = time.perf_counter()
+    app.wait_for_next_check()
+    waited = time.perf_counter() - start
+    return waited, detect(app)
+
+
+def test_event_wakes_detection():
+    """新消息的 ChildAdded 通知立即唤醒检测，不用等到兜底轮询"""
+    backend = SimulatedBackend(time_scale=0)
+    app = make_event_app(backend)
+    assert app.event_source is not None and app.event_source.is_active
+
+    script = play_script([(0.1, lambda: backend.tree.add_message("你好"))])
+    waited, detected = wait_and_detect(app)
+    script.join()
+    assert detected, "事件唤醒后没有检测到新消息"
+    assert waited < FALLBACK_INTERVAL, f"等了 {waited:.2f} 秒，不是被通知唤醒的"
+
+
+def test_detection_after_dropped_events():
+    """通知队列已满时多余的通知被丢弃，一次唤醒仍然能检测到这一批消息"""
+    backend = SimulatedBackend(time_scale=0)
+    app = make_event_app(backend, FakeTreeEventSource(max_pending=1))
+
+    messages = ["在吗", "有空吗", "看消息", "人呢"]
+    play_script([(0, lambda text=text: backend.tree.add_message(text)) for text in messages], speed=0).join()
+    assert app.event_source.dropped_events == len(messages) - 1
+
+    waited, detected = wait_and_detect(app)
+    assert detected, "通知被丢弃后没有检测到新消息"
+    assert waited < FALLBACK_INTERVAL
+    assert app.last_message_text == messages[-1]
+
+
+def test_detection_without_events():
+    """完全收不到通知时（例如订阅失效），兜底轮询在 event_fallback_interval 内发现新消息"""
+    backend = SimulatedBackend(time_scale=0)
+    app = make_event_app(backend)
+    source = app.event_source
+    backend.tree.chat_list.remove_listener(source.notify)
+
+    script = play_script([(0.1, lambda: backend.tree.add_message("收到请回复"))])
+    waited, detected = wait_and_detect(app)
+    script.join()
+    assert detected, "兜底轮询没有检测到新消息"
+    assert FALLBACK_INTERVAL * 0.9 <= waited < WAIT_INTERVAL, f"等了 {waited:.2f} 秒"
+    assert source.is_active
+
+
+def main():
+    return run_tests("事件驱动检测测试", [
+        ("通知唤醒等待", test_event_wakes_waiter),
+        ("通知被丢弃时仍能唤醒", test_dropped_events_still_wake),
+        ("收不到通知时兜底轮询", test_polling_without_events),
+        ("停止订阅唤醒等待", test_stop_wakes_waiter),
+        ("通知唤醒检测", test_event_wakes_detection),
+        ("通知被丢弃时仍能检测", test_detection_after_dropped_events),
+        ("收不到通知时兜底检测", test_detection_without_events),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,17 +3,64 @@
 """
 微信消息检测测试脚本
 专门用于测试新的消息检测机制
+
+用法：
+    python test_message_detection.py                      # 实时监控消息检测
+    python test_message_detection.py --record chat.json   # 把当前聊天列表保存为 fixture
+    python test_message_detection.py --fixture chat.json  # 离线解析保存的聊天列表
 """
 
+import argparse
 import sys
 import os
 
 # 添加项目根目录到路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from chat_messages import MessageParser, save_fixture, load_fixture
+from chat_snapshot import ChatSnapshotBuilder
 from wechat_auto_emoji import WeChatAutoEmoji
 
+
+def print_records(records):
+    for record in records:
+        who = "自己" if record.own else (record.sender or "对方")
+        print(f"  {record.identity}  {record.kind:<8} {who}: {record.text}")
+
+
+def record_fixture(bot: WeChatAutoEmoji, path: str) -> bool:
+    """读取当前聊天列表的完整快照并保存为 fixture"""
+    if not bot.find_wechat_window():
+        return False
+    if not bot.find_chat_area(bot.get_wechat_automation_element()):
+        print("无法找到聊天区域")
+        return False
+    snapshot = ChatSnapshotBuilder(bot.uia, bot.uia_module).build(bot.chat_area_element)
+    center_x = bot.wechat_window.left + bot.wechat_window.width // 2
+    save_fixture(path, snapshot.items, center_x, snapshot.timestamp)
+    print(f"已保存 {snapshot.count} 条聊天列表项到 {path}")
+    print_records(MessageParser().parse(snapshot.items, snapshot.timestamp, center_x))
+    return True
+
+
+def parse_fixture(path: str):
+    """离线解析 fixture 中的聊天列表"""
+    items, center_x, timestamp = load_fixture(path)
+    records = MessageParser().parse(items, timestamp, center_x)
+    print(f"{path}: {len(items)} 条聊天列表项")
+    print_records(records)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="微信消息检测测试工具")
+    parser.add_argument('--record', metavar='PATH', help="把当前聊天列表保存为 fixture")
+    parser.add_argument('--fixture', metavar='PATH', help="离线解析保存的聊天列表")
+    args = parser.parse_args()
+
+    if args.fixture:
+        parse_fixture(args.fixture)
+        return
+
     print("=== 微信消息检测测试工具 ===")
     print("此工具用于测试改进后的消息检测机制")
     print("使用前请确保：")
@@ -25,6 +72,9 @@ def main():
     bot = WeChatAutoEmoji()
     
     try:
+        if args.record:
+            record_fixture(bot, args.record)
+            return
         # 直接运行测试
         bot.test_message_detection()
     except KeyboardInterrupt:
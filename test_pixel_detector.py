@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+像素变化检测测试脚本
+用合成的聊天区域截图（numpy 数组）检查 PixelChangeDetector：底部出现对方的新气泡时检测到，
+光标闪烁、居中的时间分隔行和忽略区域内的变化不算。需要 numpy，不需要微信和截图库
+
+用法：
+    python test_pixel_detector.py
+"""
+
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pixel_detector import PixelChangeDetector, HAS_NUMPY
+from testkit import run_tests
+
+if HAS_NUMPY:
+    import numpy as np
+elif __name__ != "__main__":
+    # 交给 pytest 运行时整个文件跳过（直接运行时由 main 提示）
+    import pytest
+    pytest.skip("像素变化检测需要 numpy", allow_module_level=True)
+
+WIDTH, HEIGHT = 500, 480
+BACKGROUND = 245      # 聊天区域背景（浅灰）
+BUBBLE = 255          # 气泡（白色）
+TEXT = 40             # 气泡中的文字
+ROW_HEIGHT = 60       # 每条消息占的高度
+BUBBLE_HEIGHT = 40
+
+
+def draw_bubble(frame, top: int, side: str, length: int):
+    """在 top 处画一个气泡（超出截图的部分裁掉）：对方的在左侧，自己的在右侧，length 为文字长度（像素）"""
+    left, right = (20, 40 + length) if side == 'left' else (460 - length, 480)
+    frame[max(0, top):max(0, top + BUBBLE_HEIGHT), left:right] = BUBBLE
+    for line in range(top + 10, top + BUBBLE_HEIGHT - 10, 10):
+        frame[max(0, line):max(0, line + 4), left + 10:right - 10] = TEXT
+
+
+def chat_frame(sides, offset: int = 0):
+    """按顺序排列的气泡（'left'/'right'），offset 为向上滚动的像素"""
+    frame = np.full((HEIGHT, WIDTH, 3), BACKGROUND, dtype=np.uint8)
+    for index, side in enumerate(sides):
+        # 每条消息的长度不同，和真实的聊天记录一样每行像素之和各不相同
+        draw_bubble(frame, 10 + index * ROW_HEIGHT - offset, side, 60 + index * 37 % 100)
+    return frame
+
+
+def test_new_bubble_detected():
+    """底部出现对方的新气泡时检测到，自己的气泡不算"""
+    detector = PixelChangeDetector()
+    history = ['left', 'right', 'left']
+    assert not detector.feed(chat_frame(history)), "第一帧只作为基线"
+    assert not detector.feed(chat_frame(history)), "没有变化时误报"
+
+    history.append('left')
+    assert detector.feed(chat_frame(history)), "没有检测到对方的新气泡"
+    assert detector.detections == 1
+
+    history.append('right')
+    assert not detector.feed(chat_frame(history)), "自己的气泡被当作新消息"
+    assert detector.last_own
+
+
+def test_new_bubble_after_scroll():
+    """聊天区域已满时新消息把聊天记录顶上去，仍然检测到"""
+    detector = PixelChangeDetector()
+    history = ['left', 'right'] * 5
+    offset = 10 + len(history) * ROW_HEIGHT - HEIGHT
+    detector.feed(chat_frame(history, offset))
+
+    history.append('left')
+    assert detector.feed(chat_frame(history, offset + ROW_HEIGHT)), "滚动后没有检测到新气泡"
+    assert detector.last_shift == ROW_HEIGHT // detector.scale
+
+
+def test_cursor_blink_ignored():
+    """输入光标和鼠标指针这样的小范围变化不算新消息"""
+    detector = PixelChangeDetector()
+    history = ['left', 'right', 'left']
+    frame = chat_frame(history)
+    detector.feed(frame)
+    bottom = 10 + len(history) * ROW_HEIGHT
+    for _ in range(3):
+        blink = frame.copy()
+        blink[bottom:bottom + 16, 40:42] = 0
+        assert not detector.feed(blink), "光标出现时误报"
+        assert not detector.feed(frame), "光标消失时误报"
+
+
+def test_timestamp_ignored():
+    """底部居中出现时间分隔行不算新消息"""
+    detector = PixelChangeDetector()
+    history = ['left', 'right']
+    frame = chat_frame(history)
+    detector.feed(frame)
+    stamped = frame.copy()
+    top = 10 + len(history) * ROW_HEIGHT
+    stamped[top:top + 14, WIDTH // 2 - 30:WIDTH // 2 + 30] = 200
+    stamped[top + 4:top + 10, WIDTH // 2 - 20:WIDTH // 2 + 20] = 120
+    assert not detector.feed(stamped), "时间分隔行被当作新消息"
+    assert detector.last_changed == 0
+
+
+def test_ignored_region():
+    """忽略区域内的变化不算，同样的变化在忽略区域外会被检测到"""
+    history = ['left', 'right']
+    frame = chat_frame(history)
+    top = 10 + len(history) * ROW_HEIGHT
+    badge = frame.copy()
+    badge[top:top + 30, 20:120] = 90
+
+    ignoring = PixelChangeDetector()
+    ignoring.ignore(0, top - 10, 140, top + 40)
+    ignoring.feed(frame)
+    assert not ignoring.feed(badge), "忽略区域内的变化被当作新消息"
+
+    plain = PixelChangeDetector()
+    plain.feed(frame)
+    assert plain.feed(badge), "没有忽略区域时应该检测到同样的变化"
+
+
+def main():
+    if not HAS_NUMPY:
+        print("⚠ 未安装 numpy，跳过像素变化检测测试")
+        return 0
+    return run_tests("像素变化检测测试", [
+        ("底部出现新气泡", test_new_bubble_detected),
+        ("滚动后出现新气泡", test_new_bubble_after_scroll),
+        ("光标闪烁", test_cursor_blink_ignored),
+        ("时间分隔行", test_timestamp_ignored),
+        ("忽略区域", test_ignored_region),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复规则测试脚本
+检查关键词自动机、规则的优先级和各种条件（发送者、聊天、正则）、每分钟次数限制
+以及规则文件修改后的重新加载。不需要微信，也不需要Windows
+
+用法：
+    python test_reply_rules.py
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from reply_rules import KeywordAutomaton, RuleEngine
+from testkit import run_tests
+
+
+def make_engine(rules, default=None) -> RuleEngine:
+    """不读规则文件、直接使用给定规则的引擎"""
+    engine = RuleEngine(path=None)
+    engine.compiled = engine.load_dict({'version': 1, 'default': default or {}, 'rules': rules})
+    return engine
+
+
+def matched(engine: RuleEngine, text: str, sender=None, chat=None):
+    """命中的规则名称，没有命中时为 None"""
+    rule = engine.compiled.match(text, sender, chat)
+    return rule.name if rule else None
+
+
+def test_overlapping_keywords():
+    """互相重叠、互为后缀的关键词一遍扫描全部命中，不区分英文大小写"""
+    automaton = KeywordAutomaton([("he", 1), ("she", 2), ("his", 4), ("hers", 8)])
+    assert automaton.scan("ushers") == 1 | 2 | 8
+    assert automaton.scan("SHE") == 1 | 2
+    assert automaton.scan("this") == 4
+    assert automaton.scan("ahishers") == 1 | 2 | 4 | 8
+    assert automaton.scan("") == 0
+    assert automaton.scan("hhh") == 0
+
+    # 同一个关键词属于多条规则
+    shared = KeywordAutomaton([("晚安", 1), ("晚安", 2), ("安", 4)])
+    assert shared.scan("大家晚安") == 1 | 2 | 4
+
+
+def test_priority_order():
+    """几条规则都满足时取优先级最高的，优先级相同时取文件中靠前的"""
+    engine = make_engine([
+        {"name": "好", "keywords": ["好"]},
+        {"name": "好的", "keywords": ["好的"], "priority": 5},
+        {"name": "兜底"},
+        {"name": "也是好", "keywords": ["好"]},
+    ])
+    assert matched(engine, "好的") == "好的"
+    assert matched(engine, "好呀") == "好"
+    assert matched(engine, "在吗") == "兜底"
+
+
+def test_sender_and_chat_masks():
+    """发送者和聊天条件：没有这种条件的规则总是满足它"""
+    engine = make_engine([
+        {"name": "老板", "senders": ["老板"], "reply": False, "priority": 10},
+        {"name": "工作群收到", "chats": ["工作群"], "keywords": ["收到"], "reply": False},
+        {"name": "收到", "keywords": ["收到"], "stickers": [3]},
+    ])
+    assert matched(engine, "收到", sender="老板", chat="家人") == "老板"
+    assert matched(engine, "收到", sender="同事", chat="工作群") == "工作群收到"
+    assert matched(engine, "收到", sender="同事", chat="家人") == "收到"
+    assert matched(engine, "收到") == "收到"
+    assert matched(engine, "你好", sender="同事") is None
+
+    decision = engine.decide("收到", sender="同事", chat="家人")
+    assert decision.reply and decision.stickers == [3]
+    assert not engine.decide("好的", sender="老板").reply
+
+
+def test_regex_prefilter():
+    """所有正则合成的预筛选匹配不上时跳过正则规则，匹配上时仍由每条规则自己的正则决定"""
+    engine = make_engine([
+        {"name": "大笑", "regex": "哈{3,}", "priority": 1},
+        {"name": "数字", "regex": r"\d{4}", "priority": 1},
+        {"name": "哈", "keywords": ["哈"]},
+    ])
+    assert engine.compiled.regex_filter is not None
+    assert matched(engine, "哈哈哈哈") == "大笑"
+    assert matched(engine, "哈哈") == "哈"
+    assert matched(engine, "验证码 2048") == "数字"
+    assert matched(engine, "哈 12") == "哈"
+
+    # 引用分组的正则合在一起后分组编号会变，不能用来预筛选
+    backref = make_engine([
+        {"name": "叠字a", "regex": r"(a)\1"},
+        {"name": "叠字", "regex": r"(\w)\1"},
+    ])
+    assert matched(backref, "aa") == "叠字a"
+    assert matched(backref, "好好") == "叠字", "预筛选漏掉了引用分组的正则"
+    # 同一条规则的几个正则也一样
+    same_rule = make_engine([{"name": "叠字", "regex": [r"(a)\1", r"(b)\1"]}])
+    assert matched(same_rule, "bb") == "叠字"
+    assert matched(same_rule, "ab") is None
+
+
+def test_max_per_minute():
+    """每分钟次数限制按规则和聊天分别计算，用传入的时间判断"""
+    engine = make_engine([{"name": "晚安", "keywords": ["晚安"], "max_per_minute": 2}])
+    replies = [engine.decide("晚安", chat="群1", now=now).reply for now in (0.0, 10.0, 20.0, 59.9)]
+    assert replies == [True, True, False, False], f"回复: {replies}"
+    assert engine.decide("晚安", chat="群2", now=20.0).reply, "其他聊天的次数被算在一起"
+    assert engine.decide("晚安", chat="群1", now=60.0).reply, "一分钟前的回复没有过期"
+    assert not engine.decide("晚安", chat="群1", now=65.0).reply
+    assert engine.compiled.rules[0].matches == 7
+
+
+def test_reload_after_modification():
+    """规则文件修改后重新加载；文件有错误时保留原来的规则；文件删除后按默认规则回复"""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'reply_rules.json')
+
+        def write(content, mtime):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+            os.utime(path, (mtime, mtime))
+
+        write({"rules": [{"name": "不回晚安", "keywords": ["晚安"], "reply": False}]}, 1000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine = RuleEngine(path, reload_interval=0)
+            assert not engine.decide("晚安").reply
+            assert engine.loads == 1
+
+            # 没有修改时不重新加载
+            assert not engine.maybe_reload()
+
+            write({"rules": [{"name": "回晚安", "keywords": ["晚安"], "stickers": [7]}]}, 1010)
+            decision = engine.decide("晚安")
+            assert decision.reply and decision.rule.name == "回晚安"
+            assert engine.loads == 2
+
+            write("{不是JSON", 1020)
+            assert engine.decide("晚安").rule.name == "回晚安", "规则文件有错误时丢掉了原来的规则"
+
+            write({"version": 2, "rules": []}, 1030)
+            assert engine.decide("晚安").rule.name == "回晚安"
+
+            os.remove(path)
+            decision = engine.decide("晚安")
+            assert decision.reply and decision.rule is None
+
+
+def main():
+    return run_tests("回复规则测试", [
+        ("重叠的关键词", test_overlapping_keywords),
+        ("规则优先级", test_priority_order),
+        ("发送者和聊天条件", test_sender_and_chat_masks),
+        ("正则预筛选", test_regex_prefilter),
+        ("每分钟次数限制", test_max_per_minute),
+        ("修改规则文件后重新加载", test_reload_after_modification),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快照轨迹测试脚本
+在模拟后端上监控时录制快照轨迹，再用 replay_trace 回放，检查回放时检测到的新消息和录制时一致。
+不需要微信，也不需要Windows
+
+用法：
+    python test_snapshot_trace.py
+"""
+
+import contextlib
+import io
+import sys
+import os
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import SimulatedBackend
+from replay_trace import replay
+from snapshot_trace import read_trace
+from testkit import detect, make_app, run_tests
+
+# 录制时两次检测之间的间隔（秒）：回放使用录制时的时间，间隔太短会进入二次验证
+TICK_INTERVAL = 0.25
+
+
+def record(app, path: str, ticks):
+    """开始录制，按 ticks 中每一项（None 或新消息文本）检测一次，然后停止录制"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.toggle_trace_recording(path)
+    for text in ticks:
+        time.sleep(TICK_INTERVAL)
+        if text is not None:
+            app.backend.tree.add_message(text)
+        detect(app)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.toggle_trace_recording()
+
+
+def test_replay_recording_started_mid_session():
+    """监控中途开始录制时，录制后收到的第一条消息回放时也能检测到"""
+    app = make_app(SimulatedBackend())
+    for text in ["早", "吃了吗"]:
+        app.backend.tree.add_message(text)
+        detect(app)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'trace.wxtrace')
+        ticks = [f"msg{i}" if i % 3 == 0 else None for i in range(9)]
+        record(app, path, ticks)
+        assert sum(frame.baseline for frame in read_trace(path)) == 1, "没有写入基线帧"
+        result = replay(path)
+
+    expected = [text for text in ticks if text is not None]
+    assert result['recorded_detections'] == len(expected), f"录制时检测到 {result['recorded_detections']} 条"
+    assert result['consistent'], f"回放不一致：缺少 {result['missing']}，多出 {result['extra']}"
+
+
+def test_replay_recording_restarted():
+    """同一个文件录制两段（中间停止录制时仍有新消息）时，每段都以开始录制时的状态为基线"""
+    app = make_app(SimulatedBackend())
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'trace.wxtrace')
+        record(app, path, ["第一段", None, "第一段结束"])
+        for text in ["没有录制", "也没有录制"]:
+            app.backend.tree.add_message(text)
+            detect(app)
+        record(app, path, ["第二段", None, "第二段结束"])
+        result = replay(path)
+
+    assert result["recorded_detections"] == 4, f"录制时检测到 {result['recorded_detections']} 条"
+    assert result['consistent'], f"回放不一致：缺少 {result['missing']}，多出 {result['extra']}"
+
+
+def main():
+    return run_tests("快照轨迹测试", [
+        ("监控中途开始录制", test_replay_recording_started_mid_session),
+        ("同一个文件录制两段", test_replay_recording_restarted),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表情包库索引测试脚本
+在临时目录中写入合成的 PNG 文件，检查增量更新：没有变化的文件不重新读取、没有变化时索引和数据文件都不改写、
+改名的文件按内容哈希复用、重复的文件只索引一次、新文件的数据追加在数据文件末尾，以及按标签查找。
+不需要微信，也不需要Windows和Pillow
+
+用法：
+    python test_sticker_library.py
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sticker_library import StickerIndexer, StickerLibrary
+from testkit import run_tests
+
+# 固定的修改时间：每次改动文件后都设回这个时间，确保检测变化靠的是大小和内容而不是时间精度
+FIXED_MTIME = 1700000000
+
+
+def png_bytes(width: int, height: int, seed: int) -> bytes:
+    """只有文件头和 IHDR 块的 PNG（seed 放在一个私有块中，让内容各不相同）"""
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'teSt', struct.pack('>I', seed)) + chunk(b'IEND', b'')
+
+
+def write_png(folder: str, relative: str, width: int, height: int, seed: int):
+    path = os.path.join(folder, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(png_bytes(width, height, seed))
+    os.utime(path, (FIXED_MTIME, FIXED_MTIME))
+
+
+def file_state(path: str):
+    """(修改时间, 内容)，用来确认文件没有被改写"""
+    with open(path, 'rb') as f:
+        return os.stat(path).st_mtime_ns, f.read()
+
+
+def refresh(indexer: StickerIndexer, library=None) -> StickerLibrary:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return indexer.refresh(library)
+
+
+def make_library(folder: str):
+    """三张不同的图片，建立第一次索引"""
+    write_png(folder, '猫/开心_01.png', 120, 80, 1)
+    write_png(folder, '猫/生气.png', 64, 64, 2)
+    write_png(folder, '狗/晚安.png', 200, 150, 3)
+    indexer = StickerIndexer(folder)
+    library = refresh(indexer)
+    assert len(library) == 3 and indexer.stats['hashed'] == 3
+    return indexer, library
+
+
+def test_unchanged_refresh_writes_nothing():
+    """没有变化时不读取图片文件，索引和数据文件都不改写"""
+    with tempfile.TemporaryDirectory() as folder:
+        indexer, library = make_library(folder)
+        index_before = file_state(library.index_path)
+        store_before = file_state(library.store_path)
+        assert store_before[1], "没有写入剪贴板数据"
+
+        library = refresh(indexer, library)
+        stats = indexer.stats
+        assert stats['unchanged'] == 3 and stats['hashed'] == 0, f"统计: {stats}"
+        assert stats['store'] == 'unchanged' and stats['appended_bytes'] == 0
+        assert file_state(library.index_path) == index_before, "没有变化时改写了索引"
+        assert file_state(library.store_path) == store_before, "没有变化时改写了数据文件"
+        assert len(library) == 3
+        library.close()
+
+
+def test_new_file_appended():
+    """新文件的数据追加在数据文件末尾，原来的数据不动，原来的图片仍然读得到"""
+    with tempfile.TemporaryDirectory() as folder:
+        indexer, library = make_library(folder)
+        _, store_before = file_state(library.store_path)
+        sad = os.path.join(folder, '猫', '生气.png')
+        payload_before = library.payload(sad).data
+
+        write_png(folder, '狗/早安.png', 90, 90, 4)
+        library = refresh(indexer, library)
+        stats = indexer.stats
+        assert stats['unchanged'] == 3 and stats['hashed'] == 1 and stats['encoded'] == 1, f"统计: {stats}"
+        assert stats['store'] == 'appended'
+        _, store_after = file_state(library.store_path)
+        assert store_after.startswith(store_before), "原来的数据被改写"
+        assert len(store_after) == len(store_before) + stats['appended_bytes']
+
+        assert len(library) == 4
+        assert library.payload(sad).data == payload_before
+        new_payload = library.payload(os.path.join(folder, '狗', '早安.png'))
+        assert new_payload is not None and new_payload.data
+        library.close()
+
+
+def test_renamed_file_reused_by_hash():
+    """改名（移动到其他目录）的文件按内容哈希复用尺寸，标签按新的路径生成"""
+    with tempfile.TemporaryDirectory() as folder:
+        indexer, library = make_library(folder)
+        os.makedirs(os.path.join(folder, '兔子'))
+        os.replace(os.path.join(folder, '猫', '开心_01.png'), os.path.join(folder, '兔子', '开心_跳.png'))
+
+        library = refresh(indexer, library)
+        stats = indexer.stats
+        assert stats['hashed'] == 1 and stats['reused'] == 1, f"统计: {stats}"
+        assert len(library) == 3
+
+        entries = [library.entry(i) for i in range(len(library))]
+        moved = [entry for entry in entries if entry.path.endswith('开心_跳.png')]
+        assert len(moved) == 1 and (moved[0].width, moved[0].height) == (120, 80)
+        assert moved[0].tags == ['兔子', '开心', '跳'], f"标签: {moved[0].tags}"
+
+        # 按标签查找使用新的路径
+        assert [library.path(i) for i in library.find('兔子')] == [moved[0].path]
+        assert [library.path(i) for i in library.find('猫')] == [os.path.join(folder, '猫', '生气.png')]
+        assert library.find('开心') == [moved[0].index]
+        assert library.find('01') == [] and library.find('不存在') == []
+        library.close()
+
+
+def test_duplicates_indexed_once():
+    """内容相同的文件只索引第一个（按路径排序），下次更新时不再读取重复的文件"""
+    with tempfile.TemporaryDirectory() as folder:
+        indexer, library = make_library(folder)
+        shutil.copyfile(os.path.join(folder, '狗', '晚安.png'), os.path.join(folder, '狗', '晚安_副本.png'))
+        os.utime(os.path.join(folder, '狗', '晚安_副本.png'), (FIXED_MTIME, FIXED_MTIME))
+
+        library = refresh(indexer, library)
+        stats = indexer.stats
+        assert stats['duplicates'] == 1 and stats['appended_bytes'] == 0, f"统计: {stats}"
+        assert len(library) == 3 and library.duplicates == 1
+        assert library.find('副本') == [], "重复的文件出现在标签索引中"
+
+        index_before = file_state(library.index_path)
+        library = refresh(indexer, library)
+        stats = indexer.stats
+        assert stats['unchanged'] == 4 and stats['hashed'] == 0 and stats['duplicates'] == 1, f"统计: {stats}"
+        assert file_state(library.index_path) == index_before
+        library.close()
+
+
+def test_store_rewritten_after_deletions():
+    """删掉大部分图片后重写数据文件，只保留仍然被引用的数据"""
+    with tempfile.TemporaryDirectory() as folder:
+        indexer, library = make_library(folder)
+        for index in range(4, 10):
+            write_png(folder, f'大量/图{index}.png', 10, 10, index)
+        library = refresh(indexer, library)
+        assert len(library) == 9
+        size_before = os.path.getsize(library.store_path)
+
+        shutil.rmtree(os.path.join(folder, '大量'))
+        library = refresh(indexer, library)
+        assert indexer.stats['store'] == 'rewritten', f"统计: {indexer.stats}"
+        assert os.path.getsize(library.store_path) < size_before
+        assert len(library) == 3
+        for i in range(len(library)):
+            payload = library.payload(library.path(i))
+            assert payload is not None and payload.data, f"{library.path(i)} 的剪贴板数据丢失"
+        library.close()
+
+
+def main():
+    return run_tests("表情包库索引测试", [
+        ("没有变化时不改写文件", test_unchanged_refresh_writes_nothing),
+        ("新文件追加到数据文件", test_new_file_appended),
+        ("改名的文件按哈希复用", test_renamed_file_reused_by_hash),
+        ("重复的文件只索引一次", test_duplicates_indexed_once),
+        ("删除后重写数据文件", test_store_rewritten_after_deletions),
+    ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试脚本共用的工具
+功能：按顺序运行一组测试函数并打印结果；在模拟后端上创建只做检测的实例。
+      测试函数用 assert 检查，既可以直接运行测试脚本，也可以交给 pytest 收集
+"""
+
+import contextlib
+import io
+from typing import Callable, List, Optional, Tuple
+
+
+def run_tests(title: str, tests: List[Tuple[str, Callable[[], None]]]) -> int:
+    """依次运行 (名称, 测试函数)，打印 ✓/✗，返回进程退出码"""
+    print(f"=== {title} ===\n")
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {name}: {e}")
+
+    print("\n=== 测试结果 ===")
+    if failed:
+        print(f"✗ {failed} 项测试失败")
+        return 1
+    print("✓ 所有测试通过！")
+    return 0
+
+
+def make_app(backend, configure: Optional[Callable] = None):
+    """在模拟后端上创建一个只做检测的实例（不读写配置文件）
+
+    configure(app) 在找到聊天区域之后、记录检测基线之前调用，用来调整检测参数
+    """
+    from wechat_auto_emoji import WeChatAutoEmoji
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = WeChatAutoEmoji(backend=backend)
+        app.calibration_store = None
+        app.selection_path = None
+        app.reply_rules = None
+        app.find_wechat_window()
+        app.find_chat_area(app.get_wechat_automation_element())
+        if configure:
+            configure(app)
+        app.reset_detection_baseline()
+    return app
+
+
+def detect(app) -> bool:
+    """检测一次新消息（跳过检测间隔太短时的二次验证）"""
+    app.last_check_time -= 1.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        return app.detect_new_message()
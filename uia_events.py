@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天列表结构变化事件源
+功能：把聊天区域的结构变化通知（UI Automation StructureChanged 事件）放入队列，
+      监控循环只在列表真正变化时被唤醒，轮询作为兜底方案
+"""
+
+import queue
+import time
+from typing import Optional, List, Callable
+
+# UI Automation 的 StructureChangeType 枚举值
+CHANGE_CHILD_ADDED = 0
+CHANGE_CHILD_REMOVED = 1
+CHANGE_CHILDREN_INVALIDATED = 2
+CHANGE_CHILDREN_BULK_ADDED = 3
+CHANGE_CHILDREN_BULK_REMOVED = 4
+CHANGE_CHILDREN_REORDERED = 5
+
+# 停止时放入队列的哨兵，用于立即唤醒等待中的监控循环
+_STOP_SENTINEL = object()
+
+
+class StructureChange:
+    """一次结构变化通知"""
+    __slots__ = ('change_type', 'timestamp')
+
+    def __init__(self, change_type: int, timestamp: Optional[float] = None):
+        self.change_type = change_type
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def __repr__(self):
+        return f"StructureChange(type={self.change_type}, t={self.timestamp:.3f})"
+
+
+class MessageEventSource:
+    """消息变化事件源基类
+
+    子类负责订阅具体的通知来源，并在收到通知时调用 notify()；
+    监控循环通过 wait_for_change() 阻塞等待，直到有变化或超时。
+    设置了 listener 时通知直接交给回调（例如多聊天调度器唤醒对应的聊天），不再入队。
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.is_active = False
+        self.dropped_events = 0  # 队列已满时丢弃的通知数量
+        self.listener: Optional[Callable[[StructureChange], None]] = None
+
+    def set_listener(self, listener: Optional[Callable[[StructureChange], None]]):
+        """设置通知回调，回调在发出通知的线程中执行，应当尽快返回"""
+        self.listener = listener
+
+    def start(self, chat_element) -> bool:
+        """开始订阅聊天列表的变化，成功返回True"""
+        raise NotImplementedError
+
+    def stop(self):
+        """停止订阅，并唤醒正在等待的线程"""
+        self.is_active = False
+        try:
+            self._queue.put_nowait(_STOP_SENTINEL)
+        except queue.Full:
+            pass
+
+    def notify(self, change_type: int):
+        """记录一次结构变化（可在任意线程调用）"""
+        listener = self.listener
+        if listener is not None:
+            listener(StructureChange(change_type))
+            return
+        try:
+            self._queue.put_nowait(StructureChange(change_type))
+        except queue.Full:
+            # 队列中已有未处理的通知，监控循环一定会被唤醒，丢弃即可
+            self.dropped_events += 1
+
+    def wait_for_change(self, timeout: float) -> List[StructureChange]:
+        """等待结构变化，返回本次唤醒时合并的所有通知（超时返回空列表）"""
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+
+        changes = []
+        item = first
+        while True:
+            if item is not _STOP_SENTINEL:
+                changes.append(item)
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return changes
+
+
+class UIAStructureEventSource(MessageEventSource):
+    """基于 UI Automation StructureChanged 事件的事件源（仅Windows）"""
+
+    def __init__(self, uia, max_pending: int = 256):
+        super().__init__(max_pending)
+        self.uia = uia
+        self._element = None
+        self._handler = None
+
+    def start(self, chat_element) -> bool:
+        if self.is_active:
+            return True
+        if not self.uia or not chat_element:
+            return False
+
+        try:
+            import comtypes
+            import comtypes.gen.UIAutomationClient as UIAuto
+        except ImportError:
+            print("UI Automation模块不可用，无法订阅结构变化事件")
+            return False
+
+        source = self
+
+        class _StructureChangedHandler(comtypes.COMObject):
+            _com_interfaces_ = [UIAuto.IUIAutomationStructureChangedEventHandler]
+
+            def HandleStructureChangedEvent(self, sender, changeType, runtimeId):
+                source.notify(changeType)
+                return 0  # S_OK
+
+        try:
+            handler = _StructureChangedHandler()
+            self.uia.AddStructureChangedEventHandler(
+                chat_element, UIAuto.TreeScope_Children, None, handler)
+        except Exception as e:
+            print(f"订阅聊天区域结构变化事件失败: {e}")
+            return False
+
+        self._element = chat_element
+        self._handler = handler
+        self.is_active = True
+        print("已订阅聊天区域结构变化事件")
+        return True
+
+    def stop(self):
+        if self._handler is not None and self._element is not None:
+            try:
+                self.uia.RemoveStructureChangedEventHandler(self._element, self._handler)
+            except Exception as e:
+                print(f"取消结构变化事件订阅时出错: {e}")
+        self._element = None
+        self._handler = None
+        super().stop()
@@ -8,20 +8,35 @@
 """
 
 import time
-import random
 import threading
 import sys
-import ctypes
-from ctypes import wintypes
-import comtypes.client
-from comtypes import CoCreateInstance, CLSCTX_INPROC_SERVER, GUID
-import pyautogui
-import pygetwindow as gw
-import win32gui
-import win32api
-import win32con
-from typing import Optional, Tuple, List
-import hashlib
+import os
+from typing import Optional, Tuple, List, Callable
+
+from backends import PlatformBackend, WindowsBackend
+from uia_events import MessageEventSource
+from chat_scheduler import ChatScheduler
+from action_queue import ActionQueue, CoalescingPolicy, OnePerBurstPolicy, RateLimitPolicy
+from async_engine import AsyncEngine, AsyncActionQueue
+from adaptive_interval import AdaptiveInterval
+from readiness import SendTimings, wait_until
+from calibration_profile import CalibrationStore, validate_calibration
+from emoji_grid import EmojiGrid, DEFAULT_CELL_PITCH
+from emoji_selector import EmojiSelector, DEFAULT_SELECTION_PATH
+from emoji_pages import PanelLayout, PanelTab, tabs_from_rects
+from sticker_paste import PayloadCache, list_sticker_files
+from sticker_library import StickerIndexer, StickerLibrary
+from reply_rules import RuleEngine, ReplyDecision, DEFAULT_RULES_PATH
+from chat_snapshot import ChatSnapshot, ChatSnapshotBuilder, SnapshotElement
+from signature_index import SignatureIndex, IncrementalSignatureEngine
+from chat_messages import MessageParser, MessageRecord
+from snapshot_trace import TraceRecorder, EVENT_SENT, EVENT_DETECTED
+from window_geometry import WindowGeometry
+from chat_area_locator import ChatAreaLocator, AREA_OK, AREA_STALE
+from pixel_detector import PixelChangeDetector, HAS_NUMPY
+from auto_calibration import AutoCalibrator
+from metrics import MonitorMetrics, MetricsServer, JsonDumper
+from sampling_profiler import SamplingProfiler
 
 # 导入键盘监听库
 try:
@@ -37,60 +52,140 @@ except ImportError:
         HAS_PYNPUT = False
         print("警告：无法导入键盘监听库，将使用备选方案")
 
-# 尝试导入UI Automation，如果失败则使用备选方案
-try:
-    import comtypes.gen.UIAutomationClient as UIAuto
-    HAS_UIA = True
-except ImportError:
-    print("UI Automation模块未找到，将使用备选监控方案")
-    HAS_UIA = False
-    UIAuto = None
-
 class WeChatAutoEmoji:
-    def __init__(self):
+    def __init__(self, backend: Optional[PlatformBackend] = None, uia=None):
+        # 平台后端：默认使用Windows后端，测试和压测时可以传入模拟后端
+        self.backend = backend or WindowsBackend()
+        
         # 微信相关变量
         self.wechat_window = None
         self.wechat_hwnd = None
         self.chat_area_element = None
+        self.chat_area_locator: Optional[ChatAreaLocator] = None  # 记住聊天区域的路径，每次检测前验证
         self.emoji_button_pos = None
         self.emoji_panel_area = None
         
-        # 初始化UI Automation（如果可用）
-        self.uia = None
-        if HAS_UIA:
-            try:
-                self.uia = CoCreateInstance(UIAuto.CUIAutomation._reg_clsid_, 
-                                           interface=UIAuto.IUIAutomation, 
-                                           clsctx=CLSCTX_INPROC_SERVER)
-                print("UI Automation已初始化")
-            except Exception as e:
-                print(f"UI Automation初始化失败: {e}")
-                self.uia = None
+        # 初始化UI Automation（如果可用），多聊天监控时所有检测器共用一个
+        self.uia = uia or self.backend.create_automation()
+        self.uia_module = self.backend.uia_module if self.uia else None
         
         # 监控状态
         self.is_monitoring = False
         self.last_message_count = 0
         self.last_window_title = ""
         self.monitoring_thread = None
+        self.scheduler = None            # 多聊天监控调度器（ChatScheduler 或 AsyncEngine）
+        # 监控引擎："async" 所有检测、定时器和发送队列在一个事件循环上运行 / "thread" 监控线程加发送线程
+        self.engine_mode = "async"
+        self.engine: Optional[AsyncEngine] = None  # 单聊天监控的异步引擎
+        self.last_engine: Optional[AsyncEngine] = None  # 上一个停止的引擎，重新开始前等它的执行线程结束
         
         # 消息检测的状态变量
-        self.last_message_elements = []  # 存储最后几条消息元素的特征
-        self.last_message_hash = None    # 最后一条消息的哈希值
         self.message_history_size = 5    # 保存的消息历史数量
-        self.last_check_time = time.time()  # 上次检查时间
+        self.last_message_elements = SignatureIndex(self.message_history_size)  # 最后几条消息的标识
+        self.message_parser = MessageParser()  # 把聊天列表项解析成消息记录
+        self.window_geometry: Optional[WindowGeometry] = None  # 窗口位置缓存，判断消息来源时使用
+        self.last_message_hash = None    # 最后一条消息的哈希值
+        self.last_check_time = self.backend.now()  # 上次检查时间
+        
+        # 事件驱动检测：订阅聊天列表的结构变化，轮询作为兜底
+        self.detection_mode = "event"    # "event" 事件驱动 / "poll" 定时轮询
+        self.event_source: Optional[MessageEventSource] = None
+        self.event_fallback_interval = 2.0  # 事件模式下的兜底轮询间隔（秒）
+        
+        # 聊天列表快照：每次检测只遍历一次聊天区域
+        self.snapshot_builder: Optional[ChatSnapshotBuilder] = None
+        self.trace_recorder: Optional[TraceRecorder] = None  # 录制快照的轨迹文件，None 表示不录制
+        self.last_snapshot: Optional[ChatSnapshot] = None  # 最近一次读取的快照，开始录制时作为基线帧
+        self.signature_engine = IncrementalSignatureEngine()  # 只读取聊天列表尾部
+        
+        # 没有 UI Automation 时截取聊天区域比较像素变化（需要 numpy）
+        self.pixel_detector: Optional[PixelChangeDetector] = None
+        self.region_capture = None
+        self.pixel_fallback = HAS_NUMPY
+        # 运行指标：默认关闭，metrics 命令开启并导出
+        self.metrics = MonitorMetrics()
+        self.metrics.queue_depth.fn = self.pending_replies
+        self.metrics_exporter = None     # MetricsServer 或 JsonDumper
+        self.metrics_port = 9464         # Prometheus 端点的端口
+        self.metrics_interval = 10.0     # 写入JSON文件的间隔（秒）
+        # 采样分析：profile 命令采样监控和发送线程
+        self.profile_seconds = 30.0      # 默认采样时长（秒）
+        self.profile_interval = 0.005    # 采样间隔（秒）
+        self.change_time: Optional[float] = None  # 最早一个还没有检测的结构变化通知的时间
+        self.com_calls_last_tick = 0     # 最近一次检测的COM调用次数
+        self.com_calls_total = 0         # 累计COM调用次数
+        self.tick_count = 0              # 累计检测次数
         
         # 发送状态控制
         self.just_sent_emoji = False     # 刚刚发送了表情包的标志
         self.emoji_send_time = 0         # 发送表情包的时间戳
         self.emoji_cooldown = 3.0        # 发送表情包后的冷却时间（秒）
         
+        # 发送队列：检测线程只提交回复意图，由执行线程完成点击
+        self.action_queue: Optional[ActionQueue] = None
+        self.reply_policy = "burst"      # "burst" 每轮消息回复一次 / "rate" 限制每分钟次数
+        self.max_replies_per_minute = 6  # "rate" 策略下每个聊天每分钟最多回复次数
+        
         # 位置设置相关
         self.position_confirmed = False
         self.hotkey_listener = None
+        # 保存的表情包位置配置，为 None 时每次启动都交互式设置
+        self.calibration_store: Optional[CalibrationStore] = CalibrationStore()
+        # 在窗口截图中自动识别表情包按钮和面板（需要 numpy），识别不到时再按热键设置
+        self.auto_calibrator: Optional[AutoCalibrator] = AutoCalibrator(self.backend) if HAS_NUMPY else None
+        
+        # 表情包面板网格：第一次发送时检测并缓存，之后按序号直接点击格子中心
+        self.emoji_grid: Optional[EmojiGrid] = None
+        self.emoji_cell_pitch = DEFAULT_CELL_PITCH  # 读取不到面板元素时按这个间距推算（100%缩放）
+        
+        # 多页表情包面板：标签页和每一页的网格第一次打开面板时检测并缓存
+        self.panel_layout: Optional[PanelLayout] = None
+        self.emoji_pages = {}            # 标签页名称 → 页数（只有一个标签页时名称为"默认"），未配置的按1页
+        self.page_scroll_amount = 5      # 翻一页需要滚动的滚轮格数
+        self.navigation_delay = 0.15     # 无法判断翻页是否完成时的固定等待（秒）
+        self.navigation_timeout = 0.5    # 等待切换标签页或翻页完成的超时（秒）
+        self.navigation_candidates = 3   # 选择表情包时比较导航代价的候选数量，1 表示不考虑导航代价
+        self.last_panel_tab = 0          # 面板打开时显示的标签页（微信会记住上次的标签页）
+        
+        # 表情包选择：按权重选择，每个聊天最近发过的表情包不会再选，记录保存到磁盘
+        self.emoji_selector = EmojiSelector(no_repeat=3)
+        self.selection_path: Optional[str] = DEFAULT_SELECTION_PATH  # 为 None 时不保存选择记录
+        self.selection_save_interval = 30.0  # 发送后最多间隔多久保存一次选择记录（秒）
+        self.selection_saved_at = time.time()
+        self.selection_loaded = False
+        
+        # 发送方式："panel" 打开表情包面板点击 / "paste" 把本地图片粘贴到输入框发送
+        self.send_mode = "panel"
+        self.chat_send_modes = {}        # 聊天名称 → 发送方式，没有设置的聊天使用 send_mode
+        self.sticker_dir: Optional[str] = None  # 粘贴发送的本地图片目录
+        self.sticker_files = []                 # 图片路径列表，或者按序号取路径的表情包库（StickerLibrary）
+        self.sticker_library: Optional[StickerLibrary] = None
+        self.payload_cache = PayloadCache()     # 编码好的剪贴板数据
+        self.sticker_selector = EmojiSelector(no_repeat=3)  # 本地图片的选择（序号对应 sticker_files）
+        
+        # 回复规则：按最新消息的内容、发送者和聊天决定是否回复、回复哪些表情包；为 None 时每条消息都回复
+        self.reply_rules: Optional[RuleEngine] = RuleEngine(DEFAULT_RULES_PATH)
+        self.last_message_text: Optional[str] = None    # 检测到的最新消息文本，只从标题检测到时为 None
+        self.last_message_sender: Optional[str] = None  # 最新消息的发送者（群聊中的头像名称）
         
         # 配置
-        self.check_interval = 0.5  # 检查间隔（秒）
-        self.click_delay = 0.2     # 点击延迟（秒）
+        self.check_interval = 0.5  # 检查间隔（秒），有消息时使用的最快间隔
+        self.max_check_interval = 5.0  # 聊天空闲时检测间隔逐步放大到的上限（秒）
+        self.title_check_interval = 0.1  # 等待期间检查窗口标题的间隔（秒）
+        self.click_delay = 0.2     # 点击延迟（秒），无法判断就绪状态时使用
+        
+        # 发送流程的就绪等待：等到真实的就绪信号为止，超时后放弃或退回固定等待
+        self.foreground_timeout = 1.0    # 等待微信窗口切换到前台的超时（秒）
+        self.panel_timeout = 1.5         # 等待表情包面板显示的超时（秒）
+        self.append_timeout = 2.0        # 等待表情包出现在聊天列表的超时（秒）
+        self.readiness_poll_interval = 0.02  # 检查就绪信号的间隔（秒）
+        self.panel_probe_supported = None    # 能否识别表情包面板：None 未知 / True / False
+        self.send_probe_builder: Optional[ChatSnapshotBuilder] = None  # 发送线程专用，不影响检测状态
+        self.send_timings = SendTimings(self.metrics.send_step)  # 发送流程每一步的耗时
+        
+        # 自适应检测间隔：空闲时指数退避，有新消息时立即回到 check_interval
+        self.pacer = self.make_pacer()
         
         print("微信自动表情包回复器已初始化")
         print("请确保微信PC版已经打开并登录")
@@ -99,7 +194,7 @@ class WeChatAutoEmoji:
         """查找微信窗口"""
         try:
             # 查找微信窗口
-            wechat_windows = gw.getWindowsWithTitle("微信")
+            wechat_windows = self.backend.find_windows("微信")
             if not wechat_windows:
                 print("未找到微信窗口，请确保微信已经打开.你可能需要尝试:将wechat最小化后,再执行start命令.")
                 return False
@@ -125,7 +220,7 @@ class WeChatAutoEmoji:
     def get_wechat_automation_element(self):
         """获取微信窗口的UI Automation元素"""
         try:
-            if not self.uia or not HAS_UIA:
+            if not self.uia:
                 return None
                 
             # 通过窗口句柄获取元素
@@ -144,36 +239,21 @@ class WeChatAutoEmoji:
     def find_chat_area(self, root_element):
         """查找聊天区域元素"""
         try:
-            if not self.uia or not HAS_UIA or not root_element:
+            if not self.uia or not root_element:
                 return False
                 
-            # 尝试查找聊天消息列表
-            # 微信的聊天区域通常是一个列表控件
-            condition = self.uia.CreatePropertyCondition(
-                UIAuto.UIA_ControlTypePropertyId, 
-                UIAuto.UIA_ListControlTypeId
-            )
-            
-            chat_lists = root_element.FindAll(UIAuto.TreeScope_Descendants, condition)
-            
-            if chat_lists.Length > 0:
-                # 通常聊天区域是最大的列表控件
-                largest_list = None
-                max_size = 0
-                
-                for i in range(chat_lists.Length):
-                    list_element = chat_lists.GetElement(i)
-                    rect = list_element.CurrentBoundingRectangle
-                    size = rect.right * rect.bottom
-                    
-                    if size > max_size:
-                        max_size = size
-                        largest_list = list_element
-                
-                if largest_list:
-                    self.chat_area_element = largest_list
-                    print("找到聊天区域")
-                    return True
+            # 微信的聊天区域通常是面积最大的列表控件；第一次遍历整个窗口，
+            # 之后沿记住的路径直接定位
+            if self.chat_area_locator is None:
+                self.chat_area_locator = ChatAreaLocator(self.uia, self.uia_module)
+            chat_list = self.chat_area_locator.locate(root_element)
+            
+            if chat_list:
+                self.chat_area_element = chat_list
+                # 聊天区域变了，之前记住的尾部位置不再有效
+                self.signature_engine.reset()
+                print("找到聊天区域")
+                return True
             
             print("未找到聊天区域，将使用备选方案")
             return False
@@ -194,12 +274,13 @@ class WeChatAutoEmoji:
         print("4. 同时按住 Ctrl+Alt 然后点击鼠标左键")
         print("(超时时间: 30秒)")
         
-        start_time = time.time()
+        confirmed = threading.Event()
         
         if HAS_KEYBOARD:
             # 使用keyboard库监听热键
             def on_hotkey():
                 self.position_confirmed = True
+                confirmed.set()
                 print("位置已确认！")
             
             # 注册多个热键
@@ -207,9 +288,8 @@ class WeChatAutoEmoji:
             keyboard.add_hotkey('ctrl+space', on_hotkey)
             keyboard.add_hotkey('ctrl+shift+c', on_hotkey)
             
-            # 等待确认或超时
-            while not self.position_confirmed and (time.time() - start_time) < timeout:
-                time.sleep(0.1)
+            # 等待确认或超时（热键回调直接唤醒，不轮询）
+            confirmed.wait(timeout)
             
             # 清除热键
             keyboard.clear_all_hotkeys()
@@ -220,6 +300,7 @@ class WeChatAutoEmoji:
                 try:
                     if key == pynput_keyboard.Key.f1:
                         self.position_confirmed = True
+                        confirmed.set()
                         print("位置已确认！")
                         return False  # 停止监听
                 except AttributeError:
@@ -229,8 +310,7 @@ class WeChatAutoEmoji:
             listener.start()
             
             # 等待确认或超时
-            while not self.position_confirmed and (time.time() - start_time) < timeout:
-                time.sleep(0.1)
+            confirmed.wait(timeout)
             
             listener.stop()
             
@@ -266,8 +346,13 @@ class WeChatAutoEmoji:
             print("表情包按钮位置设置失败")
             return False
         
-        self.emoji_button_pos = pyautogui.position()
+        self.emoji_button_pos = self.backend.mouse_position()
         print(f"✓ 表情包按钮位置已设置: {self.emoji_button_pos}")
+        if self.auto_calibrator is not None and self.wechat_window:
+            # 截下按钮的样子，以后窗口大小或缩放比例变了可以自动识别
+            dpi = self.backend.get_dpi(self.wechat_window)
+            if self.auto_calibrator.remember_button(self.wechat_window, dpi, self.emoji_button_pos):
+                print("✓ 已保存表情包按钮的图像，以后可以自动识别")
         
         # 设置表情包面板区域
         print("\n步骤 2: 设置表情包面板区域")
@@ -280,7 +365,7 @@ class WeChatAutoEmoji:
             print("表情包面板左上角位置设置失败")
             return False
         
-        panel_top_left = pyautogui.position()
+        panel_top_left = self.backend.mouse_position()
         print(f"✓ 表情包面板左上角: {panel_top_left}")
         
         print("\n步骤 3: 设置表情包面板右下角")
@@ -292,7 +377,7 @@ class WeChatAutoEmoji:
             print("表情包面板右下角位置设置失败")
             return False
         
-        panel_bottom_right = pyautogui.position()
+        panel_bottom_right = self.backend.mouse_position()
         print(f"✓ 表情包面板右下角: {panel_bottom_right}")
         
         # 保存面板区域信息
@@ -306,6 +391,9 @@ class WeChatAutoEmoji:
         }
         
         print(f"✓ 表情包面板区域已设置: {self.emoji_panel_area}")
+        # 面板区域变了，网格和标签页在下一次发送时重新检测
+        self.emoji_grid = None
+        self.panel_layout = None
         
         # 关闭表情包面板
         print("\n步骤 4: 关闭表情包面板")
@@ -320,14 +408,173 @@ class WeChatAutoEmoji:
         print("现在可以开始监控了")
         return True
     
-    def get_message_count(self) -> int:
+    def auto_calibrate(self) -> bool:
+        """在窗口截图中识别表情包按钮，点击按钮后比较截图找到面板，不需要按热键"""
+        calibrator = self.auto_calibrator
+        if calibrator is None or not self.wechat_window:
+            return False
+        window = self.wechat_window
+        print("正在自动识别表情包按钮和面板...")
+        start = time.perf_counter()
+        try:
+            window.activate()
+            self.wait_ready(lambda: self.backend.is_foreground(window), self.foreground_timeout)
+            dpi = self.backend.get_dpi(window)
+            chat_rect = self.get_chat_area_rect()
+            button = calibrator.locate_button(window, dpi, chat_rect)
+            if button is None:
+                print("截图中没有找到表情包按钮")
+                return False
+            self.backend.click(button.x, button.y)
+            opened = self.wait_for_emoji_panel()
+            if opened is False:
+                print(f"点击 {button} 后没有打开表情包面板")
+                return False
+            panel = calibrator.locate_panel(window)
+            # 再点一次按钮关闭面板
+            self.backend.click(button.x, button.y)
+        except Exception as e:
+            print(f"自动识别表情包位置时出错: {e}")
+            return False
+        if panel is None:
+            print("点击按钮前后的截图没有变化，没有找到表情包面板")
+            return False
+        problem = validate_calibration(window, button, panel, chat_rect)
+        if problem:
+            print(f"自动识别的位置不可用: {problem}")
+            return False
+        
+        self.emoji_button_pos = button
+        self.emoji_panel_area = panel
+        self.emoji_grid = None
+        self.panel_layout = None
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"✓ 已自动识别表情包位置（{elapsed:.0f} ms，匹配度 {calibrator.last_match.score:.2f}）: "
+              f"按钮 {button}，面板 {panel}")
+        return True
+    
+    def load_calibration(self) -> bool:
+        """加载与当前窗口大小和DPI匹配的表情包位置配置，并检查是否可用"""
+        if not self.calibration_store or not self.wechat_window:
+            return False
+        start = time.perf_counter()
+        dpi = self.backend.get_dpi(self.wechat_window)
+        loaded = self.calibration_store.load(self.wechat_window, dpi)
+        if loaded is None:
+            print(f"没有与当前窗口（{self.wechat_window.width}x{self.wechat_window.height}，DPI {dpi}）匹配的位置配置")
+            return False
+        
+        button_pos, panel_area, extras = loaded
+        problem = validate_calibration(self.wechat_window, button_pos, panel_area, self.get_chat_area_rect())
+        if problem:
+            print(f"已保存的位置配置不可用: {problem}")
+            return False
+        
+        self.emoji_button_pos = button_pos
+        self.emoji_panel_area = panel_area
+        self.emoji_grid = EmojiGrid.from_dict(extras['grid']) if 'grid' in extras else None
+        self.panel_layout = PanelLayout.from_dict(extras['layout']) if 'layout' in extras else None
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"✓ 已加载保存的表情包位置（{elapsed:.1f} ms）: 按钮 {button_pos}，面板 {panel_area}")
+        return True
+    
+    def save_calibration(self) -> bool:
+        """把当前的表情包位置保存到配置文件（相对窗口左上角）"""
+        if not self.calibration_store or not self.wechat_window:
+            return False
+        if not (self.emoji_button_pos and self.emoji_panel_area):
+            return False
+        dpi = self.backend.get_dpi(self.wechat_window)
+        extras = {
+            'grid': self.emoji_grid.to_dict() if self.emoji_grid else None,
+            'layout': self.panel_layout.to_dict() if self.panel_layout else None,
+        }
+        if self.calibration_store.save(self.wechat_window, dpi, self.emoji_button_pos, self.emoji_panel_area, extras):
+            print(f"表情包位置已保存到 {self.calibration_store.path}")
+            return True
+        return False
+    
+    def ensure_calibration(self) -> bool:
+        """优先使用保存的表情包位置，不可用时自动识别，识别不到再交互式设置，并保存"""
+        if self.load_calibration():
+            return True
+        if self.auto_calibrate():
+            self.save_calibration()
+            return True
+        if not self.setup_emoji_positions():
+            return False
+        self.save_calibration()
+        return True
+    
+    def take_snapshot(self) -> Optional[ChatSnapshot]:
+        """遍历一次聊天区域，生成本次检测共用的快照"""
+        if not (self.chat_area_element and self.uia):
+            return None
+        try:
+            snapshot = self.backend.replay_snapshot(self.wechat_window)
+            if snapshot is None:
+                if self.snapshot_builder is None:
+                    self.snapshot_builder = ChatSnapshotBuilder(self.uia, self.uia_module)
+                snapshot = self.signature_engine.fetch(self.snapshot_builder, self.chat_area_element)
+            self.last_snapshot = snapshot
+            if self.trace_recorder is not None:
+                self.record_trace_snapshot(snapshot)
+            self.com_calls_last_tick = snapshot.com_calls
+            self.com_calls_total += snapshot.com_calls
+            self.tick_count += 1
+            self.metrics.com_calls.observe(snapshot.com_calls)
+            return snapshot
+        except Exception as e:
+            print(f"获取聊天区域快照时出错: {e}")
+            return None
+    
+    def revalidate_chat_area(self) -> bool:
+        """确认聊天区域元素仍然有效（每次检测只读取一次位置）
+        
+        元素失效（微信切换聊天时会重建聊天列表）或位置变化时沿记住的路径重新定位。
+        换成了另一个元素时返回 True，这时之前的尾部位置和结构变化订阅都已经重新建立。
+        """
+        locator = self.chat_area_locator
+        if locator is None or not self.chat_area_element or not self.uia:
+            return False
+        status = locator.revalidate(self.chat_area_element)
+        if status == AREA_OK:
+            return False
+        
+        previous = locator.runtime_id
+        try:
+            chat_list = locator.locate(self.uia.ElementFromHandle(self.wechat_hwnd))
+        except Exception as e:
+            print(f"重新定位聊天区域时出错: {e}")
+            return False
+        if not chat_list:
+            print("聊天区域已失效，暂时找不到新的聊天区域")
+            return False
+        
+        self.chat_area_element = chat_list
+        if status != AREA_STALE and previous is not None and locator.runtime_id == previous:
+            # 同一个元素，只是窗口移动或改变了大小
+            return False
+        
+        print("聊天区域已被微信重建，已重新定位")
+        self.signature_engine.reset()
+        if self.event_source is not None and self.event_source.is_active:
+            self.event_source.stop()
+            self.event_source.start(chat_list)
+        return True
+    
+    def get_message_count(self, snapshot: Optional[ChatSnapshot] = None) -> int:
         """获取当前聊天区域的消息数量"""
         try:
-            if self.chat_area_element and self.uia and HAS_UIA:
-                # 尝试获取子元素数量
-                condition = self.uia.CreateTrueCondition()
-                children = self.chat_area_element.FindAll(UIAuto.TreeScope_Children, condition)
-                return children.Length
+            if self.chat_area_element and self.uia:
+                # 从快照读取子元素数量
+                snapshot = snapshot or self.take_snapshot()
+                if snapshot is None:
+                    return 0
+                if snapshot.is_tail:
+                    # 尾部快照不知道总数，用上次的数量加上新增数量估算
+                    return max(self.last_message_count + snapshot.appended, snapshot.count)
+                return snapshot.count
             else:
                 # 备选方案：监控窗口标题变化
                 # 当有新消息时，微信窗口标题通常会显示未读消息数量
@@ -347,13 +594,19 @@ class WeChatAutoEmoji:
     
     def detect_new_message(self) -> bool:
         """检测是否有新消息 - 使用多种改进的方法"""
+        # 运行指标关闭时只检查这一次开关
+        tick_start = time.perf_counter() if self.metrics.enabled else None
+        self.metrics.ticks.inc()
         try:
-            current_time = time.time()
+            current_time = self.backend.now()
             has_new_message = False
+            title_detected = False  # 是否由窗口标题的未读数检测到
             
             # 首先检查是否在发送表情包的冷却期内
             if self.just_sent_emoji and (current_time - self.emoji_send_time) < self.emoji_cooldown:
                 # 在冷却期内，不检测新消息，避免误判自己发送的表情包
+                self.metrics.suppressed.inc(label_value='cooldown')
+                self.change_time = None
                 return False
             
             # 如果过了冷却期，重置发送标志
@@ -361,20 +614,33 @@ class WeChatAutoEmoji:
                 self.just_sent_emoji = False
                 print("表情包发送冷却期结束，恢复消息检测")
                 # 更新消息基线，避免把冷却期内的消息当作新消息
-                if self.chat_area_element and self.uia and HAS_UIA:
-                    self.last_message_hash = self.get_latest_message_signature()
-                    self.last_message_elements = self.get_message_signatures()[-self.message_history_size:]
-                    self.last_message_count = self.get_message_count()
+                if self.chat_area_element and self.uia:
+                    baseline = self.take_snapshot()
+                    self.last_message_hash = self.get_latest_message_signature(baseline)
+                    self.last_message_elements.replace(self.get_message_signatures(baseline))
+                    self.last_message_count = self.get_message_count(baseline)
                     print("已更新消息检测基线")
+                elif self.pixel_detector is not None:
+                    self.pixel_detector.reset()
+                    self.detect_by_pixels()
+            
+            # 聊天列表被重建时（例如切换了聊天）以新列表为基线，不把已有的消息当作新消息
+            if self.revalidate_chat_area():
+                self.reset_detection_baseline()
+            
+            # 本次检测的所有方法共用同一份快照
+            snapshot = self.take_snapshot()
             
             # 方法1：消息签名检测（主要方法）
-            if self.chat_area_element and self.uia and HAS_UIA:
-                latest_signature = self.get_latest_message_signature()
+            previous_signature = self.last_message_hash
+            if snapshot is not None:
+                latest_signature = self.get_latest_message_signature(snapshot)
                 
                 if latest_signature and latest_signature != self.last_message_hash:
                     # 检查是否是自己发送的消息
                     if latest_signature == "OWN_MESSAGE":
                         print("检测到自己发送的消息，忽略")
+                        self.metrics.suppressed.inc(label_value='own')
                         self.last_message_hash = latest_signature
                         # 不设置 has_new_message = True，避免触发回复
                     else:
@@ -384,17 +650,18 @@ class WeChatAutoEmoji:
                         self.last_message_hash = latest_signature
                         has_new_message = True
                 
-                # 辅助检测：消息元素列表变化
-                current_signatures = self.get_message_signatures()
-                if len(current_signatures) > 0:
-                    # 检查是否有新的消息签名出现
-                    new_signatures = [sig for sig in current_signatures[-3:] if sig not in self.last_message_elements]
-                    if new_signatures:
-                        print(f"检测到新的消息元素: {len(new_signatures)} 个")
+                # 辅助检测：最后几条消息中出现了新的标识（只算他人的消息，不算时间分隔行和系统提示）
+                records = self.message_records(snapshot)
+                if len(records) > 0:
+                    new_records = [record for record in records[-3:]
+                                   if record.identity not in self.last_message_elements
+                                   and record.is_message and not record.own]
+                    if new_records:
+                        print(f"检测到新的消息: {len(new_records)} 条")
                         has_new_message = True
                     
                     # 更新消息历史
-                    self.last_message_elements = current_signatures[-self.message_history_size:]
+                    self.last_message_elements.replace(record.identity for record in records)
             
             # 方法2：窗口标题变化检测（辅助方法）
             if self.wechat_window:
@@ -408,31 +675,38 @@ class WeChatAutoEmoji:
                     if re.search(r'\(\d+\)', current_title) or re.search(r'\[\d+\]', current_title):
                         print(f"通过窗口标题检测到新消息: {current_title}")
                         has_new_message = True
+                        title_detected = True
             
             # 方法3：时间间隔检测（防止遗漏）
             # 如果距离上次检测时间太短，可能是误报，需要额外验证
-            if has_new_message and (current_time - self.last_check_time) < 0.2:
+            # 标题未读数不会是消息列表的误报，不需要验证（等待期间标题变化会立即触发检测）
+            if has_new_message and not title_detected and (current_time - self.last_check_time) < 0.2:
                 print("检测间隔太短，进行二次验证...")
-                time.sleep(0.1)  # 等待一下再次检测
+                self.backend.sleep(0.1)  # 等待一下再次检测
                 
-                # 再次检查消息签名
-                if self.chat_area_element and self.uia and HAS_UIA:
-                    verify_signature = self.get_latest_message_signature()
-                    if verify_signature != latest_signature:
-                        print("二次验证通过，确认为新消息")
-                    else:
+                # 再次检查消息签名：最新消息又变回检测前的样子才算误报
+                # （重新获取快照失败时无法验证，保留本次检测结果）
+                if snapshot is not None:
+                    verify_snapshot = self.take_snapshot()
+                    if verify_snapshot is None:
+                        print("二次验证时无法获取聊天区域快照，保留检测结果")
+                    elif (latest_signature != previous_signature
+                          and self.get_latest_message_signature(verify_snapshot) == previous_signature):
                         print("二次验证失败，可能是误报")
+                        self.metrics.suppressed.inc(label_value='verify')
+                        self.last_message_hash = previous_signature
                         has_new_message = False
+                    else:
+                        print("二次验证通过，确认为新消息")
             
             # 方法4：备选检测 - 元素数量突增
-            if not has_new_message and self.chat_area_element and self.uia and HAS_UIA:
+            if not has_new_message and snapshot is not None:
                 try:
-                    condition = self.uia.CreateTrueCondition()
-                    children = self.chat_area_element.FindAll(UIAuto.TreeScope_Children, condition)
-                    current_count = children.Length
+                    # 增量签名引擎已经算出了尾部新增的消息数量
+                    current_count = self.get_message_count(snapshot)
                     
                     # 如果消息数量显著增加（超过2个），很可能有新消息
-                    if current_count > self.last_message_count + 1:
+                    if snapshot.appended > 1:
                         print(f"检测到消息数量显著增加: {self.last_message_count} -> {current_count}")
                         has_new_message = True
                     
@@ -441,14 +715,74 @@ class WeChatAutoEmoji:
                 except Exception as e:
                     print(f"备选检测方法出错: {e}")
             
+            # 方法5：没有聊天列表快照时比较聊天区域的像素（每次都截图，保持上一帧最新）
+            if snapshot is None and self.detect_by_pixels() and not has_new_message:
+                print("通过像素变化检测到聊天区域底部出现了新消息")
+                has_new_message = True
+            
             self.last_check_time = current_time
             
+            # 记下触发回复的消息内容和发送者，供回复规则使用
+            if has_new_message:
+                latest = self.latest_incoming_record(snapshot) if not title_detected else None
+                if latest is not None:
+                    self.last_message_text = latest.text
+                    self.last_message_sender = latest.sender
+                else:
+                    self.last_message_text = self.last_message_sender = None
+                if self.trace_recorder is not None:
+                    self.trace_recorder.record_event(EVENT_DETECTED, str(self.wechat_hwnd),
+                                                     self.last_message_text, current_time)
+            
+            if tick_start is not None:
+                self.record_tick(tick_start, has_new_message)
+            self.change_time = None
             return has_new_message
             
         except Exception as e:
             print(f"检测新消息时出错: {e}")
             return False
     
+    def record_tick(self, tick_start: float, detected: bool):
+        """记录一次检测的耗时；检测到新消息时记录从结构变化通知到现在的延迟（只在开启运行指标时调用）"""
+        metrics = self.metrics
+        metrics.detect_seconds.observe(time.perf_counter() - tick_start)
+        if detected:
+            metrics.detections.inc()
+            if self.change_time is not None:
+                metrics.detection_latency.observe(max(0.0, time.time() - self.change_time))
+    
+    def note_change(self, timestamp: float):
+        """收到结构变化通知（可在任意线程调用），记下最早一个还没有检测的通知的时间"""
+        if self.change_time is None:
+            self.change_time = timestamp
+    
+    def pending_replies(self) -> int:
+        """发送队列中等待执行的回复数量"""
+        queue = self.active_action_queue()
+        return queue.depth if queue else 0
+    
+    def active_action_queue(self):
+        """正在使用的发送队列（ActionQueue 或 AsyncActionQueue），没有监控时返回 None"""
+        if self.action_queue:
+            return self.action_queue
+        if self.engine:
+            return self.engine.action_queue
+        return self.scheduler.action_queue if self.scheduler else None
+    
+    def activate_chat_window(self):
+        """确保微信窗口是活动的，等到窗口切换到前台"""
+        ready = True
+        if self.wechat_window:
+            self.wechat_window.activate()
+            ready = self.wait_ready(lambda: self.backend.is_foreground(self.wechat_window),
+                                    self.foreground_timeout)
+            if ready is None:
+                self.backend.sleep(0.1)
+            elif not ready:
+                print("等待微信窗口切换到前台超时，继续发送")
+        self.send_timings.step('activate', timed_out=ready is False)
+    
     def click_emoji_button(self) -> bool:
         """点击表情包按钮"""
         try:
@@ -456,14 +790,11 @@ class WeChatAutoEmoji:
                 print("表情包按钮位置未设置")
                 return False
             
-            # 确保微信窗口是活动的
-            if self.wechat_window:
-                self.wechat_window.activate()
-                time.sleep(0.1)
+            self.activate_chat_window()
             
-            # 点击表情包按钮
-            pyautogui.click(self.emoji_button_pos.x, self.emoji_button_pos.y)
-            time.sleep(self.click_delay)
+            # 点击表情包按钮（面板是否打开由 select_random_emoji 等待）
+            self.backend.click(self.emoji_button_pos.x, self.emoji_button_pos.y)
+            self.send_timings.step('button')
             
             print("已点击表情包按钮")
             return True
@@ -472,35 +803,69 @@ class WeChatAutoEmoji:
             print(f"点击表情包按钮时出错: {e}")
             return False
     
-    def select_random_emoji(self) -> bool:
-        """随机选择并点击一个表情包"""
+    def select_random_emoji(self, decision: Optional[ReplyDecision] = None) -> bool:
+        """随机选择并点击一个表情包，回复规则指定了表情包时只在其中选择"""
         try:
             if not self.emoji_panel_area:
                 print("表情包面板区域未设置")
                 return False
             
+            panel = self.emoji_panel_area
+            
             # 等待表情包面板打开
-            time.sleep(0.3)
+            ready = self.wait_for_emoji_panel()
+            self.send_timings.step('panel', timed_out=ready is False)
+            if ready is False:
+                print("等待表情包面板打开超时，放弃本次发送")
+                # 点击面板外的位置，确保面板不会在之后弹出并一直开着
+                self.backend.click(panel['right'] + 50, panel['top'] + 50)
+                return False
             
-            # 在表情包面板区域内随机选择一个位置点击
-            panel = self.emoji_panel_area
+            # 记录发送前聊天列表的尾部，用于确认表情包已经发出
+            tail_before = self.probe_chat_tail()
+            
+            # 选择一个表情包：面板有多页时优先选择导航步骤少的。
+            # 超时已经在上面返回，这里面板已经打开或已经固定等待过，都先尝试读取面板元素
+            grid = self.get_emoji_grid(panel_open=True)
+            layout = self.get_panel_layout(panel_open=True)
+            total = layout.total(grid)
+            self.emoji_selector.resize(total)
+            start = (self.last_panel_tab, 0)
+            allowed = [i for i in decision.stickers if 0 <= i < total] if decision else []
+            if allowed:
+                index = self.emoji_selector.choose_from(self.chat_key(), allowed)
+            else:
+                candidates = self.navigation_candidates if len(layout.tabs) > 1 or layout.tabs[0].pages > 1 else 1
+                index = self.emoji_selector.choose(
+                    self.chat_key(), cost=lambda i: layout.navigation_cost(i, start, grid), candidates=candidates)
+            tab, page, cell = layout.locate(index, grid)
             
-            # 避免点击到边缘，留出一定边距
-            margin = 20
-            random_x = random.randint(panel['left'] + margin, panel['right'] - margin)
-            random_y = random.randint(panel['top'] + margin, panel['bottom'] - margin)
+            # 切换到表情包所在的标签页和页，按这一页的网格点击格子中心
+            tab, page = self.navigate_panel(layout, start, (tab, page))
+            self.send_timings.step('navigate')
+            page_grid = self.get_page_grid(layout, tab, page, grid)
+            cell %= page_grid.count
+            x, y = page_grid.cell_center(cell, panel)
             
-            # 点击随机位置
-            pyautogui.click(random_x, random_y)
-            time.sleep(self.click_delay)
+            self.backend.click(x, y)
+            self.send_timings.step('emoji')
             
-            print(f"已点击表情包位置: ({random_x}, {random_y})")
+            if len(layout.tabs) > 1 or layout.tabs[tab].pages > 1:
+                print(f"已点击 {layout.tabs[tab].name} 第 {page + 1} 页第 {cell + 1} 个表情包: ({x}, {y})")
+            else:
+                print(f"已点击第 {cell + 1} 个表情包: ({x}, {y})")
             
-            # 等待表情包发送
-            time.sleep(0.2)
+            # 等待表情包出现在聊天列表中
+            appended = self.wait_sent(tail_before)
+            if appended is False:
+                print("没有在聊天列表中看到发送的表情包，可能点到了空白处")
 
-            # 将鼠标移出去,防止点到空白之后卡住
-            pyautogui.click(panel['right'] + 50, panel['top'] + 50)
+            # 没有确认发出时将鼠标移出去点一下,防止点到空白之后面板卡住
+            if not appended:
+                self.backend.click(panel['right'] + 50, panel['top'] + 50)
+            
+            if time.time() - self.selection_saved_at >= self.selection_save_interval:
+                self.save_selection_state()
 
             return True
             
@@ -508,22 +873,329 @@ class WeChatAutoEmoji:
             print(f"选择表情包时出错: {e}")
             return False
     
-    def send_random_emoji(self) -> bool:
-        """发送随机表情包的完整流程"""
+    def wait_sent(self, tail_before: Optional[List[str]]) -> Optional[bool]:
+        """等待自己发送的消息出现在聊天列表中，无法判断时固定等待并返回None"""
+        appended = None
+        if tail_before is not None:
+            appended = self.wait_ready(lambda: self.emoji_appended(tail_before), self.append_timeout)
+        if appended is None:
+            self.backend.sleep(self.click_delay + 0.2)
+        self.send_timings.step('appended', timed_out=appended is False)
+        return appended
+    
+    def get_send_mode(self) -> str:
+        """当前聊天的发送方式；没有可用的本地图片时总是使用表情包面板"""
+        mode = self.chat_send_modes.get(self.chat_key(), self.send_mode)
+        if mode == "paste" and not self.sticker_files:
+            return "panel"
+        return mode
+    
+    def load_sticker_dir(self, directory: str) -> bool:
+        """设置粘贴发送的本地图片目录
+        
+        目录中已有索引时直接打开（不需要解析），然后在后台增量更新索引；没有索引时先建立索引。
+        索引无法写入（例如目录只读）时退回直接列出目录中的图片。
+        """
+        if not os.path.isdir(directory):
+            print(f"目录不存在: {directory}")
+            return False
+        indexer = StickerIndexer(directory)
+        library = StickerLibrary.open(directory)
         try:
-            print("开始发送随机表情包...")
+            if library is None:
+                print("正在建立表情包库索引...")
+                library = indexer.refresh()
+                print(f"表情包库索引完成: {indexer.describe()}")
+            else:
+                threading.Thread(target=self.refresh_sticker_library, args=(indexer, library), daemon=True).start()
+        except OSError as e:
+            print(f"无法建立表情包库索引（{e}），直接读取图片目录")
+            library = None
+        files = library if library is not None else list_sticker_files(directory)
+        if not len(files):
+            print(f"目录中没有图片: {directory}")
+            return False
+        
+        if self.sticker_library is not None and self.sticker_library is not library:
+            self.sticker_library.close()
+        self.sticker_dir = directory
+        self.sticker_library = library
+        self.sticker_files = files
+        self.sticker_selector.resize(len(files))
+        self.payload_cache.clear()
+        self.payload_cache.source = library
+        print(f"已加载 {len(files)} 张本地图片: {directory}")
+        return True
+    
+    def refresh_sticker_library(self, indexer: StickerIndexer, library: StickerLibrary):
+        """后台增量更新表情包库索引，更新后 library 指向新的索引"""
+        try:
+            indexer.refresh(library)
+            self.sticker_selector.resize(len(library))
+            print(f"表情包库索引已更新: {indexer.describe()}")
+        except OSError as e:
+            print(f"更新表情包库索引失败: {e}")
+    
+    def input_box_pos(self) -> Tuple[int, int]:
+        """输入框中的一个位置：表情包按钮所在工具栏的下方"""
+        window = self.wechat_window
+        x = self.emoji_button_pos.x + 100
+        if window is None:
+            return x, self.emoji_button_pos.y + 40
+        return x, (self.emoji_button_pos.y + window.top + window.height) // 2
+    
+    def paste_random_sticker(self, decision: Optional[ReplyDecision] = None) -> Optional[bool]:
+        """从本地图片目录选择一张图片，粘贴到输入框后回车发送
+        
+        回复规则指定了标签时只在表情包库中带这些标签的图片中选择。
+        返回None表示当前平台不能写入剪贴板，由调用方改用表情包面板发送。
+        """
+        try:
+            allowed = []
+            if decision and decision.tags and self.sticker_library is not None:
+                allowed = sorted({i for tag in decision.tags for i in self.sticker_library.find(tag)})
+            if allowed:
+                index = self.sticker_selector.choose_from(self.chat_key(), allowed)
+            else:
+                index = self.sticker_selector.choose(self.chat_key())
+            path = self.sticker_files[index]
+            payload = self.payload_cache.get(path)
+            self.send_timings.step('encode')
             
-            # 1. 点击表情包按钮
-            if not self.click_emoji_button():
-                return False
+            self.activate_chat_window()
+            if not self.backend.set_clipboard(payload.format, payload.data):
+                return None
+            
+            tail_before = self.probe_chat_tail()
+            
+            # 点击输入框让它获得焦点，粘贴后回车发送
+            x, y = self.input_box_pos()
+            self.backend.click(x, y)
+            self.backend.hotkey('ctrl', 'v')
+            self.backend.press('enter')
+            self.send_timings.step('paste')
+            print(f"已粘贴图片: {os.path.basename(path)}")
+            
+            appended = self.wait_sent(tail_before)
+            if appended is False:
+                print("没有在聊天列表中看到发送的图片")
+            return True
+            
+        except Exception as e:
+            print(f"粘贴图片时出错: {e}")
+            return False
+    
+    def chat_key(self) -> str:
+        """当前聊天的名称（去掉标题中的未读数），用于区分各个聊天的表情包发送记录"""
+        if not self.wechat_window:
+            return ""
+        import re
+        return re.sub(r'\s*[\(\[]\d+[\)\]]\s*$', '', self.wechat_window.title)
+    
+    def load_selection_state(self):
+        """加载上次保存的表情包权重和发送记录（只加载一次）"""
+        if self.selection_loaded or not self.selection_path:
+            return
+        self.selection_loaded = True
+        if self.emoji_selector.load(self.selection_path):
+            print(f"已加载表情包选择记录（{len(self.emoji_selector.histories)} 个聊天）")
+    
+    def save_selection_state(self):
+        """保存表情包权重和各聊天最近发过的表情包"""
+        self.selection_saved_at = time.time()
+        if self.selection_path and self.emoji_selector.dirty:
+            self.emoji_selector.save(self.selection_path)
+    
+    def get_emoji_grid(self, panel_open: bool = False) -> EmojiGrid:
+        """表情包面板网格，第一次使用时检测并缓存
+        
+        面板已打开时优先读取面板中每个表情包元素的位置；读取不到时按面板区域和表情包间距推算。
+        """
+        if self.emoji_grid is not None:
+            return self.emoji_grid
+        
+        panel = self.emoji_panel_area
+        grid = None
+        if panel_open:
+            cells = self.backend.get_emoji_panel_cells(self.uia, self.wechat_window)
+            if cells:
+                grid = EmojiGrid.from_cells(cells, panel)
+        if grid is None:
+            scale = self.backend.get_dpi(self.wechat_window) / 96 if self.wechat_window else 1.0
+            grid = EmojiGrid.from_panel_area(panel, self.emoji_cell_pitch * scale)
+        
+        self.emoji_grid = grid
+        print(f"表情包面板网格: {grid.describe()}")
+        # 只有从面板元素检测到的网格值得保存，推算的网格下次启动可以再算
+        if grid.source == "uia":
+            self.save_calibration()
+        return grid
+    
+    def get_panel_layout(self, panel_open: bool = False) -> PanelLayout:
+        """表情包面板的标签页布局，第一次使用时检测并缓存"""
+        if self.panel_layout is not None:
+            return self.panel_layout
+        
+        tab_rects = self.backend.get_emoji_panel_tabs(self.uia, self.wechat_window) if panel_open else None
+        if tab_rects and len(tab_rects) > 1:
+            tabs = tabs_from_rects(tab_rects, self.emoji_panel_area, self.emoji_pages)
+        else:
+            tabs = [PanelTab("默认", None, self.emoji_pages.get("默认", 1))]
+        self.panel_layout = PanelLayout(tabs)
+        print(f"表情包面板: {self.panel_layout.describe()}")
+        if tab_rects:
+            self.save_calibration()
+        return self.panel_layout
+    
+    def get_page_grid(self, layout: PanelLayout, tab: int, page: int, default_grid: EmojiGrid) -> EmojiGrid:
+        """某一页的网格，第一次到达这一页时从面板元素检测并缓存（最后一页可能不满）"""
+        if (tab, page) == (0, 0):
+            return default_grid
+        if page in layout.tabs[tab].grids:
+            return layout.tabs[tab].grids[page]
+        cells = self.backend.get_emoji_panel_cells(self.uia, self.wechat_window)
+        grid = EmojiGrid.from_cells(cells, self.emoji_panel_area) if cells else None
+        if grid is None:
+            return default_grid
+        layout.set_page_grid(tab, page, grid)
+        self.save_calibration()
+        return grid
+    
+    def navigate_panel(self, layout: PanelLayout, start: Tuple[int, int],
+                       target: Tuple[int, int]) -> Tuple[int, int]:
+        """从 start 切换到 target 所在的标签页和页，返回实际到达的位置
+        
+        每一步都等待面板内容变化（无法判断时固定等待），并把耗时记入导航代价模型。
+        翻页时面板内容不再变化说明已经到了这个标签页的最后一页，记下实际页数。
+        """
+        panel = self.emoji_panel_area
+        tab, page = start
+        if target[0] != tab:
+            center = layout.tabs[target[0]].center
+            if center is None:
+                return start
+            step_start = time.perf_counter()
+            before = self.backend.emoji_panel_signature(self.uia, self.wechat_window)
+            self.backend.click(int(panel['left'] + center[0]), int(panel['top'] + center[1]))
+            self.wait_panel_changed(before)
+            layout.cost_model.record('tab', time.perf_counter() - step_start)
+            tab, page = target[0], 0
+            self.last_panel_tab = tab
+        
+        center_x = (panel['left'] + panel['right']) // 2
+        center_y = (panel['top'] + panel['bottom']) // 2
+        while page != target[1]:
+            direction = 1 if target[1] > page else -1
+            step_start = time.perf_counter()
+            before = self.backend.emoji_panel_signature(self.uia, self.wechat_window)
+            self.backend.scroll(center_x, center_y, -direction * self.page_scroll_amount)
+            changed = self.wait_panel_changed(before)
+            layout.cost_model.record('page', time.perf_counter() - step_start)
+            if changed is False:
+                if direction > 0:
+                    print(f"{layout.tabs[tab].name} 只有 {page + 1} 页")
+                    layout.set_tab_pages(tab, page + 1)
+                    self.save_calibration()
+                break
+            page += direction
+        return tab, page
+    
+    def wait_panel_changed(self, before: Optional[str]) -> Optional[bool]:
+        """等待表情包面板的内容变化（切换标签页或翻页完成）"""
+        if before is None:
+            self.backend.sleep(self.navigation_delay)
+            return None
+        return self.wait_ready(
+            lambda: self.backend.emoji_panel_signature(self.uia, self.wechat_window) != before,
+            self.navigation_timeout)
+    
+    def wait_ready(self, predicate, timeout: float) -> Optional[bool]:
+        """等待就绪信号：True 已就绪，False 超时，None 无法判断"""
+        return wait_until(predicate, timeout, self.readiness_poll_interval)
+    
+    def wait_for_emoji_panel(self) -> Optional[bool]:
+        """等待表情包面板显示，无法识别面板时退回固定等待并返回None"""
+        if self.panel_probe_supported is False:
+            self.backend.sleep(0.3)
+            return None
+        
+        ready = self.wait_ready(lambda: self.backend.is_emoji_panel_open(self.wechat_window),
+                                self.panel_timeout)
+        if ready is None:
+            self.backend.sleep(0.3)
+        elif ready:
+            self.panel_probe_supported = True
+        elif self.panel_probe_supported is None:
+            # 从来没有识别到过面板，多半是当前微信版本的面板窗口不同，以后改用固定等待
+            print("无法识别表情包面板窗口，改用固定等待")
+            self.panel_probe_supported = False
+            return None
+        return ready
+    
+    def probe_chat_tail(self) -> Optional[List[str]]:
+        """读取聊天列表最后几条消息的签名（发送线程使用，不影响检测状态），不可用时返回None"""
+        if not self.chat_area_element or not self.uia:
+            return None
+        if self.send_probe_builder is None:
+            self.send_probe_builder = ChatSnapshotBuilder(self.uia, self.uia_module)
+        try:
+            tail = self.send_probe_builder.build_tail(self.chat_area_element, 3)
+        except Exception:
+            return None
+        records = self.message_records(tail)
+        signatures = [record.identity for record in records]
+        # 最后一条是自己的消息时在末尾加上标记，便于判断新出现的是不是自己发的表情包
+        if records and records[-1].own:
+            signatures.append("OWN_MESSAGE")
+        return signatures
+    
+    def emoji_appended(self, tail_before: List[str]) -> Optional[bool]:
+        """聊天列表尾部是否出现了自己新发送的消息"""
+        tail = self.probe_chat_tail()
+        if tail is None:
+            return None
+        return tail != tail_before and bool(tail) and tail[-1] == "OWN_MESSAGE"
+    
+    def make_reply(self) -> Optional[Callable[[], bool]]:
+        """按回复规则决定是否回复最新消息，返回发送动作；规则决定不回复时返回None"""
+        if self.reply_rules is None:
+            return self.send_random_emoji
+        chat = self.chat_key()
+        decision = self.reply_rules.decide(self.last_message_text, self.last_message_sender or chat, chat)
+        if decision.rule is not None or not decision.reply:
+            print(decision.describe())
+        if not decision.reply:
+            return None
+        return lambda: self.send_random_emoji(decision)
+    
+    def send_random_emoji(self, decision: Optional[ReplyDecision] = None) -> bool:
+        """发送随机表情包的完整流程，decision 为回复规则的决定（可能指定了表情包集合）"""
+        try:
+            print("开始发送随机表情包...")
+            self.send_timings.begin()
             
-            # 2. 选择随机表情包
-            if not self.select_random_emoji():
+            sent = None
+            if self.get_send_mode() == "paste":
+                sent = self.paste_random_sticker(decision)
+                if sent is None:
+                    print("无法写入剪贴板，改用表情包面板发送")
+            if sent is None:
+                # 1. 点击表情包按钮
+                if not self.click_emoji_button():
+                    return False
+                
+                # 2. 选择随机表情包
+                sent = self.select_random_emoji(decision)
+            if not sent:
                 return False
+            self.send_timings.finish()
             
             # 3. 设置发送标志和冷却时间
             self.just_sent_emoji = True
             self.emoji_send_time = time.time()
+            if self.trace_recorder is not None:
+                self.trace_recorder.record_event(EVENT_SENT, str(self.wechat_hwnd), timestamp=self.emoji_send_time,
+                                                 cooldown=self.emoji_cooldown)
             print(f"随机表情包发送完成！进入 {self.emoji_cooldown} 秒冷却期...")
             
             return True
@@ -539,28 +1211,160 @@ class WeChatAutoEmoji:
         while self.is_monitoring:
             try:
                 # 检查微信窗口是否还存在
-                if not self.wechat_window or not win32gui.IsWindow(self.wechat_hwnd):
+                if not self.wechat_window or not self.backend.is_window_alive(self.wechat_window):
                     print("微信窗口已关闭，停止监控")
                     self.stop_monitoring()
                     break
                 
+                # stop_monitoring 可能在其他线程中清除发送队列，先取一次引用
+                action_queue = self.action_queue
+                if action_queue is None:
+                    break
+                
+                # 回复还没有发送完时不检测：发送线程正在使用同一个检测器（消息解析的缓存、冷却状态）
+                if not action_queue.wait_idle(self.wechat_hwnd, timeout=1.0):
+                    continue
+                
                 # 检测新消息
-                if self.detect_new_message():
-                    print("检测到新消息，准备发送表情包...")
-                    
-                    # 发送随机表情包
-                    if self.send_random_emoji():
-                        print("表情包发送成功！")
+                detected = self.detect_new_message()
+                reply = self.make_reply() if detected else None
+                if reply is not None:
+                    # 交给发送队列，检测不等待点击完成
+                    if action_queue.submit(self.wechat_hwnd, reply):
+                        print("检测到新消息，已加入发送队列")
                     else:
-                        print("表情包发送失败")
+                        print("检测到新消息，已合并到待发送的回复")
                 
-                # 等待一段时间再检查
-                time.sleep(self.check_interval)
+                # 有新消息时回到最快间隔，空闲时逐步退避
+                self.pacer.record(detected)
+                
+                # 等待下一次检查：事件模式下等待结构变化通知，否则定时轮询
+                self.wait_for_next_check()
                 
             except Exception as e:
                 print(f"监控循环中发生错误: {e}")
                 time.sleep(1)
     
+    def make_reply_policy(self) -> CoalescingPolicy:
+        """按当前配置创建回复的合并策略"""
+        if self.reply_policy == "rate":
+            return RateLimitPolicy(self.max_replies_per_minute)
+        return OnePerBurstPolicy()
+    
+    def make_action_queue(self) -> ActionQueue:
+        """按当前的合并策略创建发送队列"""
+        queue = ActionQueue(policy=self.make_reply_policy())
+        queue.wait_histogram = self.metrics.reply_wait
+        return queue
+    
+    def make_engine(self, detector_factory=None) -> AsyncEngine:
+        """创建异步监控引擎；上一个引擎停止时还在执行的检测或发送先等它完成"""
+        if self.last_engine is not None:
+            self.last_engine.wait_closed(timeout=5)
+            self.last_engine = None
+        queue = AsyncActionQueue(policy=self.make_reply_policy())
+        queue.wait_histogram = self.metrics.reply_wait
+        return AsyncEngine(self.backend, self.uia, detector_factory,
+                           min_interval=self.check_interval,
+                           max_interval=max(self.check_interval, self.max_check_interval),
+                           action_queue=queue,
+                           fallback_interval=self.event_fallback_interval,
+                           title_check_interval=self.title_check_interval)
+    
+    def start_engine(self):
+        """在异步引擎上监控当前聊天窗口（调用前已经完成位置设置和基线初始化）"""
+        engine = self.make_engine()
+        engine.on_closed = self.on_engine_target_closed
+        subscribe = self.detection_mode == "event"
+        engine.add_target(self, self.pacer, subscribe=subscribe)
+        if engine.is_event_driven(self.wechat_hwnd):
+            print(f"已启用事件驱动检测（兜底轮询间隔 {self.event_fallback_interval} 秒）")
+        elif subscribe:
+            print("结构变化事件订阅失败，回退到轮询模式")
+        self.engine = engine
+        self.is_monitoring = True
+        engine.start()
+    
+    def on_engine_target_closed(self, target):
+        """异步引擎发现微信窗口已关闭（在事件循环线程中调用）"""
+        if target.detector is not self:
+            return
+        print("微信窗口已关闭，停止监控")
+        self.is_monitoring = False
+        # engine.stop() 要等事件循环线程退出，在事件循环线程中调用会卡住，交给另一个线程停止
+        threading.Thread(target=self.stop_closed_engine, args=(self.engine,), daemon=True).start()
+
+    def stop_closed_engine(self, engine: AsyncEngine):
+        """停止窗口已关闭的引擎（用户已经停止或重新开始了监控时不再处理）"""
+        if engine is not None and self.engine is engine:
+            self.stop_monitoring()
+    
+    def setup_event_source(self) -> bool:
+        """订阅聊天区域的结构变化事件，失败时回退到轮询模式"""
+        if self.detection_mode != "event":
+            return False
+        if not self.chat_area_element or not self.uia:
+            print("聊天区域不可用，使用轮询模式检测消息")
+            return False
+        
+        if self.event_source is None:
+            self.event_source = self.backend.create_event_source(self.uia)
+        
+        if self.event_source is None or not self.event_source.start(self.chat_area_element):
+            print("结构变化事件订阅失败，回退到轮询模式")
+            self.event_source = None
+            return False
+        
+        print(f"已启用事件驱动检测（兜底轮询间隔 {self.event_fallback_interval} 秒）")
+        return True
+    
+    def make_pacer(self) -> AdaptiveInterval:
+        """按当前配置创建自适应检测间隔"""
+        return AdaptiveInterval(min_interval=self.check_interval,
+                                max_interval=max(self.check_interval, self.max_check_interval))
+    
+    def window_title_changed(self) -> bool:
+        """窗口标题是否变化（只读取窗口标题，不访问元素树，开销很小）"""
+        if not self.wechat_window:
+            return False
+        try:
+            return self.wechat_window.title != self.last_window_title
+        except Exception:
+            return False
+    
+    def wait_for_next_check(self):
+        """等待下一次检测时机
+        
+        等待时长由自适应间隔决定；事件模式下收到结构变化通知立即返回，
+        兜底轮询不超过 event_fallback_interval。等待期间每隔 title_check_interval
+        检查一次窗口标题，标题出现未读数等变化时立即检测。
+        """
+        # 取一次引用，stop_monitoring 可能在其他线程中清除 self.event_source
+        source = self.event_source
+        event_driven = bool(source and source.is_active)
+        
+        wait_time = self.pacer.interval
+        if event_driven:
+            wait_time = min(wait_time, self.event_fallback_interval)
+        deadline = self.last_check_time + wait_time
+        
+        while self.is_monitoring:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return
+            step = min(timeout, self.title_check_interval)
+            if event_driven:
+                changes = source.wait_for_change(step)
+                if changes:
+                    self.note_change(changes[0].timestamp)
+                    return
+                if not source.is_active:
+                    return
+            else:
+                time.sleep(step)
+            if self.window_title_changed():
+                return
+    
     def start_monitoring(self):
         """开始监控"""
         if self.is_monitoring:
@@ -579,36 +1383,210 @@ class WeChatAutoEmoji:
             # 查找聊天区域
             self.find_chat_area(root_element)
         
-        # 设置表情包位置
-        if not self.setup_emoji_positions():
+        # 设置表情包位置（优先加载保存的配置）
+        if not self.ensure_calibration():
             print("表情包位置设置失败")
             return
+        self.load_selection_state()
         
         # 初始化消息检测状态
-        self.last_message_count = self.get_message_count()
+        self.reset_detection_baseline()
+        self.pacer = self.make_pacer()
+        
+        if self.engine_mode == "async":
+            self.start_engine()
+            print("监控已启动！")
+            return
+        
+        # 订阅结构变化事件（失败时自动使用轮询）
+        self.setup_event_source()
+        
+        # 启动发送队列和监控
+        self.action_queue = self.make_action_queue()
+        self.action_queue.start()
+        self.is_monitoring = True
+        self.monitoring_thread = threading.Thread(target=self.monitoring_loop, name='monitor', daemon=True)
+        self.monitoring_thread.start()
+        
+        print("监控已启动！")
+    
+    def reset_detection_baseline(self):
+        """以当前聊天区域的状态作为消息检测的基线"""
+        snapshot = self.take_snapshot()
+        self.last_message_count = self.get_message_count(snapshot)
         print(f"初始消息数量: {self.last_message_count}")
         
+        # 没有快照时截取一帧作为像素变化检测的基线
+        if snapshot is None:
+            if self.pixel_detector is not None:
+                self.pixel_detector.reset()
+            self.detect_by_pixels()
+        
         # 初始化消息签名检测
-        if self.chat_area_element and self.uia and HAS_UIA:
-            self.last_message_hash = self.get_latest_message_signature()
-            self.last_message_elements = self.get_message_signatures()[-self.message_history_size:]
+        if snapshot is not None:
+            self.last_message_hash = self.get_latest_message_signature(snapshot)
+            self.last_message_elements.replace(self.get_message_signatures(snapshot))
             print(f"初始化消息签名检测，当前签名: {self.last_message_hash}")
             print(f"初始化消息历史，共 {len(self.last_message_elements)} 条记录")
         
-        self.last_check_time = time.time()
+        if self.wechat_window:
+            self.last_window_title = self.wechat_window.title
+        self.last_check_time = self.backend.now()
+    
+    def attach_window(self, window) -> bool:
+        """直接监控指定的聊天窗口（多聊天监控时每个聊天窗口一个检测器）"""
+        try:
+            self.wechat_window = window
+            self.wechat_hwnd = window._hWnd
+            
+            root_element = self.get_wechat_automation_element()
+            if root_element:
+                self.find_chat_area(root_element)
+            
+            self.reset_detection_baseline()
+            return True
+            
+        except Exception as e:
+            print(f"附加聊天窗口时出错: {e}")
+            return False
+    
+    def pixel_fallback_region(self) -> Optional[Tuple[int, int, int, int]]:
+        """像素变化检测截取的区域 (left, top, right, bottom)
         
-        # 启动监控
-        self.is_monitoring = True
-        self.monitoring_thread = threading.Thread(target=self.monitoring_loop, daemon=True)
-        self.monitoring_thread.start()
+        有聊天区域元素时用它的位置；否则按表情包按钮推算：聊天记录在按钮所在的工具栏上方，
+        左边与按钮对齐，上面是标题栏。
+        """
+        rect = self.get_chat_area_rect()
+        if rect:
+            return rect
+        window = self.wechat_window
+        if not (window and self.emoji_button_pos):
+            return None
+        left = self.emoji_button_pos.x - 20
+        top = window.top + 60
+        right = window.left + window.width - 10
+        bottom = self.emoji_button_pos.y - 20
+        if right - left < 100 or bottom - top < 100:
+            return None
+        return (left, top, right, bottom)
+    
+    def detect_by_pixels(self) -> bool:
+        """截取聊天区域与上一帧比较，底部左侧出现新气泡时返回 True（第一帧只作为基线）"""
+        if not self.pixel_fallback:
+            return False
+        region = self.pixel_fallback_region()
+        if region is None:
+            return False
+        left, top, right, bottom = region
+        width, height = right - left, bottom - top
+        try:
+            capture = self.region_capture
+            if capture is None or (capture.width, capture.height) != (width, height):
+                # 区域大小变了（窗口改变大小），重新分配截图缓冲区
+                if capture is not None:
+                    capture.close()
+                capture = self.region_capture = self.backend.create_region_capture(width, height)
+                if capture is None:
+                    print("当前环境不支持截图，无法使用像素变化检测")
+                    self.pixel_fallback = False
+                    return False
+                self.pixel_detector = PixelChangeDetector(bgr=capture.bgr)
+            return self.pixel_detector.feed(capture.grab(left, top))
+        except Exception as e:
+            print(f"像素变化检测出错: {e}")
+            return False
+    
+    def get_chat_area_rect(self) -> Optional[Tuple[int, int, int, int]]:
+        """聊天区域的 (left, top, right, bottom)"""
+        try:
+            if self.chat_area_element:
+                rect = self.chat_area_element.CurrentBoundingRectangle
+                return (rect.left, rect.top, rect.right, rect.bottom)
+        except Exception as e:
+            print(f"获取聊天区域位置时出错: {e}")
+        return None
+    
+    def start_multi_monitoring(self):
+        """同时监控所有打开的聊天窗口（主窗口和弹出的独立聊天窗口）"""
+        if self.is_monitoring or self.scheduler:
+            print("已经在监控中...")
+            return
         
-        print("监控已启动！")
+        # 先在主窗口中设置表情包位置，其他窗口按聊天区域的位置换算
+        if not self.find_wechat_window():
+            return
+        root_element = self.get_wechat_automation_element()
+        if root_element:
+            self.find_chat_area(root_element)
+        if not (self.emoji_button_pos and self.emoji_panel_area):
+            if not self.ensure_calibration():
+                print("表情包位置设置失败")
+                return
+        self.load_selection_state()
+        
+        def make_detector():
+            detector = WeChatAutoEmoji(backend=self.backend, uia=self.uia)
+            detector.emoji_cooldown = self.emoji_cooldown
+            detector.click_delay = self.click_delay
+            detector.emoji_grid = self.emoji_grid
+            detector.panel_layout = self.panel_layout
+            detector.emoji_pages = self.emoji_pages
+            # 所有聊天共用一个选择引擎（各聊天的记录分开），由主检测器负责保存
+            detector.emoji_selector = self.emoji_selector
+            detector.selection_path = None
+            detector.send_mode = self.send_mode
+            detector.chat_send_modes = self.chat_send_modes
+            detector.sticker_dir = self.sticker_dir
+            detector.sticker_files = self.sticker_files
+            detector.sticker_library = self.sticker_library
+            detector.reply_rules = self.reply_rules
+            detector.payload_cache = self.payload_cache
+            detector.sticker_selector = self.sticker_selector
+            detector.trace_recorder = self.trace_recorder
+            # 所有聊天的检测和发送记入同一份运行指标
+            detector.metrics = self.metrics
+            detector.send_timings.histogram = self.metrics.send_step
+            # 独立聊天窗口的元素树结构与主窗口相同，沿主窗口的路径定位聊天区域
+            if self.chat_area_locator is not None:
+                detector.chat_area_locator = self.chat_area_locator.fork()
+            return detector
+        
+        if self.engine_mode == "async":
+            self.scheduler = self.make_engine(make_detector)
+        else:
+            self.scheduler = ChatScheduler(self.backend, self.uia, make_detector,
+                                           min_interval=self.check_interval,
+                                           action_queue=self.make_action_queue())
+        self.scheduler.discover(self.emoji_button_pos, self.emoji_panel_area,
+                                self.get_chat_area_rect())
+        if not self.scheduler.targets:
+            print("没有可以监控的聊天窗口")
+            self.scheduler = None
+            return
+        self.scheduler.start()
     
     def stop_monitoring(self):
         """停止监控"""
         self.is_monitoring = False
-        if self.monitoring_thread:
+        if self.engine:
+            # 取消所有协程，立即返回
+            self.engine.stop()
+            self.last_engine, self.engine = self.engine, None
+        if self.scheduler:
+            self.scheduler.stop()
+            if isinstance(self.scheduler, AsyncEngine):
+                self.last_engine = self.scheduler
+            self.scheduler = None
+        if self.event_source:
+            # 停止订阅同时会唤醒等待事件的监控线程
+            self.event_source.stop()
+            self.event_source = None
+        if self.monitoring_thread and self.monitoring_thread is not threading.current_thread():
             self.monitoring_thread.join(timeout=2)
+        if self.action_queue:
+            self.action_queue.stop()
+            self.action_queue = None
+        self.save_selection_state()
         print("监控已停止")
     
     def run(self):
@@ -631,13 +1609,22 @@ class WeChatAutoEmoji:
                 print("5. debug - 测试消息检测功能")
                 print("6. cooldown - 设置发送冷却时间")
                 print("7. status - 查看当前状态")
-                print("8. quit - 退出程序")
+                print("8. multi - 同时监控所有打开的聊天窗口")
+                print("9. mode - 设置发送方式（表情包面板/粘贴本地图片）")
+                print("10. record - 开始/停止录制聊天列表快照（用于离线回放）")
+                print("11. auto - 自动识别表情包位置（不用按热键）")
+                print("12. metrics - 开启/关闭运行指标（Prometheus 端点或定时写入JSON）")
+                print("13. profile - 采样分析监控和发送线程的耗时（输出火焰图文件）")
+                print("14. quit - 退出程序")
                 
                 command = input("\n请输入命令: ").strip().lower()
                 
                 if command == "start":
                     self.start_monitoring()
                     
+                elif command == "multi":
+                    self.start_multi_monitoring()
+                    
                 elif command == "stop":
                     self.stop_monitoring()
                     
@@ -649,7 +1636,18 @@ class WeChatAutoEmoji:
                         print("请先运行 start 命令设置位置")
                         
                 elif command == "setup":
-                    self.setup_emoji_positions()
+                    if not self.wechat_window:
+                        self.find_wechat_window()
+                    if self.setup_emoji_positions():
+                        self.save_calibration()
+                    
+                elif command == "auto":
+                    if not self.wechat_window:
+                        self.find_wechat_window()
+                    if self.auto_calibrator is None:
+                        print("自动识别需要安装 numpy，请使用 setup 命令设置")
+                    elif self.auto_calibrate():
+                        self.save_calibration()
                     
                 elif command == "debug":
                     self.test_message_detection()
@@ -664,22 +1662,113 @@ class WeChatAutoEmoji:
                     except ValueError:
                         print("请输入有效的数字")
                 
+                elif command == "mode":
+                    self.configure_send_mode()
+                
+                elif command == "record":
+                    self.toggle_trace_recording()
+                
+                elif command == "metrics":
+                    self.configure_metrics()
+                
+                elif command == "profile":
+                    self.profile_threads()
+                
                 elif command == "status":
                     print(f"\n=== 程序状态 ===")
-                    print(f"监控状态: {'运行中' if self.is_monitoring else '已停止'}")
+                    print(f"监控状态: {'运行中' if self.is_monitoring or self.scheduler else '已停止'}"
+                          f"（{'异步引擎' if self.engine_mode == 'async' else '监控线程'}）")
                     print(f"表情包按钮位置: {self.emoji_button_pos}")
                     print(f"表情包面板区域: {self.emoji_panel_area}")
-                    print(f"检测间隔: {self.check_interval} 秒")
+                    if self.emoji_grid:
+                        print(f"表情包面板网格: {self.emoji_grid.describe()}")
+                    if self.panel_layout:
+                        total = f"，共 {self.panel_layout.total(self.emoji_grid)} 个表情包" if self.emoji_grid else ""
+                        print(f"表情包面板: {self.panel_layout.describe()}{total}")
+                        for line in self.panel_layout.cost_model.describe():
+                            print(f"  {line}")
+                    print(f"发送方式: {'粘贴本地图片' if self.send_mode == 'paste' else '表情包面板'}")
+                    for chat, mode in self.chat_send_modes.items():
+                        print(f"  {chat}: {'粘贴本地图片' if mode == 'paste' else '表情包面板'}")
+                    if self.sticker_library is not None:
+                        print(f"本地表情包库: {self.sticker_library.describe()}（{self.sticker_dir}）")
+                    if self.sticker_files:
+                        print(f"本地图片: {len(self.sticker_files)} 张，{self.payload_cache.describe()}")
+                    if self.reply_rules is not None:
+                        print("回复规则:")
+                        for line in self.reply_rules.describe():
+                            print(f"  {line}")
+                    selector = self.emoji_selector
+                    print(f"表情包选择: 已选择 {selector.selections} 次，设置权重 {len(selector.weights)} 个，"
+                          f"最近 {selector.no_repeat} 次发过的不再选，记录 {len(selector.histories)} 个聊天")
+                    if ((self.event_source and self.event_source.is_active)
+                            or (self.engine and self.engine.is_event_driven(self.wechat_hwnd))):
+                        print(f"检测方式: 事件驱动（兜底轮询 {self.event_fallback_interval} 秒）")
+                    else:
+                        print("检测方式: 定时轮询")
+                    if self.is_monitoring:
+                        print(f"检测间隔: {self.pacer.describe()}")
+                    else:
+                        print(f"检测间隔: {self.check_interval} ~ {self.max_check_interval} 秒（自适应）")
                     print(f"冷却时间: {self.emoji_cooldown} 秒")
+                    if self.send_timings.sends:
+                        print(f"发送耗时（共 {self.send_timings.sends} 次）:")
+                        for line in self.send_timings.summary():
+                            print(f"  {line}")
+                    if self.tick_count:
+                        average_calls = self.com_calls_total / self.tick_count
+                        print(f"COM调用: 最近一次 {self.com_calls_last_tick} 次，平均每次检测 {average_calls:.1f} 次")
+                    
+                    queue = self.active_action_queue()
+                    if queue:
+                        print(f"回复策略: {queue.policy.describe()}")
+                        print(f"发送队列: 待发送 {queue.depth} 个，已发送 {queue.executed} 个，"
+                              f"合并 {queue.coalesced} 个，丢弃 {queue.dropped} 个")
+                    if self.scheduler:
+                        print(f"多聊天监控: {len(self.scheduler.targets)} 个聊天，"
+                              f"待发送 {self.scheduler.action_queue.depth} 个")
+                        for chat in self.scheduler.status():
+                            print(f"  {chat['title']}: 间隔 {chat['interval']:.2f} 秒，"
+                                  f"消息频率约 {chat['rate_per_minute']:.1f} 条/分钟，"
+                                  f"{'事件驱动' if chat['event_driven'] else '轮询'}，"
+                                  f"已检测 {chat['ticks']} 次，回复 {chat['detections']} 次")
+                    engine = self.engine or (self.scheduler if isinstance(self.scheduler, AsyncEngine) else None)
+                    if engine:
+                        print(engine.describe())
                     
                     cooldown_status = self.get_cooldown_status()
                     if cooldown_status['in_cooldown']:
                         print(f"冷却状态: 冷却中，剩余 {cooldown_status['remaining_time']:.1f} 秒")
                     else:
                         print("冷却状态: 未在冷却中")
+                    if self.trace_recorder is not None:
+                        print(f"快照录制: {self.trace_recorder.describe()}")
+                    if self.window_geometry is not None:
+                        print(self.window_geometry.describe())
+                    print(self.message_parser.describe())
+                    if self.chat_area_locator is not None:
+                        print(self.chat_area_locator.describe())
+                    if self.pixel_detector is not None:
+                        print(self.pixel_detector.describe())
+                    if self.auto_calibrator is not None:
+                        print(self.auto_calibrator.describe())
+                    for line in self.metrics.describe():
+                        print(line)
+                    if self.metrics_exporter is not None:
+                        print(f"运行指标导出: {self.metrics_exporter.describe()}")
                     
                 elif command == "quit":
                     self.stop_monitoring()
+                    if self.trace_recorder is not None:
+                        self.toggle_trace_recording()
+                    if self.window_geometry is not None:
+                        self.window_geometry.close()
+                    if self.region_capture is not None:
+                        self.region_capture.close()
+                    if self.auto_calibrator is not None:
+                        self.auto_calibrator.close()
+                    if self.metrics_exporter is not None:
+                        self.metrics_exporter.close()
                     print("程序已退出")
                     break
                     
@@ -693,88 +1782,58 @@ class WeChatAutoEmoji:
             except Exception as e:
                 print(f"程序运行时出错: {e}")
     
-    def get_message_signatures(self) -> List[str]:
-        """获取聊天区域中消息的特征签名列表"""
-        signatures = []
+    def window_center_x(self) -> Optional[int]:
+        """微信窗口中线的横坐标（使用窗口位置缓存，窗口移动或改变大小时才重新读取）"""
+        if not self.wechat_window:
+            return None
+        if self.window_geometry is None or self.window_geometry.window is not self.wechat_window:
+            if self.window_geometry is not None:
+                self.window_geometry.close()
+            self.window_geometry = WindowGeometry(self.backend, self.wechat_window, self.uia)
+        return self.window_geometry.center_x
+    
+    def message_records(self, snapshot: ChatSnapshot) -> List[MessageRecord]:
+        """快照中的消息记录（以窗口中线判断自己发送的消息）"""
+        return self.message_parser.records(snapshot, self.window_center_x())
+    
+    def latest_incoming_record(self, snapshot: Optional[ChatSnapshot]) -> Optional[MessageRecord]:
+        """快照中他人发送的最新一条消息，最后一条消息是自己发送的时返回None"""
+        if snapshot is None:
+            return None
+        for record in reversed(self.message_records(snapshot)):
+            if record.is_message:
+                return None if record.own else record
+        return None
+    
+    def get_message_signatures(self, snapshot: Optional[ChatSnapshot] = None) -> List[str]:
+        """获取聊天区域中消息的标识列表（与位置无关）"""
         try:
-            if self.chat_area_element and self.uia and HAS_UIA:
-                # 获取聊天区域的所有子元素
-                condition = self.uia.CreateTrueCondition()
-                children = self.chat_area_element.FindAll(UIAuto.TreeScope_Children, condition)
-                
-                for i in range(children.Length):
-                    try:
-                        child = children.GetElement(i)
-                        # 获取元素的文本内容、位置、类型等信息来生成签名
-                        name = getattr(child, 'CurrentName', '') or ''
-                        control_type = getattr(child, 'CurrentControlType', 0) or 0
-                        automation_id = getattr(child, 'CurrentAutomationId', '') or ''
-                        
-                        # 尝试获取元素的边界矩形
-                        try:
-                            rect = child.CurrentBoundingRectangle
-                            position = f"{rect.left},{rect.top},{rect.right},{rect.bottom}"
-                        except:
-                            position = ""
-                        
-                        # 生成消息签名（包含内容、类型、位置等信息）
-                        signature_data = f"{name}|{control_type}|{automation_id}|{position}"
-                        signature = hashlib.md5(signature_data.encode('utf-8')).hexdigest()[:12]
-                        signatures.append(signature)
-                        
-                    except Exception as e:
-                        # 忽略单个元素的错误，继续处理其他元素
-                        continue
+            if self.chat_area_element and self.uia:
+                snapshot = snapshot or self.take_snapshot()
+                if snapshot is not None:
+                    return [record.identity for record in self.message_records(snapshot)]
                         
         except Exception as e:
-            print(f"获取消息签名时出错: {e}")
+            print(f"获取消息标识时出错: {e}")
             
-        return signatures
+        return []
     
-    def get_latest_message_signature(self) -> Optional[str]:
-        """获取最新消息的签名，同时检查是否是自己发送的消息"""
+    def get_latest_message_signature(self, snapshot: Optional[ChatSnapshot] = None) -> Optional[str]:
+        """获取最新消息的标识，同时检查是否是自己发送的消息"""
         try:
-            if self.chat_area_element and self.uia and HAS_UIA:
-                # 获取聊天区域的子元素
-                condition = self.uia.CreateTrueCondition()
-                children = self.chat_area_element.FindAll(UIAuto.TreeScope_Children, condition)
+            if self.chat_area_element and self.uia:
+                snapshot = snapshot or self.take_snapshot()
                 
-                if children.Length > 0:
-                    # 获取最后一个元素（通常是最新的消息）
-                    latest_child = children.GetElement(children.Length - 1)
-                    
-                    # 检查是否是自己发送的消息
-                    if self.is_own_message(latest_child):
+                if snapshot is not None:
+                    records = [record for record in self.message_records(snapshot) if record.is_message]
+                    if records:
                         # 如果是自己发送的消息，返回特殊标记
-                        return "OWN_MESSAGE"
-                    
-                    # 获取详细信息
-                    name = getattr(latest_child, 'CurrentName', '') or ''
-                    control_type = getattr(latest_child, 'CurrentControlType', 0) or 0
-                    automation_id = getattr(latest_child, 'CurrentAutomationId', '') or ''
-                    
-                    # 尝试获取更多子元素的信息（消息可能包含多个子元素）
-                    sub_condition = self.uia.CreateTrueCondition()
-                    sub_children = latest_child.FindAll(UIAuto.TreeScope_Subtree, sub_condition)
-                    sub_content = []
-                    
-                    for j in range(min(sub_children.Length, 10)):  # 限制子元素数量
-                        try:
-                            sub_child = sub_children.GetElement(j)
-                            sub_name = getattr(sub_child, 'CurrentName', '') or ''
-                            if sub_name and len(sub_name.strip()) > 0:
-                                sub_content.append(sub_name.strip())
-                        except:
-                            continue
-                    
-                    # 组合所有信息生成签名
-                    full_content = f"{name}|{control_type}|{automation_id}|{'|'.join(sub_content)}"
-                    signature = hashlib.md5(full_content.encode('utf-8')).hexdigest()
-                    
-                    return signature
+                        if records[-1].own:
+                            return "OWN_MESSAGE"
+                        return records[-1].identity
                     
         except Exception as e:
-            print(f"获取最新消息签名时出错: {e}")
+            print(f"获取最新消息标识时出错: {e}")
             
         return None
 
@@ -800,10 +1859,11 @@ class WeChatAutoEmoji:
         print("找到聊天区域，开始测试...")
         
         # 初始化检测状态
-        self.last_message_hash = self.get_latest_message_signature()
-        self.last_message_elements = self.get_message_signatures()
-        self.last_message_count = self.get_message_count()
-        self.last_check_time = time.time()
+        snapshot = self.take_snapshot()
+        self.last_message_hash = self.get_latest_message_signature(snapshot)
+        self.last_message_elements.replace(self.get_message_signatures(snapshot))
+        self.last_message_count = self.get_message_count(snapshot)
+        self.last_check_time = self.backend.now()
         
         print(f"初始状态:")
         print(f"  消息数量: {self.last_message_count}")
@@ -817,9 +1877,11 @@ class WeChatAutoEmoji:
             while True:
                 if self.detect_new_message():
                     print("✓ 检测到新消息！")
-                    print(f"  当前消息数量: {self.get_message_count()}")
-                    print(f"  当前最新签名: {self.get_latest_message_signature()}")
-                    print(f"  当前历史数量: {len(self.get_message_signatures())}")
+                    snapshot = self.take_snapshot()
+                    print(f"  当前消息数量: {self.get_message_count(snapshot)}")
+                    print(f"  当前最新签名: {self.get_latest_message_signature(snapshot)}")
+                    print(f"  当前历史数量: {len(self.get_message_signatures(snapshot))}")
+                    print(f"  本次检测COM调用: {self.com_calls_last_tick} 次")
                     print("-" * 40)
                 
                 time.sleep(0.5)
@@ -827,51 +1889,138 @@ class WeChatAutoEmoji:
         except KeyboardInterrupt:
             print("\n测试结束")
     
-    def is_own_message(self, message_element) -> bool:
-        """判断是否是自己发送的消息"""
+    def is_own_message(self, message_element: SnapshotElement) -> bool:
+        """判断是否是自己发送的消息（读取快照中已缓存的子元素）"""
         try:
             if not message_element:
                 return False
             
-            # 获取消息元素的详细信息
-            name = getattr(message_element, 'CurrentName', '') or ''
-            automation_id = getattr(message_element, 'CurrentAutomationId', '') or ''
-            
-            # 尝试获取消息的子元素，查找发送者信息
-            sub_condition = self.uia.CreateTrueCondition()
-            sub_children = message_element.FindAll(UIAuto.TreeScope_Children, sub_condition)
-            
-            for i in range(sub_children.Length):
-                try:
-                    sub_child = sub_children.GetElement(i)
-                    sub_name = getattr(sub_child, 'CurrentName', '') or ''
-                    sub_class = getattr(sub_child, 'CurrentClassName', '') or ''
-                    
-                    # 检查是否包含自己发送消息的特征
-                    # 微信中自己发送的消息通常在右侧，可能有特定的类名或属性
-                    if 'right' in sub_class.lower() or 'self' in sub_class.lower():
-                        return True
-                    
-                    # 检查消息的位置信息
-                    try:
-                        rect = sub_child.CurrentBoundingRectangle
-                        # 如果消息位置偏右，可能是自己发送的
-                        if hasattr(self, 'wechat_window') and self.wechat_window:
-                            window_center = self.wechat_window.left + self.wechat_window.width // 2
-                            if rect.left > window_center:
-                                return True
-                    except:
-                        pass
-                        
-                except:
-                    continue
-            
-            return False
+            # 微信中自己发送的消息在右侧，气泡的类名可能带有 right/self
+            return self.message_parser.is_own(message_element, self.window_center_x())
             
         except Exception as e:
             print(f"判断消息来源时出错: {e}")
             return False
 
+    def record_trace_snapshot(self, snapshot: ChatSnapshot, baseline: bool = False):
+        """把快照写入正在录制的轨迹文件"""
+        window = self.wechat_window
+        self.trace_recorder.record_snapshot(
+            snapshot, str(self.wechat_hwnd), window.title if window else '',
+            (window.left, window.top, window.width, window.height) if window else None, baseline)
+    
+    def set_trace_recorder(self, recorder: Optional[TraceRecorder]):
+        """设置快照录制，多聊天监控时所有聊天的检测器写入同一个轨迹文件
+        
+        开始录制时先写入每个检测器最近一次读取的快照作为基线帧，
+        回放时以它为基线，录制开始后的第一次检测不会被当作基线用掉
+        """
+        detectors = [self]
+        if self.scheduler:
+            detectors += [target.detector for target in self.scheduler.targets.values()]
+        for detector in detectors:
+            detector.trace_recorder = recorder
+            if recorder is not None and detector.last_snapshot is not None:
+                detector.record_trace_snapshot(detector.last_snapshot, baseline=True)
+    
+    def toggle_trace_recording(self, path: Optional[str] = None):
+        """开始或停止录制聊天列表快照，录制的轨迹可以用 replay_trace.py 离线回放"""
+        if self.trace_recorder is not None:
+            recorder = self.trace_recorder
+            self.set_trace_recorder(None)
+            recorder.close()
+            print(f"已停止录制: {recorder.describe()}")
+            return
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                time.strftime("trace_%Y%m%d_%H%M%S.wxtrace"))
+        try:
+            recorder = TraceRecorder(path)
+        except OSError as e:
+            print(f"无法创建轨迹文件 {path}: {e}")
+            return
+        self.set_trace_recorder(recorder)
+        print(f"开始录制聊天列表快照到 {path}，再次输入 record 停止录制")
+    
+    def configure_send_mode(self):
+        """交互式设置发送方式：默认方式或某个聊天单独的方式"""
+        print(f"当前发送方式: {'粘贴本地图片' if self.send_mode == 'paste' else '表情包面板'}")
+        if self.sticker_dir:
+            print(f"本地图片目录: {self.sticker_dir}（{len(self.sticker_files)} 张）")
+        directory = input("本地图片目录（按Enter保持当前设置）: ").strip()
+        if directory:
+            self.load_sticker_dir(directory)
+        mode = input("发送方式 panel/paste（按Enter保持当前设置）: ").strip().lower()
+        if not mode:
+            return
+        if mode not in ("panel", "paste"):
+            print("请输入 panel 或 paste")
+            return
+        if mode == "paste" and not self.sticker_files:
+            print("请先设置本地图片目录")
+            return
+        chat = input("只用于哪个聊天（输入聊天名称，按Enter用于所有聊天）: ").strip()
+        if chat:
+            self.chat_send_modes[chat] = mode
+            print(f"聊天 {chat} 的发送方式已设置为 {mode}")
+        else:
+            self.send_mode = mode
+            print(f"发送方式已设置为 {mode}")
+    
+    def configure_metrics(self):
+        """开启运行指标并选择导出方式（本机 Prometheus 端点或定时写入JSON文件），已开启时关闭"""
+        if self.metrics.enabled:
+            self.metrics.disable()
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.close()
+                self.metrics_exporter = None
+            print("运行指标已关闭")
+            return
+        choice = input(f"输入端口号提供 Prometheus 端点，或输入 .json 文件名定时写入"
+                       f"（按Enter使用端口 {self.metrics_port}）: ").strip()
+        try:
+            if choice.lower().endswith('.json'):
+                self.metrics_exporter = JsonDumper(self.metrics, choice, self.metrics_interval)
+            else:
+                self.metrics_exporter = MetricsServer(self.metrics, int(choice) if choice else self.metrics_port)
+        except ValueError:
+            print("请输入端口号或 .json 文件名")
+            return
+        except OSError as e:
+            print(f"无法开启运行指标导出: {e}")
+            return
+        self.metrics.enable()
+        print(f"运行指标已开启: {self.metrics_exporter.describe()}")
+    
+    def profile_threads(self, seconds: Optional[float] = None, path: Optional[str] = None):
+        """采样监控和发送线程一段时间，写出折叠栈文件（火焰图格式）并列出自身时间最多的函数"""
+        if not (self.is_monitoring or self.scheduler):
+            print("请先用 start 或 multi 命令开始监控，再采样分析")
+            return
+        if seconds is None:
+            try:
+                value = input(f"采样多少秒（按Enter使用 {self.profile_seconds:g} 秒）: ").strip()
+                seconds = float(value) if value else self.profile_seconds
+            except ValueError:
+                print("请输入有效的数字")
+                return
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                time.strftime("profile_%Y%m%d_%H%M%S.folded"))
+        profiler = SamplingProfiler(interval=self.profile_interval)
+        profiler.start()
+        print(f"正在采样 {seconds:g} 秒（按 Ctrl+C 提前结束）...")
+        try:
+            time.sleep(seconds)
+        except KeyboardInterrupt:
+            print("已提前结束采样")
+        finally:
+            profiler.stop()
+        for line in profiler.summary():
+            print(line)
+        if profiler.samples and profiler.write(path):
+            print(f"折叠栈已写入 {path}（可用 flamegraph.pl 或 speedscope 生成火焰图）")
+    
     def set_cooldown_time(self, seconds: float):
         """设置表情包发送后的冷却时间"""
         if seconds >= 0:
@@ -900,11 +2049,7 @@ class WeChatAutoEmoji:
 def main():
     """主函数"""
     try:
-        # 设置pyautogui的安全设置
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.1
-        
-        # 创建并运行程序
+        # 创建并运行程序（pyautogui 的安全设置在Windows后端首次使用时完成）
         app = WeChatAutoEmoji()
         app.run()
         
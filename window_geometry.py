@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+窗口位置缓存
+功能：缓存微信窗口的位置和大小，只在窗口移动或改变大小的通知到来时重新读取，
+      每次检测判断消息来源时不用再向系统查询窗口位置；后端不支持通知时按时间过期后重新读取
+"""
+
+import time
+from typing import Optional, Tuple
+
+
+class WindowGeometry:
+    """一个窗口的位置缓存 (left, top, width, height)"""
+
+    def __init__(self, backend, window, uia=None, max_age: float = 2.0):
+        self.window = window
+        self.max_age = max_age  # 没有移动通知时缓存的有效期（秒）
+        self._rect: Optional[Tuple[int, int, int, int]] = None
+        self._read_at = 0.0
+        self.reads = 0
+        self.invalidations = 0
+        # 订阅窗口移动和改变大小的通知，返回取消订阅的函数；不支持时为 None
+        self._unsubscribe = backend.watch_window_geometry(uia, window, self.invalidate)
+
+    @property
+    def watched(self) -> bool:
+        return self._unsubscribe is not None
+
+    def invalidate(self):
+        """窗口移动或改变了大小（可在任意线程调用）"""
+        self._rect = None
+        self.invalidations += 1
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        rect = self._rect
+        if rect is None or (not self.watched and time.monotonic() - self._read_at >= self.max_age):
+            window = self.window
+            rect = (window.left, window.top, window.width, window.height)
+            self._rect = rect
+            self._read_at = time.monotonic()
+            self.reads += 1
+        return rect
+
+    @property
+    def center_x(self) -> int:
+        left, _, width, _ = self.rect
+        return left + width // 2
+
+    def close(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    def describe(self) -> str:
+        mode = "窗口移动时更新" if self.watched else f"每 {self.max_age:g} 秒重新读取"
+        return f"窗口位置缓存（{mode}）: 读取 {self.reads} 次，收到移动通知 {self.invalidations} 次"